@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.py benchmarks
+--------------------
+
+Measures muddle's throughput, latency and memory against a local stand-in
+for Moodle's REST server. Run with::
+
+    python -m benchmarks --help
+"""
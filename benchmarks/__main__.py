@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.__main__
+-------------------
+
+Runs each scenario against a local :mod:`benchmarks.server` at several
+concurrency levels, and writes the results as JSON::
+
+    python -m benchmarks --concurrency 1,8,32 --latency 0.005 -o out.json
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+import muddle
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Single call scenarios, each timed per call. Calls return decoded JSON so
+# the client's parsing cost is counted too.
+
+
+def course_create(moodle, n):
+    return moodle.course().create('Course %d' % n, 'bench%d' % n, 1).json()
+
+
+def course_contents(moodle, n):
+    return moodle.course(n).contents()
+
+
+def course_contents_typed(moodle, n):
+    return moodle.course(n).contents(typed=True)
+
+
+def category_details(moodle, n):
+    return moodle.category(n % 100 + 1).details().json()
+
+
+SINGLE = {
+    'course.create': course_create,
+    'course.contents': course_contents,
+    'course.contents.typed': course_contents_typed,
+    'category.details': category_details,
+}
+
+# Bulk scenarios, timed per HTTP request. They make their own calls
+# concurrently, so are given the concurrency level as workers, and return
+# how many items they handled and how many of those failed.
+
+
+def courses_create_many(moodle, calls, workers):
+    courses = [{'fullname': 'Course %d' % n, 'shortname': 'bulk%d' % n,
+                'categoryid': 1} for n in range(calls * 10)]
+    return _tally(result.ok
+                  for result in moodle.course().create_many(courses, 10))
+
+
+def courses_delete_many(moodle, calls, workers):
+    results = moodle.course().delete_many(range(1, calls * 10 + 1), 10,
+                                          workers=workers)
+    return _tally(result.ok for result in results)
+
+
+def courses_contents_fanout(moodle, calls, workers):
+    results = moodle.courses_contents(range(1, calls + 1), workers=workers,
+                                      return_exceptions=True)
+    return _tally(not isinstance(contents, Exception)
+                  for course_id, contents in results)
+
+
+def _tally(outcomes):
+    items = errors = 0
+    for ok in outcomes:
+        items += 1
+        errors += not ok
+    return items, errors
+
+
+BULK = {
+    'course.create_many': courses_create_many,
+    'course.delete_many': courses_delete_many,
+    'courses_contents': courses_contents_fanout,
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def run_single(moodle, func, calls, concurrency):
+    latencies = []
+    lock = threading.Lock()
+    errors = [0]
+
+    def call(n):
+        start = time.perf_counter()
+        try:
+            func(moodle, n)
+        except Exception:
+            with lock:
+                errors[0] += 1
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, range(1, calls + 1)))
+    return calls, latencies, errors[0]
+
+
+def run_bulk(moodle, func, calls, concurrency):
+    latencies = []
+    lock = threading.Lock()
+
+    def record(wsfunction, response, elapsed, error):
+        if response is not None:
+            with lock:
+                latencies.append(elapsed)
+
+    moodle.metrics.add_hook('after', record)
+    try:
+        items, errors = func(moodle, calls, concurrency)
+    finally:
+        moodle.metrics.remove_hook('after', record)
+    return items, latencies, errors
+
+
+def measure(moodle, name, calls, concurrency, memory):
+    if name in SINGLE:
+        runner, func = run_single, SINGLE[name]
+    else:
+        runner, func = run_bulk, BULK[name]
+
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        items, latencies, errors = runner(moodle, func, calls, concurrency)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+    finally:
+        if memory:
+            tracemalloc.stop()
+
+    return {
+        'scenario': name,
+        'concurrency': concurrency,
+        'items': items,
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 4),
+        'requests_per_second': round(len(latencies) / elapsed, 2),
+        'items_per_second': round(items / elapsed, 2),
+        'latency_p50_ms': _ms(percentile(latencies, 50)),
+        'latency_p99_ms': _ms(percentile(latencies, 99)),
+        'peak_memory_kb': peak // 1024 if memory else None,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def start_server(args):
+    """ Starts benchmarks.server in its own process, returning it and URL """
+
+    command = [sys.executable, '-m', 'benchmarks.server',
+               '--latency', str(args.latency),
+               '--jitter', str(args.jitter),
+               '--error-rate', str(args.error_rate),
+               '--sections', str(args.sections),
+               '--modules', str(args.modules)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                               universal_newlines=True)
+    return process, process.stdout.readline().strip()
+
+
+def main(argv=None):
+    scenarios = list(SINGLE) + list(BULK)
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Benchmark muddle against a local stand-in Moodle server')
+    parser.add_argument('--scenarios', default=','.join(scenarios),
+                        help='comma separated, from: ' + ', '.join(scenarios))
+    parser.add_argument('--concurrency', default='1,4,16',
+                        help='comma separated concurrency levels')
+    parser.add_argument('--calls', type=int, default=200,
+                        help='calls per scenario and concurrency level')
+    parser.add_argument('--memory', action='store_true',
+                        help='trace peak memory (slows the client down)')
+    parser.add_argument('--compress', action='store_true',
+                        help='gzip large request bodies')
+    parser.add_argument('--transport', default='requests',
+                        help='HTTP backend: requests or urllib3')
+    parser.add_argument('--url', help='benchmark an already running server '
+                        'instead of starting one')
+    parser.add_argument('-o', '--output', help='file to write the JSON '
+                        'results to, instead of stdout')
+    server = parser.add_argument_group('server options')
+    server.add_argument('--latency', type=float, default=0.0)
+    server.add_argument('--jitter', type=float, default=0.0)
+    server.add_argument('--error-rate', type=float, default=0.0)
+    server.add_argument('--sections', type=int, default=10)
+    server.add_argument('--modules', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    names = args.scenarios.split(',')
+    unknown = set(names) - set(scenarios)
+    if unknown:
+        parser.error('unknown scenario(s): ' + ', '.join(sorted(unknown)))
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    process, url = None, args.url
+    if url is None:
+        process, url = start_server(args)
+    results = []
+    try:
+        for concurrency in levels:
+            moodle = muddle.authenticate('bench', url,
+                                         pool_maxsize=concurrency,
+                                         compress=args.compress,
+                                         transport=args.transport,
+                                         metrics=muddle.Metrics())
+            with moodle:
+                for name in names:
+                    results.append(measure(moodle, name, args.calls,
+                                           concurrency, args.memory))
+                    print('{scenario} x{concurrency}: {requests_per_second} '
+                          'req/s, p50 {latency_p50_ms} ms, p99 '
+                          '{latency_p99_ms} ms'.format(**results[-1]),
+                          file=sys.stderr)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'transport': args.transport,
+        'compress': args.compress,
+        'server': {'url': args.url, 'latency': args.latency,
+                   'jitter': args.jitter, 'error_rate': args.error_rate,
+                   'sections': args.sections, 'modules': args.modules},
+        'max_rss_kb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                       if resource else None),
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks.server
+-----------------
+
+A local stand-in for /webservice/rest/server.php, with configurable
+latency, payload sizes and error rates.
+"""
+
+import argparse
+import gzip
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from itertools import count
+import json
+import random
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+from muddle.api import MOODLE_WS_ENDPOINT
+
+
+class MockMoodle():
+    """
+    Serves canned web service responses on a local port
+
+    Example Usage::
+
+    >>> with MockMoodle(latency=0.01, sections=20) as server:
+    ...     moodle = muddle.authenticate('token', server.url)
+
+    :param float latency: (optional) Seconds each call takes
+    :param float jitter: (optional) Random extra seconds, up to this much
+    :param float error_rate: (optional) Fraction of calls answered with \
+        a 503, to exercise failure handling
+    :param int sections: (optional) Sections per course contents response
+    :param int modules: (optional) Modules per section
+    :param int categories: (optional) Categories on the site
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0,
+                 sections=10, modules=10, categories=100):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = 0
+        self._ids = count(1000)
+        self._lock = threading.Lock()
+        self._contents = json.dumps(_contents(sections, modules)).encode()
+        self._categories = _categories(categories)
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), _handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self._httpd.server_port)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def respond(self, params):
+        """ Returns (status, body) for a call """
+
+        with self._lock:
+            self.calls += 1
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            return 503, b'Service Unavailable'
+
+        wsfunction = params.get('wsfunction')
+        if wsfunction == 'core_course_get_contents':
+            return 200, self._contents
+        return 200, json.dumps(self._call(wsfunction, params)).encode()
+
+    def _call(self, wsfunction, params):
+        if wsfunction == 'core_course_create_courses':
+            return [{'id': next(self._ids), 'shortname': val}
+                    for key, val in sorted(params.items())
+                    if key.endswith('[shortname]')]
+        if wsfunction == 'core_course_get_categories':
+            category_id = params.get('criteria[0][value]')
+            if category_id is None:
+                return self._categories
+            return [category for category in self._categories
+                    if category['id'] == int(category_id)]
+        if wsfunction == 'core_course_delete_courses':
+            return {'warnings': []}
+        if wsfunction == 'core_course_duplicate_course':
+            return {'id': next(self._ids), 'shortname': params['shortname']}
+        return None
+
+
+def _handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Send headers and body together, so timings aren't skewed by
+        # delayed ACKs between two small writes.
+        disable_nagle_algorithm = True
+        wbufsize = -1
+
+        def do_GET(self):
+            self._respond()
+
+        def do_POST(self):
+            self._respond()
+
+        def _respond(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                body = self.rfile.read(length)
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                params.update(parse_qs(body.decode()))
+
+            if url.path != MOODLE_WS_ENDPOINT:
+                status, body = 404, b'Not Found'
+            else:
+                status, body = server.respond(
+                    dict((key, val[0]) for key, val in params.items()))
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def _contents(sections, modules):
+    return [{'id': section, 'section': section, 'name': 'Topic %d' % section,
+             'visible': 1, 'summary': '', 'summaryformat': 1,
+             'modules': [{'id': section * modules + module,
+                          'url': 'http://moodle/mod/resource/view.php',
+                          'name': 'Resource %d' % module,
+                          'instance': module, 'visible': 1,
+                          'modicon': 'http://moodle/theme/image.php/icon',
+                          'modname': 'resource', 'modplural': 'Files',
+                          'indent': 0,
+                          'contents': [{'type': 'file',
+                                        'filename': 'file%d.pdf' % module,
+                                        'filepath': '/', 'filesize': 1024,
+                                        'fileurl': 'http://moodle/file.php',
+                                        'timecreated': 0,
+                                        'timemodified': 0,
+                                        'mimetype': 'application/pdf'}]}
+                         for module in range(modules)]}
+            for section in range(sections)]
+
+
+def _categories(total):
+    categories = []
+    for category_id in range(1, total + 1):
+        parent = category_id // 4
+        path = '/%d' % category_id
+        if parent:
+            path = categories[parent - 1]['path'] + path
+        categories.append({'id': category_id, 'name': 'Category %d' %
+                           category_id, 'idnumber': '', 'parent': parent,
+                           'sortorder': category_id, 'coursecount': 0,
+                           'visible': 1, 'depth': path.count('/'),
+                           'path': path, 'timemodified': 0})
+    return categories
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Serve a stand-in Moodle web service on a local port')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds each call takes')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='random extra seconds per call, up to this much')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of calls answered with a 503')
+    parser.add_argument('--sections', type=int, default=10,
+                        help='sections per course contents response')
+    parser.add_argument('--modules', type=int, default=10,
+                        help='modules per section')
+    parser.add_argument('--categories', type=int, default=100,
+                        help='categories on the site')
+    args = parser.parse_args(argv)
+
+    server = MockMoodle(args.latency, args.jitter, args.error_rate,
+                        args.sections, args.modules, args.categories)
+    # The first line out is the URL, for whoever started the server.
+    print(server.url, flush=True)
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
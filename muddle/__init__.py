@@ -17,4 +17,8 @@ __version__ = '0.1.0'
 
 # Module namespace.
 
-from .core import authenticate
+from .core import authenticate, authenticate_async
+from .cache import ResponseCache, DiskCache
+from .metrics import Metrics
+from .sites import Sites
+from .exceptions import MuddleError, MoodleError
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.aio
+----------
+
+asyncio client mirroring :mod:`muddle.api`. Requires aiohttp.
+"""
+
+import asyncio
+import ssl
+
+from .api import MOODLE_WS_ENDPOINT
+from .exceptions import MuddleError
+from .params import (create_course_params, delete_course_params,
+                     contents_params, duplicate_params, export_params,
+                     category_details_params, create_category_params,
+                     delete_category_params, update_category_params)
+
+DEFAULT_LIMIT = 100
+
+
+class AsyncMuddle():
+    """
+    The asyncio Muddle class
+
+    Endpoints are coroutines returning the decoded JSON response, rather
+    than the response objects returned by :class:`muddle.api.Muddle`.
+
+    Example Usage::
+
+    >>> import muddle
+    >>> moodle = await muddle.authenticate_async(API_KEY, API_URL)
+    >>> contents = await moodle.course(10).contents()
+    >>> await moodle.close()
+
+    :param int limit: (optional) Defaults to 100. Maximum number of calls \
+        in flight at once. Further calls wait for a free slot.
+    :param float timeout: (optional) Total seconds allowed per call. \
+        Defaults to no timeout.
+    :param verify: (optional) Defaults to False. Verify the server's TLS \
+        certificate, or path to a CA bundle to verify against
+    """
+
+    # Set by authenticate, and shared with the endpoints handed out.
+    _state = ('api_key', 'api_url', 'request_params', 'semaphore',
+              'session')
+
+    # The last client authenticated, used by endpoints created without one.
+    default = None
+
+    def __init__(self, limit=DEFAULT_LIMIT, timeout=None, verify=False):
+        self.limit = limit
+        self.timeout = timeout
+        self.verify = verify
+        self.api_key = None
+        self.api_url = None
+        self.request_params = None
+        self.semaphore = None
+        self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def authenticate(self, api_key, api_url):
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError('AsyncMuddle requires aiohttp, '
+                              'install it with: pip install muddle[async]')
+
+        if self.verify is True:
+            ssl_context = None
+        elif self.verify:
+            ssl_context = ssl.create_default_context(cafile=self.verify)
+        else:
+            ssl_context = False
+
+        self.api_key = api_key
+        self.api_url = api_url + MOODLE_WS_ENDPOINT
+        self.request_params = {'wstoken': api_key,
+                               'moodlewsrestformat': 'json'}
+        self.semaphore = asyncio.Semaphore(self.limit)
+
+        if self.session is not None:
+            await self.session.close()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.limit, ssl=ssl_context),
+            timeout=aiohttp.ClientTimeout(total=self.timeout))
+        AsyncMuddle.default = self
+
+    async def close(self):
+        """ Closes all pooled connections """
+
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _share(self, client):
+        """ Takes on client's site, connections and settings """
+
+        if client is None:
+            client = AsyncMuddle.default
+        if client is None:
+            raise MuddleError('Not authenticated, call '
+                              'muddle.authenticate_async first')
+        for name in self._state:
+            setattr(self, name, getattr(client, name))
+
+    async def _request(self, method, params):
+        """ Sends a web service request, waiting for a free slot """
+
+        params = dict(params, **self.request_params)
+        params = dict((key, str(val)) for key, val in params.items())
+        kwargs = self._encode(params)
+        async with self.semaphore:
+            async with self.session.request(method, self.api_url,
+                                            **kwargs) as response:
+                return await response.json(content_type=None)
+
+    def _encode(self, params):
+        """ Parameters go in a form-encoded body, never the query string """
+
+        return {'data': params}
+
+    def course(self, course_id=None):
+        return AsyncCourse(course_id, self)
+
+    def category(self, category_id=None):
+        return AsyncCategory(category_id, self)
+
+
+class AsyncCourse(AsyncMuddle):
+    """ Awaitable versions of the :class:`muddle.api.Course` endpoints """
+
+    def __init__(self, course_id=None, client=None):
+        self.course_id = course_id
+        self._share(client)
+
+    async def create(self, fullname, shortname, category_id, **kwargs):
+        """ Create a new course, see :meth:`muddle.api.Course.create` """
+
+        params = create_course_params(fullname, shortname, category_id,
+                                       kwargs)
+        return await self._request('post', params)
+
+    async def delete(self):
+        """ Deletes the course, see :meth:`muddle.api.Course.delete` """
+
+        return await self._request('post',
+                                   delete_course_params(self.course_id))
+
+    async def contents(self):
+        """ Returns entire contents of course page """
+
+        return await self._request('post', contents_params(self.course_id))
+
+    async def duplicate(self, fullname, shortname, categoryid,
+                        visible=True, **kwargs):
+        """
+        Duplicates the course, see :meth:`muddle.api.Course.duplicate`
+        """
+
+        params = duplicate_params(self.course_id, fullname, shortname,
+                                   categoryid, visible, kwargs)
+        return await self._request('post', params)
+
+    async def export_data(self, export_to, delete_content=False):
+        """
+        Export course data to another course,
+        see :meth:`muddle.api.Course.export_data`
+        """
+
+        params = export_params(self.course_id, export_to, delete_content)
+        return await self._request('post', params)
+
+
+class AsyncCategory(AsyncMuddle):
+    """ Awaitable versions of the :class:`muddle.api.Category` endpoints """
+
+    def __init__(self, category_id=None, client=None):
+        self.category_id = category_id
+        self._share(client)
+
+    async def details(self):
+        """ Returns details for the category """
+
+        params = category_details_params(self.category_id)
+        return await self._request('post', params)
+
+    async def create(self, category_name, **kwargs):
+        """ Create a new category, see :meth:`muddle.api.Category.create` """
+
+        params = create_category_params(category_name, kwargs)
+        return await self._request('post', params)
+
+    async def delete(self, new_parent=None, recursive=False):
+        """ Deletes the category, see :meth:`muddle.api.Category.delete` """
+
+        params = delete_category_params(self.category_id, new_parent,
+                                         recursive)
+        return await self._request('post', params)
+
+    async def update(self, **kwargs):
+        """ Update the category, see :meth:`muddle.api.Category.update` """
+
+        params = update_category_params(self.category_id, kwargs)
+        return await self._request('post', params)
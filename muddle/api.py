@@ -1,16 +1,141 @@
-import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import gzip
+from itertools import islice
+import time
+from urllib.parse import urlencode
+import weakref
+
+from .categories import CategoryTree
+from .courses import MAX_GAP, iter_courses
+from .cache import ResponseCache, site_tag
+from .batch import chunked, map_chunks, Result, DEFAULT_CHUNK_SIZE
+from .exceptions import (MuddleError, MoodleError, TransportError,
+                         is_moodle_error)
+from .jobs import JobQueue, DEFAULT_WORKERS as DEFAULT_JOB_WORKERS
+from .models import CourseContents
+from .plan import Plan
+from .singleflight import SingleFlight
+from .params import (create_course_params, delete_course_params,
+                     contents_params, duplicate_params, export_params,
+                     category_details_params, create_category_params,
+                     delete_category_params, update_category_params,
+                     CREATE_COURSES, DELETE_COURSES, CREATE_CATEGORIES,
+                     UPDATE_CATEGORIES, DELETE_CATEGORIES)
+from .subtree import SubtreeCopy, DEFAULT_WORKERS as DEFAULT_SUBTREE_WORKERS
+from .sync import ContentsSync, DEFAULT_WORKERS as DEFAULT_SYNC_WORKERS
+from .stream import iter_json_array, DEFAULT_CHUNK_SIZE as STREAM_CHUNK_SIZE
+from .transport import get_transport, DEFAULT_POOL_SIZE
 
 MOODLE_WS_ENDPOINT = '/webservice/rest/server.php'
 
+# Request bodies smaller than this aren't worth gzipping.
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
 
-def valid_options(kwargs, allowed_options):
-    """ Checks that kwargs are valid API options"""
+FORM_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
+GZIP_FORM_HEADERS = dict(FORM_HEADERS, **{'Content-Encoding': 'gzip'})
 
-    diff = set(kwargs) - set(allowed_options)
-    if diff:
-        print("Invalid option(s): ", ', '.join(diff))
+
+def _cacheable(response):
+    """ Only successful calls are worth caching """
+
+    if response.status_code != 200:
+        return False
+    try:
+        return not is_moodle_error(response.json())
+    except ValueError:
         return False
-    return True
+
+
+def _overloaded(response):
+    """ Whether a response shows the server struggling """
+
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def _created_ids(response):
+    """ Returns the ids from a create call's response, if it succeeded """
+
+    try:
+        data = response.json()
+    except ValueError:
+        return []
+    if is_moodle_error(data):
+        return []
+    return [created['id'] for created in data]
+
+
+def _levels(categories, results):
+    """
+    Groups categories to create into levels, parents before children
+
+    A parent given as an idnumber refers to another category in the call.
+    Categories whose parent is unknown, or nested in a loop, get a failed
+    result instead.
+
+    :returns: (levels, parents): lists of indexes into categories, and a \
+        dict of each category's index to its parent's, where the parent \
+        is in the call
+    """
+
+    by_idnumber = {}
+    for index, category in enumerate(categories):
+        if category.get('idnumber'):
+            by_idnumber.setdefault(category['idnumber'], index)
+
+    parents = {}
+    for index, category in enumerate(categories):
+        parent = category.get('parent')
+        if not isinstance(parent, str):
+            continue
+        if parent in by_idnumber:
+            parents[index] = by_idnumber[parent]
+        else:
+            results[index] = Result(category, error=ValueError(
+                'Unknown parent category: ' + parent))
+
+    depths = {}
+    for index in range(len(categories)):
+        path = []
+        node = index
+        while node not in depths and results[node] is None and \
+                node in parents and node not in path:
+            path.append(node)
+            node = parents[node]
+
+        if node in path:
+            error = ValueError('Categories nested in a loop')
+        elif results[node] is not None and node != index:
+            error = MuddleError('Parent category {} was not created'.format(
+                categories[path[-1]]['parent']))
+        else:
+            error = None
+        if error is not None:
+            for child in path:
+                results[child] = Result(categories[child], error=error)
+            continue
+
+        depth = depths.setdefault(node, 0)
+        for child in reversed(path):
+            depth += 1
+            depths[child] = depth
+
+    levels = []
+    for index in range(len(categories)):
+        if index in depths and results[index] is None:
+            while len(levels) <= depths[index]:
+                levels.append([])
+            levels[depths[index]].append(index)
+    return levels, parents
+
+
+def _course_tag(course_id):
+    return 'course:' + str(course_id)
+
+
+# Category details include subcategories and course counts, so any
+# category or course write invalidates all of them.
+CATEGORIES_TAG = 'categories'
 
 
 class Muddle():
@@ -22,26 +147,497 @@ class Muddle():
     >>> import muddle
     >>> course = muddle.course(int)
     <Response [200]>
+
+    Connections to the Moodle server are pooled and kept alive between
+    calls. Close the pool when finished, or use the client as a context
+    manager::
+
+    >>> with muddle.authenticate(API_KEY, API_URL) as moodle:
+    ...     moodle.course(10).contents()
+
+    :param int pool_connections: (optional) Number of host pools to cache
+    :param int pool_maxsize: (optional) Maximum number of connections \
+        kept open per host
+    :param bool pool_block: (optional) Defaults to False. Block when no \
+        pooled connection is free instead of opening an extra one
+    :param bool keep_alive: (optional) Defaults to True. Reuse connections \
+        between requests
+    :param timeout: (optional) Seconds to wait for the server, either a \
+        float or a (connect, read) tuple. Defaults to no timeout.
+    :param verify: (optional) Defaults to False. Verify the server's TLS \
+        certificate, or path to a CA bundle to verify against
+    :param cert: (optional) Client certificate file, or a (cert, key) tuple
+    :param cache: (optional) A :class:`muddle.cache.ResponseCache`, or a \
+        :class:`muddle.cache.DiskCache` to keep entries across runs, for \
+        read-only calls (course contents and category details). Writes \
+        through the client invalidate the entries they affect.
+    :param scheduler: (optional) A :class:`muddle.throttle.Scheduler` \
+        pacing every call to the server
+    :param metrics: (optional) A :class:`muddle.metrics.Metrics` recording \
+        every call, and calling its hooks
+    :param bool compress: (optional) Defaults to False. Gzip large \
+        request bodies. The web server must be set up to inflate them \
+        (e.g. Apache's ``SetInputFilter DEFLATE``); compressed responses \
+        are always accepted.
+    :param transport: (optional) HTTP backend: ``requests`` (the \
+        default), ``urllib3`` for a leaner pooled client, or a \
+        :class:`muddle.transport.Transport` such as \
+        :class:`muddle.transport.MemoryTransport` for tests
+    :param bool coalesce: (optional) Defaults to True. Identical read-only \
+        calls made while one is already in flight wait for it and share \
+        its response, rather than each calling the server
+    :param retry: (optional) A :class:`muddle.retry.Retry` resending \
+        read-only calls that fail in transit. Writes are never retried.
+    :param hedge: (optional) A :class:`muddle.retry.Hedge` sending a \
+        second copy of read-only calls that are slower than usual
     """
 
+    # Set by authenticate, and shared with the Course and Category
+    # endpoints the client hands out.
+    _state = ('api_key', 'api_url', 'request_params', 'transport', 'timeout',
+              'cache', 'scheduler', 'metrics', 'flights', 'compress',
+              'retry', 'hedge', 'trees')
+
+    # The last client authenticated, used by endpoints created without one.
+    default = None
+
+    def __init__(self, pool_connections=DEFAULT_POOL_SIZE,
+                 pool_maxsize=DEFAULT_POOL_SIZE, pool_block=False,
+                 keep_alive=True, timeout=None, verify=False, cert=None,
+                 cache=None, scheduler=None, metrics=None, coalesce=True,
+                 compress=False, transport=None, retry=None, hedge=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.verify = verify
+        self.cert = cert
+        self.cache = cache
+        self.scheduler = scheduler
+        self.metrics = metrics
+        self.coalesce = coalesce
+        self.compress = compress
+        self.retry = retry
+        self.hedge = hedge
+        self.backend = transport
+        self.api_key = None
+        self.api_url = None
+        self.request_params = None
+        self.flights = None
+        self.transport = None
+        self.trees = weakref.WeakSet()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
     def authenticate(self, api_key, api_url):
-        Muddle.api_key = api_key
-        Muddle.api_url = api_url + MOODLE_WS_ENDPOINT
-        Muddle.request_params = {'wstoken': api_key,
-                                 'moodlewsrestformat': 'json'}
+        self._connect(api_key, api_url)
+        Muddle.default = self
+
+    def _connect(self, api_key, api_url):
+        """ Sets the client up for a site, leaving the default client be """
+
+        self.api_key = api_key
+        self.api_url = api_url + MOODLE_WS_ENDPOINT
+        self.request_params = {'wstoken': api_key,
+                               'moodlewsrestformat': 'json'}
+        self.flights = SingleFlight() if self.coalesce else None
+
+        if self.transport is not None:
+            self.transport.close()
+        self.transport = get_transport(
+            self.backend, pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize, pool_block=self.pool_block,
+            keep_alive=self.keep_alive, verify=self.verify, cert=self.cert)
+
+    def close(self):
+        """ Closes all pooled connections """
+
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    def _share(self, client):
+        """ Takes on client's site, connections and settings """
+
+        if client is None:
+            client = Muddle.default
+        if client is None:
+            raise MuddleError('Not authenticated, call muddle.authenticate '
+                              'first')
+        for name in self._state:
+            setattr(self, name, getattr(client, name))
+
+    def _request(self, method, params, timeout=None, tags=None,
+                 stream=False):
+        """
+        Sends a web service request through the client's transport
+
+        :param tags: (optional) Marks the call as read-only, so its \
+            response may be cached under these invalidation tags
+        :param bool stream: (optional) Defer downloading the response \
+            body. Streamed responses are never cached.
+        """
+
+        read = tags is not None and not stream
+        cache = self.cache if read else None
+        flights = self.flights if read else None
+        if cache is not None or flights is not None:
+            key = ResponseCache.key(params, self.api_url)
+        if cache is not None:
+            response = cache.get(key)
+            if response is not None:
+                if self.metrics is not None:
+                    self.metrics.record_cache_hit(params.get('wsfunction'))
+                return response
+
+        if timeout is None:
+            timeout = self.timeout
+        safe = tags is not None
+        if flights is None:
+            response = self._attempt(method, params, timeout, stream, safe)
+        else:
+            # Identical reads already in flight share that call's response.
+            response, shared = flights.do(key, lambda: self._attempt(
+                method, params, timeout, stream, safe))
+            if shared:
+                if self.metrics is not None:
+                    self.metrics.record_coalesced(params.get('wsfunction'))
+                return response
+
+        if cache is not None and _cacheable(response):
+            cache.set(key, response, [site_tag(self.api_url, tag)
+                                      for tag in tags])
+        return response
+
+    def _attempt(self, method, params, timeout, stream, safe):
+        """
+        Sends a call, retrying and hedging it as the client is set up to
+        if it's safe to send more than once
+        """
+
+        retry = self.retry
+        # Streamed bodies are read by the caller, too late to hedge.
+        hedge = None if stream else self.hedge
+        if not safe or (retry is None and hedge is None):
+            return self._call(method, params, timeout, stream)
+
+        wsfunction = params.get('wsfunction')
+        tries = 0
+        while True:
+            tries += 1
+            try:
+                if hedge is None:
+                    response = self._call(method, params, timeout, stream)
+                else:
+                    response = hedge.call(lambda: self._call(
+                        method, params, timeout, stream),
+                        wsfunction, self.metrics)
+            except Exception as e:
+                if retry is None or not retry.retryable(tries, error=e):
+                    raise
+                delay = retry.delay(tries)
+            else:
+                if retry is None or \
+                        not retry.retryable(tries, response=response):
+                    return response
+                delay = retry.delay(tries, response)
+                response.close()
+
+            if self.metrics is not None:
+                self.metrics.record_retry(wsfunction)
+            time.sleep(delay)
+
+    def _call(self, method, params, timeout, stream):
+        """ Sends a call, recording it if the client has metrics """
+
+        metrics = self.metrics
+        if metrics is None:
+            return self._send(method, params, timeout, stream)
+
+        wsfunction = params.get('wsfunction')
+        metrics.before(wsfunction, params)
+        start = time.perf_counter()
+        try:
+            response = self._send(method, params, timeout, stream)
+        except Exception as e:
+            metrics.after(wsfunction, None, time.perf_counter() - start, e)
+            raise
+        metrics.after(wsfunction, response, time.perf_counter() - start)
+        return response
+
+    def _send(self, method, params, timeout, stream):
+        """ Sends a call, within a scheduler slot if there is one """
+
+        kwargs = self._encode(dict(params, **self.request_params))
+        if self.scheduler is None:
+            return self.transport.request(method, self.api_url,
+                                          timeout=timeout, stream=stream,
+                                          **kwargs)
+
+        with self.scheduler.slot() as slot:
+            response = self.transport.request(method, self.api_url,
+                                              timeout=timeout, stream=stream,
+                                              **kwargs)
+            slot.ok = not _overloaded(response)
+        return response
+
+    def _encode(self, params):
+        """
+        Returns the request arguments carrying params, in a form-encoded
+        body, gzipped if large enough and the client compresses requests.
+        Parameters never go in the query string, where the token would
+        end up in server logs.
+        """
+
+        if not self.compress:
+            return {'data': params}
+
+        body = urlencode(params).encode('ascii')
+        if len(body) < COMPRESS_MIN_SIZE:
+            return {'data': body, 'headers': FORM_HEADERS}
+        return {'data': gzip.compress(body, COMPRESS_LEVEL),
+                'headers': GZIP_FORM_HEADERS}
+
+    def _invalidate(self, *tags):
+        """ Drops cached responses affected by a write """
+
+        if self.cache is not None:
+            self.cache.invalidate(*[site_tag(self.api_url, tag)
+                                    for tag in tags])
+
+    def _categories_changed(self, *category_ids):
+        """ Marks categories stale after a write """
+
+        self._invalidate(CATEGORIES_TAG)
+        for tree in list(self.trees):
+            tree.invalidate(*category_ids)
+
+    def _contents_changed(self, *course_ids):
+        """ Drops cached contents of courses known to have changed """
+
+        self._invalidate(*[_course_tag(course_id)
+                           for course_id in course_ids])
+
+    def _send_batch(self, schema, items, to_fields=None):
+        """
+        Sends items in a single call, yielding (items, data, error)
+
+        Moodle runs each call in a transaction, so if it rejects the
+        batch nothing was applied. The batch is then split and resent
+        until the failing items are isolated. If it answers with a list
+        of a different length than the items sent, e.g. having dropped
+        parameters past max_input_vars, the whole batch fails.
+
+        :param schema: :class:`muddle.params.Schema` of the function to call
+        :param list items: Items to send
+        :param to_fields: (optional) Callable returning the array entry \
+            to send for an item. Defaults to sending the item itself.
+        """
+
+        if not items:
+            return
+
+        if to_fields is None:
+            params = schema.params(items)
+        else:
+            params = schema.params([to_fields(item) for item in items])
+
+        try:
+            data = self._request('post', params).json()
+        except (TransportError, ValueError) as e:
+            yield items, None, e
+            return
+
+        if isinstance(data, list) and len(data) != len(items):
+            # Parameters past max_input_vars get dropped, and what was
+            # sent may have been applied, so it can't be resent.
+            yield items, None, MuddleError(
+                'Moodle returned {} results for {} items'.format(
+                    len(data), len(items)))
+        elif not is_moodle_error(data):
+            yield items, data, None
+        elif len(items) == 1:
+            yield items, None, MoodleError(data)
+        else:
+            middle = len(items) // 2
+            yield from self._send_batch(schema, items[:middle], to_fields)
+            yield from self._send_batch(schema, items[middle:], to_fields)
+
+    def courses_contents(self, course_ids, workers=DEFAULT_POOL_SIZE,
+                         timeout=None, return_exceptions=False):
+        """
+        Fetches the contents of many courses concurrently
+
+        Yields (course_id, contents) pairs as each request completes, so
+        results arrive in no particular order. Only a couple of requests
+        per worker are queued at a time, so course_ids can be a lazy
+        iterable of any length. Stop iterating (or close the generator)
+        to cancel the requests that haven't started.
+
+        :param course_ids: Iterable of course ids
+        :param int workers: (optional) Number of concurrent requests. \
+            Keep this within the client's pool_maxsize.
+        :param timeout: (optional) Per-request timeout, overriding the \
+            client's default
+        :param bool return_exceptions: (optional) Defaults to False. \
+            Yield a failed request's exception in place of its contents \
+            rather than raising it
+
+        Example Usage::
+
+        >>> import muddle
+        >>> moodle = muddle.authenticate(API_KEY, API_URL, pool_maxsize=16)
+        >>> for course_id, contents in moodle.courses_contents(ids,
+        ...                                                    workers=16):
+        ...     store(course_id, contents)
+        """
+
+        def fetch(course_id):
+            return self._request('post', contents_params(course_id),
+                                 timeout=timeout,
+                                 tags=[_course_tag(course_id)]).json()
+
+        course_ids = iter(course_ids)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        pending = {}
+        try:
+            for course_id in islice(course_ids, workers * 2):
+                pending[executor.submit(fetch, course_id)] = course_id
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    course_id = pending.pop(future)
+                    for next_id in islice(course_ids, 1):
+                        pending[executor.submit(fetch, next_id)] = next_id
+
+                    try:
+                        contents = future.result()
+                    except Exception as e:
+                        if not return_exceptions:
+                            raise
+                        contents = e
+                    yield course_id, contents
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def iter_courses(self, category=None, fields=None,
+                     batch_size=DEFAULT_CHUNK_SIZE, prefetch=True,
+                     max_gap=MAX_GAP):
+        """
+        Yields every course on the site, or in a category, a page at a
+        time, see :func:`muddle.courses.iter_courses`
+
+        :param int category: (optional) Only list the courses in this \
+            category
+        :param fields: (optional) Fields to keep from each course. \
+            Defaults to every field.
+        :param int batch_size: (optional) Defaults to 100. Courses per page
+        :param bool prefetch: (optional) Defaults to True. Fetch the next \
+            page while the current one is consumed
+        :param int max_gap: (optional) Defaults to 20000. Unused ids in a \
+            row after which courses still missing are given up on
+
+        Example Usage::
 
-    def course(self, *course_id):
-        return Course(*course_id)
+        >>> import muddle
+        >>> moodle = muddle.authenticate(API_KEY, API_URL)
+        >>> for course in moodle.iter_courses(fields=['id', 'shortname']):
+        ...     print(course['id'], course['shortname'])
+        """
+
+        return iter_courses(self, category, fields, batch_size, prefetch,
+                            max_gap)
+
+    def category_tree(self):
+        """
+        Returns a :class:`muddle.categories.CategoryTree` of every
+        category on the site, kept in sync with category writes made
+        through this client
+        """
+
+        tree = CategoryTree(self)
+        self.trees.add(tree)
+        return tree
 
-    def category(self, *category_id):
-        return Category(*category_id)
+    def contents_sync(self, path=None, workers=DEFAULT_SYNC_WORKERS):
+        """
+        Returns a :class:`muddle.sync.ContentsSync`, fetching contents only
+        for courses changed since the last sync
+
+        :param string path: (optional) JSON file the sync state is kept in
+        :param int workers: (optional) Defaults to 10. Concurrent \
+            contents requests
+        """
+
+        return ContentsSync(self, path, workers)
+
+    def jobs(self, workers=DEFAULT_JOB_WORKERS, timeout=None):
+        """
+        Returns a :class:`muddle.jobs.JobQueue` for running course
+        duplicates and imports in the background
+
+        :param int workers: (optional) Defaults to 2. Jobs run at once
+        :param float timeout: (optional) Seconds each call may take
+        """
+
+        return JobQueue(self, workers, timeout)
+
+    def plan(self, layout, root=0, prune=False,
+             chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Returns a :class:`muddle.plan.Plan` of the changes that bring the
+        site's categories and courses in line with layout. Print it for a
+        dry run, and apply it to make the changes.
+
+        :param dict layout: ``categories`` and ``courses`` the site \
+            should have
+        :param int root: (optional) Defaults to 0. Category the layout's \
+            top categories go in
+        :param bool prune: (optional) Defaults to False. Delete categories \
+            and courses beneath root that aren't in the layout, and \
+            everything in them. Needs a root.
+        :param int chunk_size: (optional) Most objects per call
+        :raises ValueError: if the layout is invalid, or if pruning \
+            without a root
+
+        Example Usage::
+
+        >>> import muddle
+        >>> moodle = muddle.authenticate(API_KEY, API_URL)
+        >>> plan = moodle.plan(json.load(open('layout.json')))
+        >>> print(plan)
+        >>> results = plan.apply()
+        """
+
+        return Plan(self, layout, root, prune, chunk_size)
+
+    def course(self, course_id=None):
+        return Course(course_id, self)
+
+    def category(self, category_id=None):
+        return Category(category_id, self)
 
 
 class Course(Muddle):
-    """ Represents API endpoints for a Moodle Course """
+    """
+    Represents API endpoints for a Moodle Course
+
+    :param int course_id: (optional) The course
+    :param client: (optional) The :class:`Muddle` whose site to call. \
+        Defaults to the last client authenticated.
+    """
 
-    def __init__(self, course_id=None):
+    def __init__(self, course_id=None, client=None):
         self.course_id = course_id
+        self._share(client)
 
     def create(self, fullname, shortname, category_id, **kwargs):
         """
@@ -89,35 +685,64 @@ class Course(Muddle):
         >>> muddle.course().create('a new course', 'new-course', 20)
         """
 
-        allowed_options = ['idnumber', 'summaryformat',
-                           'format', 'showgrades',
-                           'newsitems', 'startdate',
-                           'maxbytes', 'showreports',
-                           'visible', 'groupmode',
-                           'groupmodeforce', 'jdefaultgroupingid',
-                           'enablecompletion', 'completionstartonenrol',
-                           'completionnotify', 'lang',
-                           'forcetheme']
+        params = create_course_params(fullname, shortname, category_id,
+                                       kwargs)
+        response = self._request('post', params)
+        self._categories_changed(category_id)
+        return response
 
-        if valid_options(kwargs, allowed_options):
-            option_params = {}
-            for index, key in enumerate(kwargs):
-                val = kwargs.get(key)
+    def create_many(self, courses, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Create many courses, packing several into each request
+
+        Courses are sent in chunks of at most chunk_size, and never more
+        parameters per request than PHP's default max_input_vars. If Moodle
+        rejects a chunk, it is split and retried until the failing courses
+        are isolated, so the rest still get created.
 
-                if isinstance(val, bool):
-                    val = int(val)
+        :param courses: Iterable of dicts, each with ``fullname``, \
+            ``shortname`` and ``categoryid`` keys plus any option accepted \
+            by :meth:`create`. Generators are consumed one chunk at a time.
+        :param int chunk_size: (optional) Maximum courses per request
 
-                option_params.update({'courses[0][' + key + ']': val})
+        :returns: list of :class:`muddle.batch.Result`, one per course \
+            in input order. ``value`` holds the new course's id and \
+            shortname, ``error`` the reason it wasn't created.
 
-            params = {'wsfunction': 'core_course_create_courses',
-                      'courses[0][fullname]': fullname,
-                      'courses[0][shortname]': shortname,
-                      'courses[0][categoryid]': category_id}
+        Example Usage::
 
-            params.update(option_params)
-            params.update(self.request_params)
+        >>> import muddle
+        >>> specs = ({'fullname': name, 'shortname': name, 'categoryid': 20}
+        ...          for name in names)
+        >>> results = muddle.course().create_many(specs, chunk_size=200)
+        >>> failed = [r.item for r in results if not r.ok]
+        """
 
-            return requests.post(self.api_url, params=params, verify=False)
+        results = []
+        for chunk in chunked(courses, chunk_size, weight=len):
+            results.extend(self._create_chunk(chunk))
+        self._categories_changed(*set(result.item['categoryid']
+                                      for result in results if result.ok))
+        return results
+
+    def _create_chunk(self, courses):
+        results = [None] * len(courses)
+        pending = []
+        for index, course in enumerate(courses):
+            error = CREATE_COURSES.error(course)
+            if error is not None:
+                results[index] = Result(course, error=error)
+            else:
+                pending.append(index)
+
+        batches = self._send_batch(CREATE_COURSES, pending,
+                                   lambda index: courses[index])
+        for indexes, value, error in batches:
+            for position, index in enumerate(indexes):
+                created = value[position] if value else None
+                results[index] = Result(courses[index], value=created,
+                                        error=error)
+        return results
 
     def delete(self):
         """
@@ -129,16 +754,67 @@ class Course(Muddle):
         >>> muddle.course(10).delete()
         """
 
-        params = {'wsfunction': 'core_course_delete_courses',
-                  'courseids[0]': self.course_id}
-        params.update(self.request_params)
+        response = self._request('post',
+                                 delete_course_params(self.course_id))
+        self._invalidate(_course_tag(self.course_id), CATEGORIES_TAG)
+        return response
+
+    def delete_many(self, course_ids, chunk_size=DEFAULT_CHUNK_SIZE,
+                    workers=1):
+        """
+        Deletes many courses, packing several ids into each request
+
+        :param course_ids: Iterable of course ids
+        :param int chunk_size: (optional) Maximum ids per request
+        :param int workers: (optional) Defaults to 1. Number of requests \
+            to run concurrently
+
+        :returns: list of :class:`muddle.batch.Result`, one per id in \
+            input order. Failed deletes have ``error`` set.
+
+        Example Usage::
 
-        return requests.post(self.api_url, params=params, verify=False)
+        >>> import muddle
+        >>> results = muddle.course().delete_many(range(100, 5000))
+        >>> failed = [r.item for r in results if not r.ok]
+        """
 
-    def contents(self):
+        results = map_chunks(self._delete_chunk,
+                             chunked(course_ids, chunk_size), workers)
+        self._invalidate(CATEGORIES_TAG,
+                         *[_course_tag(result.item) for result in results])
+        return results
+
+    def _delete_chunk(self, course_ids):
+        results = []
+        batches = self._send_batch(DELETE_COURSES, course_ids)
+        for ids, value, error in batches:
+            # Courses Moodle refused to delete come back as warnings,
+            # the rest of the batch still goes ahead.
+            warnings = {}
+            for warning in (value or {}).get('warnings', []):
+                warnings[str(warning.get('itemid'))] = warning
+            for course_id in ids:
+                warning = warnings.get(str(course_id))
+                if warning:
+                    failure = MoodleError({'errorcode':
+                                           warning.get('warningcode'),
+                                           'message': warning.get('message')})
+                else:
+                    failure = error
+                results.append(Result(course_id, error=failure))
+        return results
+
+    def contents(self, typed=False):
         """
         Returns entire contents of course page
 
+        :param bool typed: (optional) Defaults to False. Return a \
+            :class:`muddle.models.CourseContents`, which is much smaller \
+            in memory than the nested dicts and indexes modules by id \
+            and sections by number. Typed contents are built from \
+            :meth:`iter_contents` and aren't cached.
+
         :returns: response object
 
         Example Usage::
@@ -147,11 +823,52 @@ class Course(Muddle):
         >>> muddle.course(10).content()
         """
 
-        params = self.request_params
-        params.update({'wsfunction': 'core_course_get_contents',
-                       'courseid': self.course_id})
+        if typed:
+            return CourseContents(self.course_id, self.iter_contents())
+
+        return self._request('post', contents_params(self.course_id),
+                             tags=[_course_tag(self.course_id)]).json()
+
+    def iter_contents(self, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Yields the sections of the course page one at a time
+
+        Sections are decoded as the response downloads, so only one
+        section is held in memory at a time and processing can start
+        before the download finishes.
 
-        return requests.get(self.api_url, params=params, verify=False).json()
+        :param int chunk_size: (optional) Bytes to read at a time
+
+        Example Usage::
+
+        >>> import muddle
+        >>> for section in muddle.course(10).iter_contents():
+        ...     print(section['name'], len(section['modules']))
+        """
+
+        response = self._request('post', contents_params(self.course_id),
+                                 stream=True)
+        with response:
+            yield from iter_json_array(response.iter_content(chunk_size))
+
+    def iter_modules(self, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Yields (section, module) for each module on the course page
+
+        Streams like :meth:`iter_contents`. The section dict is yielded
+        without its ``modules`` list.
+
+        Example Usage::
+
+        >>> import muddle
+        >>> for section, module in muddle.course(10).iter_modules():
+        ...     print(section['section'], module['modname'])
+        """
+
+        for section in self.iter_contents(chunk_size):
+            modules = section.pop('modules', [])
+            for module in modules:
+                yield section, module
 
     def duplicate(self, fullname, shortname, categoryid,
                   visible=True, **kwargs):
@@ -193,30 +910,11 @@ class Course(Muddle):
         # Ideally categoryid should be optional here and
         # should default to catid of course being duplicated.
 
-        allowed_options = ['activities', 'blocks',
-                           'filters', 'users',
-                           'role_assignments', 'comments',
-                           'usercompletion', 'logs',
-                           'grade_histories']
-
-        if valid_options(kwargs, allowed_options):
-            option_params = {}
-            for index, key in enumerate(kwargs):
-                option_params.update(
-                    {'options[' + str(index) + '][name]': key,
-                     'options[' + str(index) + '][value]':
-                        int(kwargs.get(key))})
-
-            params = {'wsfunction': 'core_course_duplicate_course',
-                      'courseid': self.course_id,
-                      'fullname': fullname,
-                      'shortname': shortname,
-                      'categoryid': categoryid,
-                      'visible': int(visible)}
-            params.update(option_params)
-            params.update(self.request_params)
-
-            return requests.post(self.api_url, params=params, verify=False)
+        params = duplicate_params(self.course_id, fullname, shortname,
+                                   categoryid, visible, kwargs)
+        response = self._request('post', params)
+        self._categories_changed(categoryid)
+        return response
 
     def export_data(self, export_to, delete_content=False):
         """
@@ -231,20 +929,24 @@ class Course(Muddle):
         >>> import muddle
         >>> muddle.course(10).export_data(12)
         """
-        params = {'wsfunction': 'core_course_import_course',
-                  'importfrom': self.course_id,
-                  'importto': export_to,
-                  'deletecontent': int(delete_content)}
-        params.update(self.request_params)
-
-        return requests.post(self.api_url, params=params, verify=False)
+        params = export_params(self.course_id, export_to, delete_content)
+        response = self._request('post', params)
+        self._invalidate(_course_tag(self.course_id), _course_tag(export_to))
+        return response
 
 
 class Category(Muddle):
-    """ Represents API endpoints for Moodle Courses Categories """
+    """
+    Represents API endpoints for Moodle Courses Categories
 
-    def __init__(self, category_id=None):
+    :param int category_id: (optional) The category
+    :param client: (optional) The :class:`Muddle` whose site to call. \
+        Defaults to the last client authenticated.
+    """
+
+    def __init__(self, category_id=None, client=None):
         self.category_id = category_id
+        self._share(client)
 
     def details(self):
         """
@@ -257,13 +959,8 @@ class Category(Muddle):
         >>> import muddle
         >>> muddle.category(10).details()
         """
-        params = {'wsfunction': 'core_course_get_categories',
-                  'criteria[0][key]': 'id',
-                  'criteria[0][value]': self.category_id}
-
-        params.update(self.request_params)
-
-        return requests.post(self.api_url, params=params, verify=False)
+        params = category_details_params(self.category_id)
+        return self._request('post', params, tags=[CATEGORIES_TAG])
 
     def create(self, category_name, **kwargs):
         """
@@ -271,6 +968,7 @@ class Category(Muddle):
         Create a new category
 
         :param string name: new category name
+        :param string idnumber: (optional) Id number
         :param int parent: (optional) Defaults to 0, root category. \
             The parent category id inside which the new \
             category will be created
@@ -287,23 +985,81 @@ class Category(Muddle):
         >>> import muddle
         >>> muddle.category().create('category name')
         """
-        allowed_options = ['parent',
-                           'description',
-                           'descriptionformat',
-                           'theme']
+        params = create_category_params(category_name, kwargs)
+        response = self._request('post', params)
+        self._categories_changed(*_created_ids(response))
+        return response
+
+    def create_many(self, categories, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Create many categories, packing several into each request
+
+        A category's ``parent`` may be the id of an existing category, or
+        the ``idnumber`` of another category in the same call. Categories
+        are created a level at a time, parents before children, so each
+        level needs only as many requests as its chunks. If Moodle
+        rejects a chunk, it is split and retried until the failing
+        categories are isolated; categories beneath one that failed
+        aren't sent.
+
+        :param categories: Iterable of dicts, each with a ``name`` key \
+            plus any option accepted by :meth:`create`
+        :param int chunk_size: (optional) Maximum categories per request
 
-        if valid_options(kwargs, allowed_options):
-            option_params = {}
-            for key in kwargs:
-                option_params.update(
-                    {'categories[0][' + key + ']': str(kwargs.get(key))})
-            params = {'wsfunction': 'core_course_create_categories',
-                      'categories[0][name]': category_name,
-                      }
-            params.update(option_params)
-            params.update(self.request_params)
+        :returns: list of :class:`muddle.batch.Result`, one per category \
+            in input order. ``value`` holds the new category's id and \
+            name, ``error`` the reason it wasn't created.
+
+        Example Usage::
+
+        >>> import muddle
+        >>> results = muddle.category().create_many([
+        ...     {'name': 'Science', 'idnumber': 'SCI'},
+        ...     {'name': 'Physics', 'idnumber': 'PHYS', 'parent': 'SCI'},
+        ...     {'name': 'Chemistry', 'parent': 'SCI'}])
+        >>> ids = [result.value['id'] for result in results if result.ok]
+        """
 
-            return requests.post(self.api_url, params=params, verify=False)
+        categories = list(categories)
+        results = [None] * len(categories)
+        levels, parents = _levels(categories, results)
+
+        def to_fields(index):
+            category = categories[index]
+            parent = category.get('parent')
+            if isinstance(parent, str):
+                parent = results[parents[index]].value['id']
+            return dict(category, parent=parent)
+
+        for level in levels:
+            pending = []
+            for index in level:
+                parent = parents.get(index)
+                if parent is not None and not results[parent].ok:
+                    results[index] = Result(categories[index], error=(
+                        MuddleError('Parent category {} was not '
+                                    'created'.format(
+                                        categories[index]['parent']))))
+                    continue
+                error = CREATE_CATEGORIES.error(to_fields(index))
+                if error is not None:
+                    results[index] = Result(categories[index], error=error)
+                else:
+                    pending.append(index)
+
+            for chunk in chunked(pending, chunk_size,
+                                 weight=lambda index: len(categories[index])):
+                batches = self._send_batch(CREATE_CATEGORIES, chunk,
+                                           to_fields)
+                for indexes, value, error in batches:
+                    for position, index in enumerate(indexes):
+                        created = value[position] if value else None
+                        results[index] = Result(categories[index],
+                                                value=created, error=error)
+
+        self._categories_changed(*[result.value['id'] for result in results
+                                   if result.ok])
+        return results
 
     def delete(self, new_parent=None, recursive=False):
         """
@@ -319,14 +1075,80 @@ class Category(Muddle):
         >>> muddle.category(10).delete()
         """
 
-        params = {'wsfunction': 'core_course_delete_categories',
-                  'categories[0][id]': self.category_id,
-                  'categories[0][recursive]': int(recursive)}
-        if new_parent:
-            params.update({'categories[0][newparent]': new_parent})
-        params.update(self.request_params)
+        params = delete_category_params(self.category_id, new_parent,
+                                         recursive)
+        parents = self._loaded_parents([self.category_id])
+        response = self._request('post', params)
+        self._category_deleted([self.category_id], new_parent, recursive,
+                               parents)
+        return response
+
+    def delete_many(self, category_ids, new_parent=None, recursive=False,
+                    chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+        """
+        Deletes many categories, packing several into each request
+
+        :param category_ids: Iterable of category ids
+        :param int new_parent: (optional) Category ID to move contents to
+        :param bool recursive: recursively delete contents inside \
+            the categories
+        :param int chunk_size: (optional) Maximum categories per request
+        :param int workers: (optional) Defaults to 1. Number of requests \
+            to run concurrently
+
+        :returns: list of :class:`muddle.batch.Result`, one per id in \
+            input order. Failed deletes have ``error`` set.
 
-        return requests.post(self.api_url, params=params, verify=False)
+        Example Usage::
+
+        >>> import muddle
+        >>> results = muddle.category().delete_many([10, 11, 12],
+        ...                                         recursive=True)
+        """
+
+        def to_fields(category_id):
+            return {'id': category_id, 'recursive': bool(recursive),
+                    'newparent': new_parent or None}
+
+        def delete_chunk(chunk):
+            results = []
+            batches = self._send_batch(DELETE_CATEGORIES, chunk, to_fields)
+            for ids, value, error in batches:
+                results.extend(Result(category_id, error=error)
+                               for category_id in ids)
+            return results
+
+        # Each category sends several parameters, all of which count
+        # towards max_input_vars.
+        category_ids = list(category_ids)
+        parents = self._loaded_parents(category_ids)
+        chunks = chunked(category_ids, chunk_size,
+                         weight=lambda category: len(to_fields(category)))
+        results = map_chunks(delete_chunk, chunks, workers)
+        self._category_deleted([result.item for result in results],
+                               new_parent, recursive, parents)
+        return results
+
+    def _loaded_parents(self, category_ids):
+        """ Returns the parents of categories loaded in the client's trees """
+
+        parents = set()
+        for tree in list(self.trees):
+            parents.update(tree.loaded_parents(category_ids))
+        return parents
+
+    def _category_deleted(self, category_ids, new_parent, recursive,
+                          parents=()):
+        if new_parent:
+            category_ids = category_ids + [new_parent]
+        elif not recursive:
+            # What was inside moved up to the parent.
+            category_ids = category_ids + [parent for parent in parents
+                                           if parent]
+        self._categories_changed(*category_ids)
+        if recursive and self.cache is not None:
+            # Courses inside went too, and there's no telling which.
+            self.cache.clear()
 
     def update(self, **kwargs):
         """
@@ -346,19 +1168,87 @@ class Category(Muddle):
         >>> muddle.category(10).update(name='new name')
         """
 
-        allowed_options = ['name', 'idnumber', 'parent',
-                           'description', 'descriptionformat',
-                           'theme']
+        params = update_category_params(self.category_id, kwargs)
+        response = self._request('post', params)
+        self._categories_changed(self.category_id)
+        return response
+
+    def update_many(self, categories, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Update many categories, packing several into each request
+
+        Moodle applies a request's updates in order, so when moving
+        categories list parents before their children.
+
+        :param categories: Iterable of dicts, each with an ``id`` key \
+            plus any option accepted by :meth:`update`
+        :param int chunk_size: (optional) Maximum categories per request
 
-        if valid_options(kwargs, allowed_options):
-            option_params = {}
-            for key in kwargs:
-                option_params.update(
-                    {'categories[0][' + key + ']': str(kwargs.get(key))})
+        :returns: list of :class:`muddle.batch.Result`, one per category \
+            in input order. Failed updates have ``error`` set.
+
+        Example Usage::
+
+        >>> import muddle
+        >>> results = muddle.category().update_many(
+        ...     {'id': category_id, 'theme': 'boost'}
+        ...     for category_id in category_ids)
+        """
 
-            params = {'wsfunction': 'core_course_update_categories',
-                      'categories[0][id]': self.category_id}
-            params.update(option_params)
-            params.update(self.request_params)
+        results = []
+        for chunk in chunked(categories, chunk_size, weight=len):
+            chunk_results = [None] * len(chunk)
+            pending = []
+            for index, category in enumerate(chunk):
+                error = UPDATE_CATEGORIES.error(category)
+                if error is not None:
+                    chunk_results[index] = Result(category, error=error)
+                else:
+                    pending.append(index)
+
+            batches = self._send_batch(UPDATE_CATEGORIES, pending,
+                                       lambda index: chunk[index])
+            for indexes, value, error in batches:
+                for index in indexes:
+                    chunk_results[index] = Result(chunk[index], error=error)
+            results.extend(chunk_results)
+
+        changed = set()
+        for result in results:
+            if result.ok:
+                changed.add(result.item['id'])
+                if result.item.get('parent'):
+                    changed.add(result.item['parent'])
+        self._categories_changed(*changed)
+        return results
+
+    def copy_subtree(self, parent, rename, checkpoint=None,
+                     workers=DEFAULT_SUBTREE_WORKERS, timeout=None,
+                     **kwargs):
+        """
+        Copies the category, its subcategories and all their courses
+        under parent, see :class:`muddle.subtree.SubtreeCopy`
+
+        :param int parent: Category the copy is created under
+        :param rename: Suffix for the copied courses' names, or a callable \
+            taking a course and returning its copy's (fullname, shortname)
+        :param string checkpoint: (optional) JSON file progress is kept \
+            in. Calling again with the same file resumes the copy.
+        :param int workers: (optional) Defaults to 2. Courses duplicated \
+            at once
+        :param float timeout: (optional) Seconds each duplicate may take
+
+        Further keywords are backup settings for every course duplicate,
+        see :meth:`Course.duplicate`.
+
+        :returns: :class:`muddle.subtree.SubtreeCopy`
+
+        Example Usage::
+
+        >>> import muddle
+        >>> muddle.category(12).copy_subtree(40, ' 2025',
+        ...                                  checkpoint='rollover.json')
+        """
 
-            return requests.post(self.api_url, params=params, verify=False)
+        return SubtreeCopy(self, self.category_id, parent, rename,
+                           checkpoint, workers, timeout, **kwargs).run()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.batch
+------------
+
+Helpers for packing many objects into a single web service call.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+# PHP's default max_input_vars. Moodle silently drops anything past it,
+# so batched requests must stay under this many parameters.
+MAX_INPUT_VARS = 1000
+
+# Parameters sent with every call (wstoken, moodlewsrestformat, wsfunction).
+BASE_PARAMS = 3
+
+DEFAULT_CHUNK_SIZE = 100
+
+
+def chunked(iterable, size, weight=None, max_weight=MAX_INPUT_VARS):
+    """
+    Lazily splits an iterable into lists of at most size items
+
+    :param iterable: Items to split. Consumed one chunk at a time.
+    :param int size: Maximum number of items per chunk
+    :param weight: (optional) Callable returning the number of request \
+        parameters an item needs
+    :param int max_weight: (optional) Maximum total weight per chunk
+    """
+
+    chunk = []
+    total = BASE_PARAMS
+    for item in iterable:
+        item_weight = weight(item) if weight else 1
+        if chunk and (len(chunk) >= size or
+                      total + item_weight > max_weight):
+            yield chunk
+            chunk = []
+            total = BASE_PARAMS
+        chunk.append(item)
+        total += item_weight
+    if chunk:
+        yield chunk
+
+
+class Result():
+    """
+    Outcome for one item of a batched call
+
+    :param item: The input the result belongs to
+    :param value: Data returned by Moodle for the item, if it succeeded
+    :param error: Exception describing why the item failed, if it did
+    """
+
+    def __init__(self, item, value=None, error=None):
+        self.item = item
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return '<Result {!r}: {!r}>'.format(self.item, self.value)
+        return '<Result {!r}: error {!r}>'.format(self.item, self.error)
+
+
+def map_chunks(func, chunks, workers=1):
+    """
+    Calls func on each chunk, concatenating the returned lists in order
+
+    :param func: Callable taking a chunk and returning a list of results
+    :param chunks: Iterable of chunks
+    :param int workers: (optional) Number of chunks to process concurrently
+    """
+
+    results = []
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for chunk_results in executor.map(func, chunks):
+                results.extend(chunk_results)
+    else:
+        for chunk in chunks:
+            results.extend(func(chunk))
+    return results
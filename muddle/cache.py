@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.cache
+------------
+
+Caches for read-only web service calls, in-process or on disk.
+"""
+
+from collections import OrderedDict
+import json
+import threading
+import time
+import zlib
+
+from .sync import course_markers
+from .transport import Response
+
+DEFAULT_MAXSIZE = 1024
+DEFAULT_TTL = 300
+
+
+class ResponseCache():
+    """
+    Size-bounded LRU cache of responses, with per-entry expiry
+
+    Entries are tagged with the objects they describe (e.g. ``course:10``)
+    so that writes through the client can invalidate them.
+
+    Example Usage::
+
+    >>> import muddle
+    >>> cache = muddle.ResponseCache(maxsize=5000, ttl=60)
+    >>> moodle = muddle.authenticate(API_KEY, API_URL, cache=cache)
+    >>> moodle.course(10).contents()
+    >>> cache.stats()
+    {'hits': 0, 'misses': 1, 'evictions': 0, 'invalidations': 0, 'size': 1}
+
+    :param int maxsize: (optional) Defaults to 1024. Maximum number of \
+        responses kept. The least recently used is evicted beyond that.
+    :param float ttl: (optional) Defaults to 300. Seconds a response is \
+        served from the cache, or None to keep it until evicted.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._tagged = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(params, site=None):
+        """ Returns the cache key for a call's parameters on a site """
+
+        return (site,) + tuple(sorted((key, str(val))
+                                      for key, val in params.items()))
+
+    def get(self, key):
+        """ Returns the cached response for key, or None """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, tags, value = entry
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+
+    def set(self, key, value, tags=()):
+        """ Caches value under key, tagged with tags """
+
+        expires = None
+        if self.ttl is not None:
+            expires = time.monotonic() + self.ttl
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires, frozenset(tags), value)
+            for tag in tags:
+                self._tagged.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        """ Drops every entry carrying any of tags """
+
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tagged.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        """ Drops every entry """
+
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._tagged.clear()
+
+    def _remove(self, key):
+        expires, tags, value = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tagged[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tagged[tag]
+
+    def stats(self):
+        """ Returns the cache's counters as a dict """
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self._entries)}
+
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,
+    content_type TEXT,
+    content BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    stored REAL NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE TABLE IF NOT EXISTS tags (
+    tag TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (tag, key)
+);
+CREATE INDEX IF NOT EXISTS tags_key ON tags (key);
+CREATE TABLE IF NOT EXISTS site_markers (
+    tag TEXT PRIMARY KEY,
+    marker TEXT
+);
+'''
+
+
+class DiskCache():
+    """
+    Persistent response cache in an SQLite file, shared across runs
+
+    A drop-in replacement for :class:`ResponseCache` for short-lived
+    processes, e.g. cron jobs, that would otherwise start cold every run.
+    Bodies are stored zlib-compressed, and the least recently used are
+    evicted beyond max_bytes. Entries are kept per site, so clients of
+    several sites can share a file.
+
+    Course contents can be revalidated in bulk instead of re-fetched: see
+    :meth:`revalidate`.
+
+    Example Usage::
+
+    >>> import muddle
+    >>> cache = muddle.DiskCache('/var/cache/moodle.sqlite', ttl=3600)
+    >>> moodle = muddle.authenticate(API_KEY, API_URL, cache=cache)
+    >>> cache.revalidate(moodle)
+    >>> moodle.course(10).contents()
+
+    :param string path: SQLite file, created if missing
+    :param int max_bytes: (optional) Defaults to 256 MB. Maximum total \
+        size of the stored (compressed) bodies
+    :param float ttl: (optional) Defaults to 300. Seconds a response is \
+        served from the cache, or None to keep it until evicted.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.revalidations = 0
+        self._lock = threading.Lock()
+
+        # Imported here so importing muddle doesn't import sqlite3.
+        import sqlite3
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+        self._bytes = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM entries'
+                                    ).fetchone()[0]
+
+    key = staticmethod(ResponseCache.key)
+
+    def get(self, key):
+        """ Returns the cached response for key, or None """
+
+        key = _encode_key(key)
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                'SELECT status, content_type, content, expires FROM entries '
+                'WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                status, content_type, content, expires = row
+                if expires is None or expires > now:
+                    self._db.execute('UPDATE entries SET accessed = ? '
+                                     'WHERE key = ?', (now, key))
+                    self.hits += 1
+                    content = zlib.decompress(content)
+                    return Response(status, {'Content-Type': content_type,
+                                             'Content-Length':
+                                             str(len(content))},
+                                    content=content)
+                self._delete([key])
+            self.misses += 1
+
+    def set(self, key, value, tags=()):
+        """ Caches a response under key, tagged with tags """
+
+        key = _encode_key(key)
+        content = zlib.compress(value.content, 1)
+        now = time.time()
+        expires = None if self.ttl is None else now + self.ttl
+
+        with self._lock, self._db:
+            self._delete([key])
+            self._db.execute(
+                'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, value.status_code, value.headers.get('Content-Type'),
+                 content, len(content), now, expires, now))
+            self._db.executemany('INSERT INTO tags VALUES (?, ?)',
+                                 [(tag, key) for tag in set(tags)])
+            self._bytes += len(content)
+            self._evict()
+
+    def invalidate(self, *tags):
+        """ Drops every entry carrying any of tags """
+
+        with self._lock, self._db:
+            keys = self._tagged(tags)
+            self._delete(keys)
+            self.invalidations += len(keys)
+
+    def clear(self):
+        """ Drops every entry """
+
+        with self._lock, self._db:
+            self.invalidations += self._db.execute(
+                'SELECT COUNT(*) FROM entries').fetchone()[0]
+            self._db.execute('DELETE FROM entries')
+            self._db.execute('DELETE FROM tags')
+            self._db.execute('DELETE FROM site_markers')
+            self._bytes = 0
+
+    def revalidate(self, client, ttl=None):
+        """
+        Checks cached course contents against the courses' metadata,
+        fetched in bulk, and renews the ones still current
+
+        Entries for a course are kept, expired or not, while its metadata
+        is unchanged since the last revalidation, or, the first time,
+        while the course hasn't changed since the entry was stored. Kept
+        entries expire ttl seconds from now; the rest are dropped.
+
+        The metadata is ``cacherev``, which changes whenever anything in
+        the course does, and ``timemodified``; see
+        :func:`muddle.sync.course_markers`. Moodle versions that don't
+        return cacherev only show changes to course settings, so entries
+        may be kept after an activity changes.
+
+        :param client: An authenticated :class:`muddle.api.Muddle`
+        :param float ttl: (optional) Defaults to the cache's ttl
+        :returns: Number of entries kept
+        """
+
+        prefix = site_tag(client.api_url, 'course:')
+        with self._lock:
+            tags = [tag for tag, in self._db.execute(
+                'SELECT DISTINCT tag FROM tags') if tag.startswith(prefix)]
+            known = dict(self._db.execute('SELECT tag, marker '
+                                          'FROM site_markers'))
+        course_ids = [int(tag[len(prefix):]) for tag in tags]
+        markers = course_markers(client, course_ids)
+
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.time() + ttl
+        kept = 0
+        with self._lock, self._db:
+            for course_id, tag in zip(course_ids, tags):
+                keys = self._tagged([tag])
+                marker = markers.get(course_id)
+                if marker is None:
+                    # Deleted, or no metadata to tell whether it changed.
+                    current = []
+                elif tag in known:
+                    unchanged = json.loads(known[tag]) == marker
+                    current = keys if unchanged else []
+                else:
+                    # cacherev is set from the clock too, so the later
+                    # of the two is when the course last changed.
+                    current = self._stored_after(
+                        keys, max(val for val in marker if val is not None))
+                self._delete(set(keys) - set(current))
+                self._db.executemany(
+                    'UPDATE entries SET expires = ? WHERE key = ?',
+                    [(expires, key) for key in current])
+                self._db.execute('INSERT OR REPLACE INTO site_markers '
+                                 'VALUES (?, ?)',
+                                 (tag, json.dumps(marker)))
+                kept += len(current)
+            self.revalidations += kept
+        return kept
+
+    def close(self):
+        self._db.close()
+
+    def _stored_after(self, keys, timestamp):
+        if timestamp is None:
+            return []
+        return [key for key in keys
+                if self._db.execute('SELECT stored FROM entries WHERE '
+                                    'key = ?', (key,)).fetchone()[0] >
+                timestamp]
+
+    def _tagged(self, tags):
+        keys = set()
+        for tag in tags:
+            keys.update(key for key, in self._db.execute(
+                'SELECT key FROM tags WHERE tag = ?', (tag,)))
+        return list(keys)
+
+    def _delete(self, keys):
+        for key in keys:
+            row = self._db.execute('SELECT size FROM entries WHERE key = ?',
+                                   (key,)).fetchone()
+            if row is None:
+                continue
+            self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self._db.execute('DELETE FROM tags WHERE key = ?', (key,))
+            self._bytes -= row[0]
+
+    def _evict(self):
+        while self._bytes > self.max_bytes:
+            oldest = self._db.execute('SELECT key FROM entries ORDER BY '
+                                      'accessed LIMIT 1').fetchone()
+            if oldest is None:
+                break
+            self._delete([oldest[0]])
+            self.evictions += 1
+
+    def stats(self):
+        """ Returns the cache's counters as a dict """
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'revalidations': self.revalidations,
+                'size': len(self),
+                'bytes': self._bytes}
+
+
+def site_tag(site, tag):
+    """ Scopes an invalidation tag to a site, so sites can share a cache """
+
+    return '{} {}'.format(site, tag)
+
+
+def _encode_key(key):
+    return json.dumps(key, separators=(',', ':'))
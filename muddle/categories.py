@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.categories
+-----------------
+
+Local index of a site's category hierarchy.
+"""
+
+import threading
+
+from .exceptions import raise_for_moodle_error
+from .params import GET_CATEGORIES
+
+
+class CategoryTree():
+    """
+    Every category on the site, loaded in a single call
+
+    Ancestor, descendant and subtree queries are answered locally. Writes
+    made through the same client (creating, updating or deleting
+    categories) mark the affected branches stale, and only those branches
+    are re-fetched, on the next query.
+
+    Example Usage::
+
+    >>> import muddle
+    >>> moodle = muddle.authenticate(API_KEY, API_URL)
+    >>> tree = moodle.category_tree()
+    >>> [category['name'] for category in tree.ancestors(42)]
+    ['Faculty of Science', 'Physics']
+    >>> len(tree.descendants(3))
+    118
+
+    :param client: An authenticated :class:`muddle.api.Muddle`
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._categories = {}
+        self._children = {}
+        self._stale = set()
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        self._sync()
+        return len(self._categories)
+
+    def __contains__(self, category_id):
+        self._sync()
+        return category_id in self._categories
+
+    def __iter__(self):
+        self._sync()
+        return iter(list(self._categories.values()))
+
+    def load(self):
+        """ (Re)loads every category on the site """
+
+        categories = self._fetch({})
+        with self._lock:
+            self._categories = {}
+            self._children = {}
+            self._stale.clear()
+            for category in categories:
+                self._add(category)
+            self._sort(self._children)
+            self._loaded = True
+
+    def refresh(self, category_id=None):
+        """
+        Re-fetches a category and everything beneath it,
+        or the whole tree if no category is given
+        """
+
+        if category_id is None:
+            return self.load()
+
+        categories = self._fetch({'criteria': [{'key': 'id',
+                                                'value': category_id}],
+                                  'addsubcategories': True})
+        with self._lock:
+            if category_id in self._categories:
+                self._remove(category_id)
+            for category in categories:
+                self._add(category)
+            self._sort(category['parent'] for category in categories)
+            self._stale.discard(category_id)
+
+    def loaded_parents(self, category_ids):
+        """
+        Returns the parent ids of those of category_ids already loaded,
+        without fetching anything
+        """
+
+        with self._lock:
+            return set(self._categories[category_id]['parent']
+                       for category_id in category_ids
+                       if category_id in self._categories)
+
+    def invalidate(self, *category_ids):
+        """ Marks branches stale, to be re-fetched on the next query """
+
+        with self._lock:
+            self._stale.update(category_ids)
+
+    def get(self, category_id):
+        """ Returns a category's details """
+
+        self._sync()
+        return self._categories[category_id]
+
+    def parent(self, category_id):
+        """ Returns a category's parent, or None for top level categories """
+
+        self._sync()
+        return self._categories.get(self._categories[category_id]['parent'])
+
+    def children(self, category_id=0):
+        """ Returns a category's direct children, in sort order """
+
+        self._sync()
+        with self._lock:
+            return [self._categories[child]
+                    for child in self._children.get(category_id, ())]
+
+    def ancestors(self, category_id):
+        """ Returns a category's ancestors, top level first """
+
+        self._sync()
+        with self._lock:
+            path = self._path(category_id)
+            return [self._categories[ancestor] for ancestor in path[:-1]
+                    if ancestor in self._categories]
+
+    def descendants(self, category_id=0):
+        """ Returns everything beneath a category, parents before children """
+
+        self._sync()
+        with self._lock:
+            found = []
+            pending = list(reversed(self._children.get(category_id, ())))
+            while pending:
+                child = pending.pop()
+                found.append(self._categories[child])
+                pending.extend(reversed(self._children.get(child, ())))
+            return found
+
+    def subtree(self, category_id):
+        """ Returns a category followed by its descendants """
+
+        return [self.get(category_id)] + self.descendants(category_id)
+
+    def _path(self, category_id):
+        path = self._categories[category_id].get('path')
+        if path:
+            return [int(part) for part in path.strip('/').split('/')]
+
+        path = [category_id]
+        parent = self._categories[category_id]['parent']
+        while parent in self._categories:
+            path.insert(0, parent)
+            parent = self._categories[parent]['parent']
+        return path
+
+    def _fetch(self, fields):
+        params = GET_CATEGORIES.params(fields)
+        return raise_for_moodle_error(
+            self.client._request('post', params).json())
+
+    def _add(self, category):
+        existing = self._categories.get(category['id'])
+        if existing is not None:
+            self._children[existing['parent']].remove(category['id'])
+        self._categories[category['id']] = category
+        self._children.setdefault(category['parent'], []).append(
+            category['id'])
+
+    def _remove(self, category_id):
+        for child in list(self._children.get(category_id, ())):
+            self._remove(child)
+        self._children.pop(category_id, None)
+        category = self._categories.pop(category_id)
+        self._children[category['parent']].remove(category_id)
+
+    def _sort(self, parent_ids):
+        for parent_id in set(parent_ids):
+            self._children[parent_id].sort(
+                key=lambda child: self._categories[child].get('sortorder', 0))
+
+    def _sync(self):
+        """ Loads the tree, or refreshes stale branches """
+
+        if not self._loaded:
+            self.load()
+            return
+
+        with self._lock:
+            stale = set(self._stale)
+            # A branch's refresh covers any stale categories beneath it.
+            for category_id in list(stale):
+                if category_id in self._categories:
+                    if any(ancestor in stale
+                           for ancestor in self._path(category_id)[:-1]):
+                        stale.discard(category_id)
+            for category_id in stale:
+                self.refresh(category_id)
+            self._stale.clear()
@@ -18,3 +18,16 @@ def authenticate(api_key, api_url, **kwargs):
     # Login.
     muddle.authenticate(api_key, api_url)
     return muddle
+
+
+async def authenticate_async(api_key, api_url, **kwargs):
+    """Returns an asyncio muddle instance, with API key and url set."""
+
+    # Imported here so importing muddle doesn't import asyncio.
+    from .aio import AsyncMuddle
+
+    muddle = AsyncMuddle(**kwargs)
+
+    # Login.
+    await muddle.authenticate(api_key, api_url)
+    return muddle
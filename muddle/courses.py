@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.courses
+--------------
+
+Paged enumeration of a site's courses, in constant memory.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .batch import DEFAULT_CHUNK_SIZE
+from .exceptions import MuddleError, raise_for_moodle_error
+from .params import courses_by_field_params, courses_by_ids_params
+
+# Most ids a page asks for. They're sent as one comma-separated value, so
+# this only keeps the request a sensible size.
+MAX_WINDOW = 1000
+
+# Consecutive unused course ids after which, if courses are still missing,
+# paging gives up.
+MAX_GAP = 20000
+
+
+def iter_courses(client, category=None, fields=None,
+                 batch_size=DEFAULT_CHUNK_SIZE, prefetch=True,
+                 max_gap=MAX_GAP):
+    """
+    Yields every course on the site, or in a category, one at a time
+
+    Site-wide, courses are fetched with core_course_get_courses_by_field
+    in pages of consecutive ids, in id order, until as many courses have
+    been seen as the site's categories count. Courses the token can't
+    view are left out of a page rather than failing it, as
+    core_course_get_courses would. Only the page being read, and
+    the next one if prefetching, are held in memory, so sites of any
+    size can be listed. The id range asked for adapts to how sparse the
+    ids are, so gaps left by deleted courses don't cost a call per page.
+    Courses created while iterating may be missed.
+
+    The count only covers categories the token can see, and includes
+    courses left out because the token can't view them, such as hidden
+    courses without moodle/course:viewhiddencourses. If max_gap unused
+    ids in a row go by before that many courses have been seen,
+    :class:`muddle.exceptions.MuddleError` is raised rather than
+    stopping short, once every course found has been yielded; with
+    courses left out, that's how paging ends.
+
+    A category's courses come from a single
+    core_course_get_courses_by_field call.
+
+    :param client: An authenticated :class:`muddle.api.Muddle`
+    :param int category: (optional) Only list the courses directly in \
+        this category
+    :param fields: (optional) Fields to keep from each course; others \
+        are dropped as soon as a page arrives. Defaults to every field.
+    :param int batch_size: (optional) Defaults to 100. Courses per page
+    :param bool prefetch: (optional) Defaults to True. Fetch the next page \
+        in the background while the current one is consumed
+    :param int max_gap: (optional) Defaults to 20000. Unused ids in a row \
+        after which courses still missing are given up on
+    """
+
+    if category is not None:
+        response = client._request(
+            'post', courses_by_field_params('category', category))
+        courses = raise_for_moodle_error(response.json())['courses']
+        for course in courses:
+            yield _project(course, fields)
+        return
+
+    for page in _pages(client, fields, batch_size, prefetch, max_gap):
+        yield from page
+
+
+def _pages(client, fields, batch_size, prefetch, max_gap):
+    """ Yields pages of courses, fetching the next while one is read """
+
+    total = sum(category.get('coursecount', 0)
+                for category in client.category_tree())
+    pager = _Pager(client, fields, batch_size, total, max_gap)
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    upcoming = None
+    try:
+        window = pager.next_window()
+        while window is not None:
+            if upcoming is None:
+                page = pager.fetch(window)
+            else:
+                page = upcoming.result()
+            window = pager.next_window(window, page)
+            if executor is not None and window is not None:
+                upcoming = executor.submit(pager.fetch, window)
+            yield page
+    finally:
+        if upcoming is not None:
+            upcoming.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+class _Pager():
+    """ Works out which course ids to ask for next """
+
+    def __init__(self, client, fields, batch_size, total, max_gap=MAX_GAP):
+        self.client = client
+        self.fields = fields
+        self.batch_size = min(batch_size, MAX_WINDOW)
+        self.total = total
+        self.max_gap = max_gap
+        self.seen = 0
+        self.start = 1
+        self.gap = 0
+
+    def fetch(self, window):
+        ids = range(window[0], window[1])
+        response = self.client._request('post', courses_by_ids_params(ids))
+        courses = raise_for_moodle_error(response.json())['courses']
+        return [_project(course, self.fields) for course in courses
+                # The site's front page is returned as a course too.
+                if course.get('format') != 'site']
+
+    def next_window(self, window=None, page=None):
+        """
+        Returns the (first, last + 1) ids of the next page after window
+        came back as page, or None once every course has been seen
+
+        :raises muddle.exceptions.MuddleError: if max_gap ids in a row \
+            were unused while courses are still missing
+        """
+
+        size = self.batch_size
+        if window is not None:
+            size = window[1] - window[0]
+            self.seen += len(page)
+            if page:
+                self.gap = 0
+                # Aim for a full page next time, given how dense ids are.
+                size = size * self.batch_size // len(page)
+            else:
+                self.gap += size
+                size *= 2
+        if self.seen >= self.total:
+            return None
+        if self.gap >= self.max_gap:
+            raise MuddleError(
+                'Found {} of {} courses; none in the {} ids after id {}'
+                .format(self.seen, self.total, self.gap,
+                        self.start - self.gap - 1))
+        size = max(self.batch_size, min(size, MAX_WINDOW))
+        window = (self.start, self.start + size)
+        self.start += size
+        return window
+
+
+def _project(course, fields):
+    if fields is None:
+        return course
+    return dict((field, course.get(field)) for field in fields)
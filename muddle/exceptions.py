@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.exceptions
+-----------------
+
+Exceptions raised by muddle.py.
+"""
+
+
+class MuddleError(Exception):
+    """ Base class for muddle errors """
+
+
+class MoodleError(MuddleError):
+    """ An exception reported back by the Moodle web service """
+
+    def __init__(self, data):
+        self.exception = data.get('exception')
+        self.errorcode = data.get('errorcode')
+        self.message = data.get('message')
+        self.debuginfo = data.get('debuginfo')
+        super().__init__('{}: {}'.format(self.errorcode, self.message))
+
+
+class TransportError(MuddleError):
+    """ A call couldn't be sent, or its response couldn't be read """
+
+
+class TransportTimeout(TransportError):
+    """ The server didn't respond in time """
+
+
+def is_moodle_error(data):
+    """ Checks whether decoded JSON is a Moodle exception response """
+
+    return isinstance(data, dict) and 'exception' in data
+
+
+def raise_for_moodle_error(data):
+    """ Raises :class:`MoodleError` if data is an exception response """
+
+    if is_moodle_error(data):
+        raise MoodleError(data)
+    return data
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.jobs
+-----------
+
+Background queue for slow backup and restore based calls, i.e. course
+duplicates and imports.
+"""
+
+from concurrent.futures import (ThreadPoolExecutor, wait as wait_futures,
+                                as_completed as futures_completed)
+import threading
+
+from .exceptions import raise_for_moodle_error
+
+DEFAULT_WORKERS = 2
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class Job():
+    """
+    Handle for a call submitted to a :class:`JobQueue`
+
+    :param string name: What the job does, e.g. ``duplicate``
+    :param args: The arguments the job was submitted with
+    :param future: The :class:`concurrent.futures.Future` running the job
+    """
+
+    def __init__(self, name, args, future):
+        self.name = name
+        self.args = args
+        self.future = future
+
+    def __repr__(self):
+        return '<Job {}{!r}: {}>'.format(self.name, self.args, self.status)
+
+    @property
+    def status(self):
+        """ One of pending, running, done, failed or cancelled """
+
+        if self.future.cancelled():
+            return CANCELLED
+        if self.future.running():
+            return RUNNING
+        if not self.future.done():
+            return PENDING
+        if self.future.exception() is not None:
+            return FAILED
+        return DONE
+
+    def done(self):
+        return self.future.done()
+
+    def cancel(self):
+        """
+        Cancels the job if it hasn't started. Returns whether it was
+        cancelled; a job already running on the server can't be stopped.
+        """
+
+        return self.future.cancel()
+
+    def result(self, timeout=None):
+        """
+        Waits for the job and returns Moodle's decoded response
+
+        :param float timeout: (optional) Seconds to wait. Raises \
+            :class:`concurrent.futures.TimeoutError` if the job isn't \
+            done by then.
+        :raises muddle.exceptions.MoodleError: if Moodle rejected the call
+        """
+
+        return self.future.result(timeout)
+
+    def exception(self, timeout=None):
+        """ Waits for the job and returns the exception it failed with """
+
+        return self.future.exception(timeout)
+
+
+class JobQueue():
+    """
+    Runs course duplicates and imports on a bounded pool of workers
+
+    Each of these runs a full backup and restore on the Moodle server, so
+    workers caps how many the server is asked to do at once.
+
+    Example Usage::
+
+    >>> import muddle
+    >>> moodle = muddle.authenticate(API_KEY, API_URL)
+    >>> with moodle.jobs(workers=4, timeout=1800) as queue:
+    ...     jobs = [queue.duplicate(course_id, name, name, 20)
+    ...             for course_id, name in templates]
+    ...     for job in queue.as_completed(jobs):
+    ...         print(job.args, job.status)
+
+    :param client: An authenticated :class:`muddle.api.Muddle`
+    :param int workers: (optional) Defaults to 2. Jobs run at once
+    :param float timeout: (optional) Seconds each call may take, \
+        overriding the client's timeout
+    """
+
+    def __init__(self, client, workers=DEFAULT_WORKERS, timeout=None):
+        self.client = client
+        self.timeout = timeout
+        self.jobs = []
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def duplicate(self, course_id, fullname, shortname, categoryid,
+                  visible=True, **kwargs):
+        """
+        Queues a course duplicate, see :meth:`muddle.api.Course.duplicate`
+
+        :returns: :class:`Job` whose result is the new course's id and \
+            shortname
+        """
+
+        def run():
+            course = self._course(course_id)
+            return course.duplicate(fullname, shortname, categoryid,
+                                    visible, **kwargs)
+
+        return self._submit('duplicate', (course_id, fullname, shortname,
+                                          categoryid), run)
+
+    def export_data(self, course_id, export_to, delete_content=False):
+        """
+        Queues a course import, see :meth:`muddle.api.Course.export_data`
+
+        :returns: :class:`Job`
+        """
+
+        def run():
+            course = self._course(course_id)
+            return course.export_data(export_to, delete_content)
+
+        return self._submit('export_data', (course_id, export_to), run)
+
+    def wait(self, jobs=None, timeout=None):
+        """
+        Waits for jobs (by default every job queued) to finish
+
+        :returns: (done, not_done) sets of :class:`Job`
+        """
+
+        jobs = self._jobs(jobs)
+        by_future = dict((job.future, job) for job in jobs)
+        done, not_done = wait_futures(by_future, timeout)
+        return (set(by_future[future] for future in done),
+                set(by_future[future] for future in not_done))
+
+    def as_completed(self, jobs=None, timeout=None):
+        """ Yields jobs (by default every job queued) as they finish """
+
+        by_future = dict((job.future, job) for job in self._jobs(jobs))
+        for future in futures_completed(by_future, timeout):
+            yield by_future[future]
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        """
+        Stops accepting jobs
+
+        :param bool wait: (optional) Defaults to True. Wait for queued \
+            jobs to finish
+        :param bool cancel_pending: (optional) Defaults to False. Cancel \
+            jobs that haven't started
+        """
+
+        if cancel_pending:
+            for job in self._jobs(None):
+                job.cancel()
+        self._executor.shutdown(wait=wait)
+
+    def _course(self, course_id):
+        course = self.client.course(course_id)
+        if self.timeout is not None:
+            course.timeout = self.timeout
+        return course
+
+    def _submit(self, name, args, run):
+        def call():
+            return raise_for_moodle_error(run().json())
+
+        job = Job(name, args, self._executor.submit(call))
+        with self._lock:
+            self.jobs.append(job)
+        return job
+
+    def _jobs(self, jobs):
+        if jobs is None:
+            with self._lock:
+                return list(self.jobs)
+        return list(jobs)
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.metrics
+--------------
+
+Per web service function counters, latency histograms and request hooks.
+"""
+
+import threading
+
+# Upper bounds, in seconds, of the latency histogram's buckets.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+INF = float('inf')
+
+
+class Metrics():
+    """
+    Records every call a client makes, keyed by wsfunction
+
+    Counts calls, errors, retries, hedged calls, cache hits, calls
+    coalesced into one already in flight, and bytes sent and received, and
+    keeps a histogram of call latencies. Hooks registered with
+    :meth:`add_hook` are called before and after each call sent to the
+    server, e.g. to forward timings to another metrics system.
+
+    Example Usage::
+
+    >>> import muddle
+    >>> metrics = muddle.Metrics()
+    >>> moodle = muddle.authenticate(API_KEY, API_URL, metrics=metrics)
+    >>> moodle.course(10).contents()
+    >>> metrics.snapshot()['core_course_get_contents']['latency']['p50']
+    0.05
+
+    :param buckets: (optional) Ascending upper bounds, in seconds, of the \
+        latency histogram's buckets
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets) + (INF,)
+        self._functions = {}
+        self._before = []
+        self._after = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, event, hook):
+        """
+        Registers a hook to be called for every call sent to the server
+
+        ``before`` hooks are called as ``hook(wsfunction, params)`` just
+        before a call is sent; params don't include the token. ``after``
+        hooks are called as ``hook(wsfunction, response, elapsed, error)``
+        once it returns or fails, with response None if it raised error.
+        Calls answered from the cache, or by another call in flight, don't
+        reach the hooks.
+
+        :param string event: ``before`` or ``after``
+        :param hook: Callable
+        """
+
+        self._hooks(event).append(hook)
+
+    def remove_hook(self, event, hook):
+        """ Unregisters a hook added with :meth:`add_hook` """
+
+        self._hooks(event).remove(hook)
+
+    def _hooks(self, event):
+        if event == 'before':
+            return self._before
+        if event == 'after':
+            return self._after
+        raise ValueError('Unknown hook event: {}'.format(event))
+
+    def before(self, wsfunction, params):
+        """ Called by the client as a call is sent """
+
+        for hook in list(self._before):
+            hook(wsfunction, params)
+
+    def after(self, wsfunction, response, elapsed, error=None):
+        """ Called by the client once a call returns or fails """
+
+        if response is None:
+            self.observe(wsfunction, elapsed, error=True)
+        else:
+            self.observe(wsfunction, elapsed,
+                         error=response.status_code >= 400,
+                         moodle_error=_moodle_error(response),
+                         bytes_sent=response.bytes_sent,
+                         bytes_received=_response_size(response))
+        for hook in list(self._after):
+            hook(wsfunction, response, elapsed, error)
+
+    def observe(self, wsfunction, elapsed, error=False, moodle_error=False,
+                bytes_sent=0, bytes_received=0):
+        """ Records a call's latency, size and outcome """
+
+        with self._lock:
+            stats = self._stats(wsfunction)
+            stats.calls += 1
+            stats.errors += bool(error)
+            stats.moodle_errors += bool(moodle_error)
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.latency_sum += elapsed
+            stats.latency_min = min(stats.latency_min, elapsed)
+            stats.latency_max = max(stats.latency_max, elapsed)
+            for index, bound in enumerate(self.buckets):
+                if elapsed <= bound:
+                    stats.counts[index] += 1
+                    break
+
+    def record_retry(self, wsfunction):
+        """ Counts a call being sent again """
+
+        with self._lock:
+            self._stats(wsfunction).retries += 1
+
+    def record_hedge(self, wsfunction, won=False):
+        """
+        Counts a slow call being sent a second time, and whether the
+        second copy answered first
+        """
+
+        with self._lock:
+            stats = self._stats(wsfunction)
+            stats.hedges += 1
+            stats.hedges_won += bool(won)
+
+    def record_cache_hit(self, wsfunction):
+        """ Counts a call answered from the cache """
+
+        with self._lock:
+            self._stats(wsfunction).cache_hits += 1
+
+    def record_coalesced(self, wsfunction):
+        """ Counts a call that shared another in-flight call's response """
+
+        with self._lock:
+            self._stats(wsfunction).coalesced += 1
+
+    def percentile(self, wsfunction, pct):
+        """
+        Estimates a latency percentile for wsfunction from the histogram,
+        as the upper bound of the bucket it falls in. Returns None before
+        any calls are recorded.
+        """
+
+        with self._lock:
+            stats = self._functions.get(wsfunction)
+            if stats is None:
+                return None
+            return self._percentile(stats, pct)
+
+    def _percentile(self, stats, pct):
+        total = sum(stats.counts)
+        if not total:
+            return None
+        rank = total * pct / 100.0
+        seen = 0
+        for bound, count in zip(self.buckets, stats.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, stats.latency_max)
+        return stats.latency_max
+
+    def snapshot(self, reset=False):
+        """
+        Returns every counter as plain dicts, keyed by wsfunction
+
+        The histogram's ``buckets`` are (upper bound, count) pairs, with
+        counts per bucket rather than cumulative. The last bucket, bound
+        None, counts calls slower than every bound.
+
+        :param bool reset: (optional) Defaults to False. Start counting \
+            afresh once the snapshot is taken, e.g. when exporting \
+            periodically
+        """
+
+        with self._lock:
+            snapshot = dict((wsfunction, self._export(stats))
+                            for wsfunction, stats in self._functions.items())
+            if reset:
+                self._functions = {}
+        return snapshot
+
+    def reset(self):
+        """ Zeroes every counter """
+
+        with self._lock:
+            self._functions = {}
+
+    def _stats(self, wsfunction):
+        stats = self._functions.get(wsfunction)
+        if stats is None:
+            stats = self._functions[wsfunction] = _Stats(len(self.buckets))
+        return stats
+
+    def _export(self, stats):
+        timed = sum(stats.counts)
+        return {
+            'calls': stats.calls,
+            'errors': stats.errors,
+            'moodle_errors': stats.moodle_errors,
+            'retries': stats.retries,
+            'hedges': stats.hedges,
+            'hedges_won': stats.hedges_won,
+            'cache_hits': stats.cache_hits,
+            'coalesced': stats.coalesced,
+            'bytes_sent': stats.bytes_sent,
+            'bytes_received': stats.bytes_received,
+            'latency': {
+                'count': timed,
+                'sum': stats.latency_sum,
+                'min': stats.latency_min if timed else None,
+                'max': stats.latency_max if timed else None,
+                'p50': self._percentile(stats, 50),
+                'p95': self._percentile(stats, 95),
+                'p99': self._percentile(stats, 99),
+                'buckets': list(zip(self.buckets[:-1] + (None,),
+                                    stats.counts)),
+            },
+        }
+
+
+class _Stats():
+    __slots__ = ('calls', 'errors', 'moodle_errors', 'retries', 'hedges',
+                 'hedges_won', 'cache_hits', 'coalesced', 'bytes_sent',
+                 'bytes_received', 'latency_sum', 'latency_min',
+                 'latency_max', 'counts')
+
+    def __init__(self, buckets):
+        self.calls = 0
+        self.errors = 0
+        self.moodle_errors = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency_sum = 0.0
+        self.latency_min = INF
+        self.latency_max = 0.0
+        self.counts = [0] * buckets
+
+
+def _response_size(response):
+    length = response.headers.get('Content-Length')
+    if length is not None:
+        return int(length)
+    if response.consumed:
+        return len(response.content)
+    # A streamed body of unknown length, not read yet.
+    return 0
+
+
+def _moodle_error(response):
+    """
+    Cheaply spots a Moodle exception without decoding the body; Moodle
+    reports them as a JSON object starting with its exception class.
+    """
+
+    if not response.consumed:
+        return False
+    return response.content[:16].lstrip().startswith(b'{"exception"')
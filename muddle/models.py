@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.models
+-------------
+
+Compact objects for course contents, as an alternative to the nested
+dicts returned by :meth:`muddle.api.Course.contents`.
+"""
+
+import sys
+
+
+class _Model():
+    """
+    Base for the content models
+
+    Known fields live in slots, and values of the fields listed in
+    _interned are interned since they repeat across every module. Any
+    field Moodle returns that isn't known is kept in ``extra``.
+    """
+
+    __slots__ = ('extra',)
+    _fields = ()
+    _interned = ()
+
+    def __init__(self, data):
+        data = dict(data)
+        for field in self._fields:
+            val = data.pop(field, None)
+            if field in self._interned and isinstance(val, str):
+                val = sys.intern(val)
+            setattr(self, field, val)
+        self.extra = data or None
+
+    def as_dict(self):
+        """
+        Returns the object as a dict, in Moodle's format.
+        Null or missing fields are left out.
+        """
+
+        data = dict((field, getattr(self, field)) for field in self._fields
+                    if getattr(self, field) is not None)
+        data.update(self.extra or {})
+        return data
+
+    def __repr__(self):
+        return '<{} {!r}>'.format(type(self).__name__, self._label())
+
+    def _label(self):
+        return getattr(self, 'id', None)
+
+
+class Content(_Model):
+    """ A file or url attached to a module """
+
+    _fields = ('type', 'filename', 'filepath', 'filesize', 'fileurl',
+               'content', 'timecreated', 'timemodified', 'sortorder',
+               'mimetype', 'isexternalfile', 'userid', 'author', 'license')
+    _interned = frozenset(['type', 'filepath', 'mimetype', 'author',
+                           'license'])
+    __slots__ = _fields
+
+    def _label(self):
+        return self.filename
+
+
+class Module(_Model):
+    """ An activity or resource on the course page """
+
+    _fields = ('id', 'url', 'name', 'instance', 'description', 'visible',
+               'uservisible', 'modicon', 'modname', 'modplural',
+               'availability', 'indent', 'completion', 'contents')
+    _interned = frozenset(['modicon', 'modname', 'modplural'])
+    __slots__ = _fields
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.contents = tuple(Content(content)
+                              for content in self.contents or ())
+
+    def as_dict(self):
+        data = super().as_dict()
+        data['contents'] = [content.as_dict() for content in self.contents]
+        return data
+
+
+class Section(_Model):
+    """ A section (topic or week) of the course page """
+
+    _fields = ('id', 'name', 'visible', 'summary', 'summaryformat',
+               'section', 'hiddenbynumsections', 'uservisible', 'modules')
+    __slots__ = _fields
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.modules = tuple(Module(module) for module in self.modules or ())
+
+    def as_dict(self):
+        data = super().as_dict()
+        data['modules'] = [module.as_dict() for module in self.modules]
+        return data
+
+
+class CourseContents():
+    """
+    The sections of a course page, indexed by module id and section number
+
+    Example Usage::
+
+    >>> import muddle
+    >>> contents = muddle.course(10).contents(typed=True)
+    >>> contents.module(123).modname
+    'forum'
+    >>> [module.name for module in contents.section(2).modules]
+
+    :param int course_id: The course the contents belong to
+    :param sections: Iterable of section dicts, as returned by Moodle
+    """
+
+    __slots__ = ('course_id', 'sections', '_modules', '_sections')
+
+    def __init__(self, course_id, sections):
+        self.course_id = course_id
+        self.sections = tuple(Section(section) for section in sections)
+        self._sections = dict((section.section, section)
+                              for section in self.sections)
+        self._modules = dict((module.id, module)
+                             for section in self.sections
+                             for module in section.modules)
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def __len__(self):
+        return len(self.sections)
+
+    def __repr__(self):
+        return '<CourseContents {!r}: {} sections, {} modules>'.format(
+            self.course_id, len(self.sections), len(self._modules))
+
+    def section(self, number):
+        """ Returns the section with the given section number """
+
+        return self._sections[number]
+
+    def module(self, module_id):
+        """ Returns the module with the given id """
+
+        return self._modules[module_id]
+
+    def modules(self):
+        """ Iterates over every module on the course page """
+
+        return iter(self._modules.values())
+
+    def as_list(self):
+        """ Returns the contents as a list of dicts, in Moodle's format """
+
+        return [section.as_dict() for section in self.sections]
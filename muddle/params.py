@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.params
+-------------
+
+Serializes web service parameters into Moodle's bracket notation.
+"""
+
+
+def flatten(fields, out=None):
+    """
+    Flattens nested dicts and lists into Moodle's bracket notation
+
+    Bools are sent as 0 or 1, and None values are left out.
+
+    >>> flatten({'courses': [{'fullname': 'A', 'visible': True}]})
+    {'courses[0][fullname]': 'A', 'courses[0][visible]': 1}
+
+    :param dict fields: Parameters to flatten
+    :param dict out: (optional) Dict to add the flattened parameters to
+    """
+
+    if out is None:
+        out = {}
+    for key, val in fields.items():
+        _flatten_into(out, key, val)
+    return out
+
+
+def _flatten_into(out, prefix, val):
+    if isinstance(val, dict):
+        for key, item in val.items():
+            _flatten_into(out, prefix + '[' + key + ']', item)
+    elif isinstance(val, (list, tuple)):
+        for index, item in enumerate(val):
+            _flatten_into(out, prefix + '[' + str(index) + ']', item)
+    elif isinstance(val, bool):
+        out[prefix] = int(val)
+    elif val is not None:
+        out[prefix] = val
+
+
+class Schema():
+    """
+    The fields a web service function accepts, compiled once
+
+    Functions taking an array of objects (e.g. ``courses`` for
+    core_course_create_courses) name it as array, and the fields then
+    describe each object in it.
+
+    :param string wsfunction: Web service function name
+    :param string array: (optional) Name of the array parameter
+    :param required: (optional) Fields that must be given
+    :param options: (optional) Fields that may be given
+    """
+
+    def __init__(self, wsfunction, array=None, required=(), options=()):
+        self.wsfunction = wsfunction
+        self.array = array
+        self.required = frozenset(required)
+        self.fields = self.required | frozenset(options)
+
+    def error(self, fields):
+        """ Returns a ValueError describing what's wrong with fields """
+
+        invalid = fields.keys() - self.fields
+        if invalid:
+            return ValueError('Invalid option(s) for {}: {}'.format(
+                self.wsfunction, ', '.join(sorted(invalid))))
+        missing = self.required - fields.keys()
+        if missing:
+            return ValueError('Missing field(s) for {}: {}'.format(
+                self.wsfunction, ', '.join(sorted(missing))))
+
+    def check(self, fields):
+        """ Raises ValueError unless fields fit the schema """
+
+        error = self.error(fields)
+        if error is not None:
+            raise error
+        return fields
+
+    def params(self, fields):
+        """
+        Serializes a call's parameters. For array functions, fields is
+        the list of objects to send.
+        """
+
+        params = {'wsfunction': self.wsfunction}
+        if self.array:
+            _flatten_into(params, self.array, fields)
+        else:
+            flatten(fields, params)
+        return params
+
+
+COURSE_OPTIONS = ['idnumber', 'summaryformat',
+                  'format', 'showgrades',
+                  'newsitems', 'startdate',
+                  'maxbytes', 'showreports',
+                  'visible', 'groupmode',
+                  'groupmodeforce', 'defaultgroupingid',
+                  'enablecompletion', 'completionstartonenrol',
+                  'completionnotify', 'lang',
+                  'forcetheme']
+
+DUPLICATE_OPTIONS = ['activities', 'blocks',
+                     'filters', 'users',
+                     'role_assignments', 'comments',
+                     'usercompletion', 'logs',
+                     'grade_histories']
+
+CATEGORY_CREATE_OPTIONS = ['parent', 'idnumber',
+                           'description',
+                           'descriptionformat',
+                           'theme']
+
+CATEGORY_UPDATE_OPTIONS = ['name', 'idnumber', 'parent',
+                           'description', 'descriptionformat',
+                           'theme']
+
+CREATE_COURSES = Schema('core_course_create_courses', 'courses',
+                        required=['fullname', 'shortname', 'categoryid'],
+                        options=COURSE_OPTIONS)
+
+DELETE_COURSES = Schema('core_course_delete_courses', 'courseids')
+
+UPDATE_COURSES = Schema('core_course_update_courses', 'courses',
+                        required=['id'],
+                        options=['fullname', 'shortname', 'categoryid',
+                                 'summary'] + COURSE_OPTIONS)
+
+GET_COURSES = Schema('core_course_get_courses', options=['options'])
+
+GET_COURSES_BY_FIELD = Schema('core_course_get_courses_by_field',
+                              options=['field', 'value'])
+
+GET_CONTENTS = Schema('core_course_get_contents',
+                      required=['courseid'])
+
+DUPLICATE_COURSE = Schema('core_course_duplicate_course',
+                          required=['courseid', 'fullname', 'shortname',
+                                    'categoryid'],
+                          options=['visible', 'options'])
+
+# The backup settings duplicate_course takes as name/value option pairs.
+DUPLICATE_COURSE_OPTIONS = Schema('core_course_duplicate_course',
+                                  options=DUPLICATE_OPTIONS)
+
+IMPORT_COURSE = Schema('core_course_import_course',
+                       required=['importfrom', 'importto'],
+                       options=['deletecontent'])
+
+GET_CATEGORIES = Schema('core_course_get_categories',
+                        options=['criteria', 'addsubcategories'])
+
+CREATE_CATEGORIES = Schema('core_course_create_categories', 'categories',
+                           required=['name'],
+                           options=CATEGORY_CREATE_OPTIONS)
+
+DELETE_CATEGORIES = Schema('core_course_delete_categories', 'categories',
+                           required=['id'],
+                           options=['newparent', 'recursive'])
+
+UPDATE_CATEGORIES = Schema('core_course_update_categories', 'categories',
+                           required=['id'],
+                           options=CATEGORY_UPDATE_OPTIONS)
+
+
+# Parameter builders for each endpoint, shared by the blocking client in
+# muddle.api and the asyncio client in muddle.aio. They raise ValueError
+# for options the endpoint doesn't accept.
+
+def create_course_params(fullname, shortname, category_id, options):
+    course = dict(options, fullname=fullname, shortname=shortname,
+                  categoryid=category_id)
+    return CREATE_COURSES.params([CREATE_COURSES.check(course)])
+
+
+def delete_course_params(course_id):
+    return DELETE_COURSES.params([course_id])
+
+
+def courses_params(course_ids=None):
+    if course_ids is None:
+        return GET_COURSES.params({})
+    return GET_COURSES.params({'options': {'ids': list(course_ids)}})
+
+
+def courses_by_field_params(field, value):
+    return GET_COURSES_BY_FIELD.params({'field': field, 'value': value})
+
+
+def courses_by_ids_params(course_ids=None):
+    if course_ids is None:
+        return GET_COURSES_BY_FIELD.params({})
+    return courses_by_field_params(
+        'ids', ','.join(str(course_id) for course_id in course_ids))
+
+
+def contents_params(course_id):
+    return GET_CONTENTS.params({'courseid': course_id})
+
+
+def duplicate_params(course_id, fullname, shortname, categoryid,
+                     visible, options):
+    DUPLICATE_COURSE_OPTIONS.check(options)
+    return DUPLICATE_COURSE.params({
+        'courseid': course_id,
+        'fullname': fullname,
+        'shortname': shortname,
+        'categoryid': categoryid,
+        'visible': bool(visible),
+        'options': [{'name': key, 'value': int(val)}
+                    for key, val in options.items()]})
+
+
+def export_params(course_id, export_to, delete_content):
+    return IMPORT_COURSE.params({'importfrom': course_id,
+                                 'importto': export_to,
+                                 'deletecontent': bool(delete_content)})
+
+
+def category_details_params(category_id):
+    return GET_CATEGORIES.params({'criteria': [{'key': 'id',
+                                                'value': category_id}]})
+
+
+def create_category_params(category_name, options):
+    category = dict(options, name=category_name)
+    return CREATE_CATEGORIES.params([CREATE_CATEGORIES.check(category)])
+
+
+def delete_category_params(category_id, new_parent, recursive):
+    category = {'id': category_id, 'recursive': bool(recursive)}
+    if new_parent:
+        category['newparent'] = new_parent
+    return DELETE_CATEGORIES.params([category])
+
+
+def update_category_params(category_id, options):
+    category = dict(options, id=category_id)
+    return UPDATE_CATEGORIES.params([UPDATE_CATEGORIES.check(category)])
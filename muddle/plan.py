@@ -0,0 +1,558 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.plan
+-----------
+
+Reconciles a site's categories and courses with a declared layout,
+making only the calls needed to get there.
+"""
+
+from .batch import chunked, Result, DEFAULT_CHUNK_SIZE
+from .exceptions import MuddleError, MoodleError, raise_for_moodle_error
+from .params import (CREATE_CATEGORIES, CREATE_COURSES, UPDATE_COURSES,
+                     courses_params)
+
+# Category fields compared with the layout. parent is handled separately.
+CATEGORY_FIELDS = ('name', 'idnumber', 'description', 'descriptionformat',
+                   'theme')
+
+# The order operations are applied in: categories must exist before
+# anything is moved or created in them, and be emptied before they're
+# deleted.
+STEPS = (('category', 'create'), ('category', 'update'),
+         ('course', 'create'), ('course', 'update'),
+         ('course', 'delete'), ('category', 'delete'))
+
+SYMBOLS = {'create': '+', 'update': '~', 'move': '>', 'delete': '-'}
+
+
+class Operation():
+    """
+    One change a :class:`Plan` makes
+
+    :param string action: ``create``, ``update``, ``move`` (an update \
+        that also changes the parent category) or ``delete``
+    :param string kind: ``category`` or ``course``
+    :param string key: The object's idnumber for categories, or \
+        shortname for courses
+    :param int object_id: (optional) Id of the existing object
+    :param dict fields: (optional) Fields to send, besides the parent
+    :param parent: (optional) Category the object is created in or moved \
+        to: a category id, or the idnumber of one in the layout
+    :param dict changes: (optional) (current, desired) values of each \
+        field an update changes
+    :param int depth: (optional) How deep the category sits in the \
+        layout, 0 for categories without a parent there
+    """
+
+    def __init__(self, action, kind, key, object_id=None, fields=None,
+                 parent=None, changes=None, depth=0):
+        self.action = action
+        self.kind = kind
+        self.key = key
+        self.id = object_id
+        self.fields = fields or {}
+        self.parent = parent
+        self.changes = changes or {}
+        self.depth = depth
+
+    def __repr__(self):
+        return '<Operation {} {} {!r}>'.format(self.action, self.kind,
+                                               self.key)
+
+    def __str__(self):
+        line = '{} {} {}'.format(SYMBOLS[self.action], self.kind, self.key)
+        if self.action == 'create':
+            return line + ' (in {!r})'.format(self.parent)
+        if self.action == 'delete':
+            return line + ' (id {})'.format(self.id)
+        return line + ': ' + ', '.join(
+            '{} {!r} -> {!r}'.format(field, current, desired)
+            for field, (current, desired) in sorted(self.changes.items()))
+
+    @property
+    def step(self):
+        return self.kind, 'update' if self.action == 'move' else self.action
+
+
+class Plan():
+    """
+    The operations that bring a site in line with a layout
+
+    A layout is a dict of ``categories`` and ``courses``, each a list of
+    dicts. Categories are keyed by ``idnumber`` and take ``name``,
+    ``parent`` and any other field :meth:`muddle.api.Category.create`
+    accepts. Courses are keyed by ``shortname`` and take ``fullname``,
+    ``category`` and any other field :meth:`muddle.api.Course.create`
+    accepts. A parent or category is either the idnumber of a category
+    in the layout, or the id of a category that exists already.
+    Categories without a parent go in root.
+
+    The site's categories and courses are each fetched in a single call
+    and compared with the layout. Existing categories are matched by
+    idnumber, or failing that by name among the categories in the same
+    parent that have no idnumber yet; courses by shortname. Only fields
+    the layout gives, and Moodle reports back, are compared.
+
+    With prune, categories beneath root and courses in them that aren't
+    in the layout are deleted, along with everything still in them once
+    the layout's categories and courses have moved out. Pruning needs a
+    root category: beneath 0 it would delete every category on the site,
+    Miscellaneous included. If moving anything failed, no categories are
+    deleted, since what didn't move would go with them.
+
+    Printing a plan lists its operations without applying anything, as a
+    dry run. :meth:`apply` then makes the changes, packing operations of
+    the same kind into as few calls as possible.
+
+    Example Usage::
+
+    >>> import muddle
+    >>> moodle = muddle.authenticate(API_KEY, API_URL)
+    >>> plan = moodle.plan({
+    ...     'categories': [
+    ...         {'idnumber': 'SCI', 'name': 'Science'},
+    ...         {'idnumber': 'PHYS', 'name': 'Physics', 'parent': 'SCI'}],
+    ...     'courses': [
+    ...         {'shortname': 'PHY101', 'fullname': 'Mechanics',
+    ...          'category': 'PHYS'}]})
+    >>> print(plan)
+    + category SCI (in 0)
+    > category PHYS: parent 7 -> 'SCI'
+    ~ course PHY101: fullname 'Mechanics I' -> 'Mechanics'
+    3 operations in about 3 calls
+    >>> failed = [result for result in plan.apply() if not result.ok]
+
+    :param client: An authenticated :class:`muddle.api.Muddle`
+    :param dict layout: The categories and courses the site should have
+    :param int root: (optional) Defaults to 0. Category layout \
+        categories without a parent go in, and the only branch pruned
+    :param bool prune: (optional) Defaults to False. Delete categories \
+        and courses beneath root that aren't in the layout. Needs a root.
+    :param int chunk_size: (optional) Most objects per call
+    :raises ValueError: if the layout repeats a key, has unknown fields, \
+        refers to a category it doesn't have, or nests categories in a \
+        loop, or if pruning without a root
+    """
+
+    def __init__(self, client, layout, root=0, prune=False,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        if prune and not root:
+            raise ValueError('Pruning needs a root category; beneath 0 it '
+                             'would delete every category on the site')
+        self.client = client
+        self.root = root
+        self.prune = prune
+        self.chunk_size = chunk_size
+        self.operations = []
+        # Layout keys to category ids, filled in as categories are
+        # matched and created.
+        self.ids = {}
+        self._plan(layout)
+
+    def __iter__(self):
+        return iter(self.operations)
+
+    def __len__(self):
+        return len(self.operations)
+
+    def __bool__(self):
+        return bool(self.operations)
+
+    def __str__(self):
+        lines = [str(operation) for operation in self.operations]
+        lines.append('{} operations in about {} calls'.format(
+            len(self.operations), self.calls()))
+        return '\n'.join(lines)
+
+    def summary(self):
+        """ Returns the number of operations of each kind and action """
+
+        summary = {'category': {}, 'course': {}}
+        for operation in self.operations:
+            actions = summary[operation.kind]
+            actions[operation.action] = actions.get(operation.action, 0) + 1
+        return summary
+
+    def calls(self):
+        """ Estimates the web service calls :meth:`apply` will make """
+
+        calls = 0
+        for step in STEPS:
+            operations = self._step(step)
+            if step == ('category', 'create'):
+                levels = {}
+                for operation in operations:
+                    levels.setdefault(operation.depth, []).append(operation)
+                groups = levels.values()
+            else:
+                groups = [operations]
+            for group in groups:
+                calls += len(list(chunked(group, self.chunk_size,
+                                          weight=_weight)))
+        return calls
+
+    def apply(self):
+        """
+        Makes the planned changes
+
+        If Moodle rejects a call, it's split and resent until the failing
+        operations are isolated, so the rest still go ahead. Operations
+        in a category that couldn't be created fail too.
+
+        :returns: list of :class:`muddle.batch.Result`, one per \
+            operation, with the object's id as ``value`` or the reason \
+            it failed as ``error``
+        """
+
+        results = []
+        for step in STEPS:
+            operations = self._step(step)
+            if not operations:
+                continue
+            if step == ('category', 'create'):
+                results.extend(self._create_categories(operations))
+            elif step == ('category', 'update'):
+                results.extend(self._update_categories(operations))
+            elif step == ('course', 'create'):
+                results.extend(self._send(CREATE_COURSES, operations))
+            elif step == ('course', 'update'):
+                results.extend(self._send(UPDATE_COURSES, operations))
+            elif step == ('course', 'delete'):
+                deleted = self.client.course().delete_many(
+                    [op.id for op in operations], self.chunk_size)
+                results.extend(Result(op, value=op.id, error=result.error)
+                               for op, result in zip(operations, deleted))
+            else:
+                results.extend(self._delete_categories(operations, results))
+        return results
+
+    def _delete_categories(self, operations, results):
+        stranded = [result for result in results
+                    if not result.ok and result.item.action == 'move']
+        if stranded:
+            error = MuddleError('Not deleted, as {} moves failed'.format(
+                len(stranded)))
+            return [Result(operation, value=operation.id, error=error)
+                    for operation in operations]
+
+        # Children are deleted before their parents. Anything else left
+        # in them isn't in the layout, and goes with them.
+        operations.sort(key=lambda op: -op.depth)
+        deleted = self.client.category().delete_many(
+            [op.id for op in operations], recursive=True,
+            chunk_size=self.chunk_size)
+        return [Result(op, value=op.id, error=result.error)
+                for op, result in zip(operations, deleted)]
+
+    def _create_categories(self, operations):
+        categories = []
+        for operation in operations:
+            # Parents being created in the same call go by idnumber.
+            parent = operation.parent
+            if parent in self.ids:
+                parent = self.ids[parent]
+            categories.append(dict(operation.fields, parent=parent))
+
+        created = self.client.category().create_many(categories,
+                                                     self.chunk_size)
+        results = []
+        for operation, result in zip(operations, created):
+            if result.ok:
+                operation.id = self.ids[operation.key] = result.value['id']
+            results.append(Result(operation, value=operation.id,
+                                  error=result.error))
+        return results
+
+    def _update_categories(self, operations):
+        # Parents are moved into place before their children.
+        operations.sort(key=lambda op: op.depth)
+        results = []
+        ready = []
+        for operation in operations:
+            try:
+                ready.append((operation, self._fields(operation)))
+            except KeyError as e:
+                results.append(Result(operation, error=_not_created(e)))
+
+        updated = self.client.category().update_many(
+            [fields for operation, fields in ready], self.chunk_size)
+        for (operation, fields), result in zip(ready, updated):
+            results.append(Result(operation, value=operation.id,
+                                  error=result.error))
+        return results
+
+    def _step(self, step):
+        return [operation for operation in self.operations
+                if operation.step == step]
+
+    def _send(self, schema, operations):
+        results = []
+        ready = []
+        for operation in operations:
+            try:
+                ready.append((operation, self._fields(operation)))
+            except KeyError as e:
+                results.append(Result(operation, error=_not_created(e)))
+
+        for chunk in chunked(ready, self.chunk_size,
+                             weight=lambda pair: len(pair[1])):
+            batches = self.client._send_batch(schema, chunk,
+                                              lambda pair: pair[1])
+            for pairs, value, error in batches:
+                for position, (operation, fields) in enumerate(pairs):
+                    results.append(self._outcome(operation, position,
+                                                 value, error))
+
+        categories = [self._lookup(operation.parent)
+                      for operation in operations
+                      if operation.parent is not None]
+        self.client._categories_changed(*[category_id for category_id
+                                          in categories
+                                          if category_id is not None])
+        self.client._contents_changed(*[operation.id
+                                        for operation in operations])
+        return results
+
+    def _fields(self, operation):
+        """ Returns the fields to send, with the parent resolved to an id """
+
+        fields = dict(operation.fields)
+        if operation.id is not None:
+            fields['id'] = operation.id
+        if operation.parent is not None:
+            parent = self._resolve(operation.parent)
+            if operation.kind == 'category':
+                fields['parent'] = parent
+            else:
+                fields['categoryid'] = parent
+        return fields
+
+    def _outcome(self, operation, position, value, error):
+        if error is not None:
+            return Result(operation, error=error)
+        if operation.action == 'create':
+            operation.id = value[position]['id']
+        else:
+            # Courses Moodle refused to update come back as warnings.
+            for warning in (value or {}).get('warnings', []):
+                if str(warning.get('itemid')) == str(operation.id):
+                    return Result(operation, error=MoodleError(
+                        {'errorcode': warning.get('warningcode'),
+                         'message': warning.get('message')}))
+        return Result(operation, value=operation.id)
+
+    def _resolve(self, ref):
+        """ Returns the id of a category id or layout key """
+
+        if isinstance(ref, int):
+            return ref
+        return self.ids[ref]
+
+    def _lookup(self, ref):
+        """ Returns the id of a category id or layout key, if it has one """
+
+        try:
+            return self._resolve(ref)
+        except KeyError:
+            return None
+
+    def _plan(self, layout):
+        categories = _index(layout.get('categories', ()), 'idnumber')
+        courses = _index(layout.get('courses', ()), 'shortname')
+        for key, category in categories.items():
+            fields = dict(category, parent=0)
+            CREATE_CATEGORIES.check(fields)
+            _check_ref(category.get('parent'), categories, key)
+        for key, course in courses.items():
+            fields = dict(course, categoryid=0)
+            fields.pop('category', None)
+            CREATE_COURSES.check(fields)
+            if course.get('category') is None:
+                raise ValueError('Course {} has no category'.format(key))
+            _check_ref(course['category'], categories, key)
+        depths = _depths(categories)
+
+        tree = self.client.category_tree()
+        existing = tree.descendants(0)
+        self._plan_categories(categories, depths, existing, tree)
+        site_courses = self._courses()
+        self._plan_courses(courses, site_courses)
+        if self.prune:
+            self._plan_prune(categories, courses, site_courses, tree)
+
+    def _plan_categories(self, categories, depths, existing, tree):
+        by_idnumber = dict((category['idnumber'], category)
+                           for category in existing
+                           if category.get('idnumber'))
+        by_name = dict(((category['parent'], category['name']), category)
+                       for category in existing
+                       if not category.get('idnumber'))
+
+        for key in sorted(categories, key=lambda key: depths[key]):
+            category = categories[key]
+            parent = category.get('parent')
+            if parent is None:
+                parent = self.root
+            fields = dict((field, val) for field, val in category.items()
+                          if field != 'parent')
+
+            parent_id = self._lookup(parent)
+            current = by_idnumber.get(key)
+            if current is None and parent_id is not None:
+                current = by_name.pop((parent_id, category['name']), None)
+            if current is None:
+                self.operations.append(Operation(
+                    'create', 'category', key, fields=fields,
+                    parent=parent, depth=depths[key]))
+                continue
+
+            self.ids[key] = current['id']
+            changes = _changes(current, fields, CATEGORY_FIELDS)
+            action = 'update'
+            if parent_id != current['parent']:
+                changes['parent'] = (current['parent'], parent)
+                action = 'move'
+            if changes:
+                self.operations.append(Operation(
+                    action, 'category', key, current['id'],
+                    fields=dict((field, fields[field]) for field in changes
+                                if field != 'parent'),
+                    parent=parent if action == 'move' else None,
+                    changes=changes, depth=depths[key]))
+
+    def _courses(self):
+        response = self.client._request('post', courses_params())
+        return [course for course in raise_for_moodle_error(response.json())
+                # The site's front page is returned as a course too.
+                if course.get('format') != 'site']
+
+    def _plan_courses(self, courses, site_courses):
+        by_shortname = dict((course['shortname'], course)
+                            for course in site_courses)
+        for key, course in courses.items():
+            category = course['category']
+            fields = dict((field, val) for field, val in course.items()
+                          if field != 'category')
+            current = by_shortname.get(key)
+            if current is None:
+                self.operations.append(Operation(
+                    'create', 'course', key, fields=fields, parent=category))
+                continue
+
+            changes = _changes(current, fields, fields)
+            action = 'update'
+            category_id = self._lookup(category)
+            if category_id != current['categoryid']:
+                changes['categoryid'] = (current['categoryid'], category)
+                action = 'move'
+            if changes:
+                self.operations.append(Operation(
+                    action, 'course', key, current['id'],
+                    fields=dict((field, fields[field]) for field in changes
+                                if field != 'categoryid'),
+                    parent=category if action == 'move' else None,
+                    changes=changes))
+
+    def _plan_prune(self, categories, courses, site_courses, tree):
+        managed = tree.descendants(self.root)
+        keep = set(self.ids.values())
+        # Categories the layout refers to by id, and their ancestors,
+        # aren't the layout's to delete.
+        refs = [category.get('parent') for category in categories.values()]
+        refs.extend(course['category'] for course in courses.values())
+        for ref in refs:
+            if isinstance(ref, int) and ref:
+                keep.add(ref)
+                keep.update(ancestor['id']
+                            for ancestor in tree.ancestors(ref))
+
+        managed_ids = set(category['id'] for category in managed)
+        if self.root:
+            managed_ids.add(self.root)
+        for course in site_courses:
+            if course['categoryid'] in managed_ids and \
+                    course['shortname'] not in courses:
+                self.operations.append(Operation(
+                    'delete', 'course', course['shortname'], course['id']))
+
+        for category in managed:
+            if category['id'] not in keep:
+                self.operations.append(Operation(
+                    'delete', 'category',
+                    category.get('idnumber') or category['name'],
+                    category['id'],
+                    depth=len(tree.ancestors(category['id']))))
+
+
+def _not_created(error):
+    """ Describes the KeyError of resolving a category that failed """
+
+    return MuddleError('Category {} was not created'.format(error.args[0]))
+
+
+def _weight(operation):
+    """ Roughly how many parameters an operation sends """
+
+    return len(operation.fields) + 2
+
+
+def _index(items, key):
+    """ Returns layout items by key, refusing duplicates """
+
+    index = {}
+    for item in items:
+        if not item.get(key):
+            raise ValueError('Missing {} in {!r}'.format(key, item))
+        if item[key] in index:
+            raise ValueError('Duplicate {}: {}'.format(key, item[key]))
+        index[item[key]] = item
+    return index
+
+
+def _check_ref(ref, categories, key):
+    if ref is None or isinstance(ref, int):
+        return
+    if ref not in categories:
+        raise ValueError('{} refers to unknown category {}'.format(key, ref))
+
+
+def _depths(categories):
+    """ Returns each layout category's depth beneath its top category """
+
+    depths = {}
+    for key in categories:
+        path = []
+        while key in categories and key not in depths:
+            if key in path:
+                raise ValueError('Categories nested in a loop: {}'.format(
+                    ' > '.join(path + [key])))
+            path.append(key)
+            key = categories[key].get('parent')
+        depth = depths.get(key, -1)
+        for key in reversed(path):
+            depth += 1
+            depths[key] = depth
+    return depths
+
+
+def _changes(current, desired, fields):
+    """ Returns (current, desired) for fields that differ """
+
+    return dict((field, (current[field], desired[field]))
+                for field in fields
+                if field in desired and field in current and
+                not _same(current[field], desired[field]))
+
+
+def _same(current, desired):
+    return _text(current) == _text(desired)
+
+
+def _text(val):
+    if val is None:
+        return ''
+    if isinstance(val, bool):
+        return str(int(val))
+    return str(val)
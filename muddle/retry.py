@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.retry
+------------
+
+Retrying and hedging read-only web service calls, so transient failures
+and slow server workers don't reach the caller.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import random
+import threading
+import time
+
+from .exceptions import TransportError
+from .metrics import Metrics
+
+# Statuses a web server or proxy answers with while it's briefly
+# unavailable.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class Retry():
+    """
+    Resends read-only calls that failed in transit, after a jittered
+    exponential backoff
+
+    The n-th retry waits a random time between 0 and backoff * 2 ** n
+    seconds, capped at max_backoff, so clients that failed together don't
+    retry together. A Retry-After header sent with the failure is
+    honoured, within max_backoff. Moodle exceptions are never retried;
+    the same call would fail the same way.
+
+    Example Usage::
+
+    >>> import muddle
+    >>> from muddle.retry import Retry
+    >>> moodle = muddle.authenticate(API_KEY, API_URL,
+    ...                              retry=Retry(attempts=4, backoff=0.2))
+
+    :param int attempts: (optional) Defaults to 3. Tries per call, \
+        counting the first
+    :param float backoff: (optional) Defaults to 0.1. Seconds the first \
+        retry waits at most, doubling for each retry after it
+    :param float max_backoff: (optional) Defaults to 10. Longest wait \
+        between tries
+    :param statuses: (optional) HTTP statuses worth retrying
+    :param errors: (optional) Exceptions worth retrying. Defaults to \
+        :class:`muddle.exceptions.TransportError`, which includes timeouts.
+    """
+
+    def __init__(self, attempts=3, backoff=0.1, max_backoff=10.0,
+                 statuses=RETRY_STATUSES, errors=(TransportError,)):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+        self.errors = tuple(errors)
+
+    def retryable(self, tries, response=None, error=None):
+        """ Whether a call that has been sent tries times should be resent """
+
+        if tries >= self.attempts:
+            return False
+        if error is not None:
+            return isinstance(error, self.errors)
+        return response.status_code in self.statuses
+
+    def delay(self, tries, response=None):
+        """ Returns the seconds to wait before sending the call again """
+
+        delay = random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** (tries - 1)))
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers['Retry-After']))
+            except (KeyError, TypeError, ValueError):
+                pass
+        return min(delay, self.max_backoff)
+
+
+class Hedge():
+    """
+    Sends a second copy of a read-only call that is slower than usual, and
+    takes whichever answer comes first
+
+    A call is hedged once it has taken longer than the given percentile
+    of its wsfunction's recent latencies, so only the slowest few percent
+    of calls cost an extra request. Until min_samples calls of a
+    wsfunction have completed, its calls aren't hedged unless a fixed
+    delay is given.
+
+    Hedged calls run on the hedge's own threads. One hedge can be shared
+    by several clients.
+
+    Example Usage::
+
+    >>> import muddle
+    >>> from muddle.retry import Hedge
+    >>> metrics = muddle.Metrics()
+    >>> moodle = muddle.authenticate(API_KEY, API_URL, hedge=Hedge(),
+    ...                              metrics=metrics)
+    >>> metrics.snapshot()['core_course_get_contents']['hedges']
+    3
+
+    :param int percentile: (optional) Defaults to 95. Latency percentile \
+        after which a call is hedged
+    :param float delay: (optional) Seconds after which to hedge calls \
+        while there are too few latencies to go by. Defaults to not \
+        hedging them.
+    :param float min_delay: (optional) Defaults to 0.01. Shortest wait \
+        before hedging
+    :param float max_delay: (optional) Longest wait before hedging
+    :param int min_samples: (optional) Defaults to 20. Latencies needed \
+        before the percentile is trusted
+    :param int workers: (optional) Defaults to 32. Threads sending calls
+    """
+
+    def __init__(self, percentile=95, delay=None, min_delay=0.01,
+                 max_delay=None, min_samples=20, workers=32):
+        self.percentile = percentile
+        self.delay = delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.latencies = Metrics()
+        self._executor = ThreadPoolExecutor(workers)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def after(self, wsfunction):
+        """
+        Returns the seconds after which to hedge a call of wsfunction, or
+        None not to hedge it
+        """
+
+        with self._lock:
+            samples = self._counts.get(wsfunction, 0)
+        if samples < self.min_samples:
+            delay = self.delay
+        else:
+            delay = self.latencies.percentile(wsfunction, self.percentile)
+        if delay is None:
+            return None
+        if self.max_delay is not None:
+            delay = min(delay, self.max_delay)
+        return max(delay, self.min_delay)
+
+    def call(self, func, wsfunction, metrics=None):
+        """
+        Calls func, calling it again if it's slow, and returns the first
+        result. If both calls fail, the first call's error is raised.
+
+        :param func: Callable sending the call
+        :param string wsfunction: The call's web service function
+        :param metrics: (optional) :class:`muddle.metrics.Metrics` to \
+            count hedges in
+        """
+
+        delay = self.after(wsfunction)
+        first = self._submit(func, wsfunction)
+        if delay is None:
+            return first.result()
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+
+        second = self._submit(func, wsfunction)
+        pending = set([first, second])
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in (first, second):
+                if future in done and future.exception() is None:
+                    if metrics is not None:
+                        metrics.record_hedge(wsfunction,
+                                             won=future is second)
+                    return future.result()
+        if metrics is not None:
+            metrics.record_hedge(wsfunction, won=False)
+        return first.result()
+
+    def close(self):
+        """ Stops the hedge's threads once calls in flight finish """
+
+        self._executor.shutdown()
+
+    def _submit(self, func, wsfunction):
+        start = time.perf_counter()
+        future = self._executor.submit(func)
+
+        def record(future):
+            # Failures say little about how long a call usually takes.
+            if future.exception() is None:
+                self.latencies.observe(wsfunction,
+                                       time.perf_counter() - start)
+                with self._lock:
+                    self._counts[wsfunction] = \
+                        self._counts.get(wsfunction, 0) + 1
+
+        future.add_done_callback(record)
+        return future
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.singleflight
+-------------------
+
+Coalesces identical calls made at the same time into one.
+"""
+
+import threading
+
+
+class SingleFlight():
+    """
+    Runs one call per key at a time, sharing its outcome
+
+    While a call is in flight, callers asking for the same key wait for it
+    and get its result, or its exception, instead of making their own.
+    Once it finishes the key is forgotten, so later callers make a fresh
+    call; caching results is left to :class:`muddle.cache.ResponseCache`.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._calls)
+
+    def do(self, key, func):
+        """
+        Calls func, unless a call for key is already in flight
+
+        :returns: (result, shared), shared being True if the result came \
+            from another caller's call
+        """
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class _Call():
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.sites
+------------
+
+Serves many Moodle sites from one process, sharing workers fairly
+between them.
+"""
+
+from collections import deque
+from concurrent.futures import Future
+import threading
+
+from .api import Muddle
+
+DEFAULT_WORKERS = 16
+DEFAULT_PER_SITE = 4
+
+
+class Sites():
+    """
+    Clients for many Moodle sites, with calls scheduled fairly across them
+
+    Each site gets its own client, with its own connection pool. Calls
+    submitted for any site share one pool of worker threads, handed out
+    round-robin between the sites with calls waiting, so a site with a
+    long backlog can't starve the others. per_site caps how many calls
+    run against any one site at once.
+
+    Example Usage::
+
+    >>> import muddle
+    >>> with muddle.Sites(workers=32, per_site=4, timeout=30) as sites:
+    ...     for tenant in tenants:
+    ...         sites.add(tenant.name, tenant.api_key, tenant.api_url)
+    ...     futures = sites.submit_all(
+    ...         lambda moodle: moodle.category(1).details().json())
+    ...     details = dict((name, future.result())
+    ...                    for name, future in futures.items())
+
+    :param int workers: (optional) Defaults to 16. Calls run at once, \
+        across all sites
+    :param int per_site: (optional) Defaults to 4. Calls run at once \
+        against any one site
+    :param options: (optional) Settings for every site's client, see \
+        :class:`muddle.api.Muddle`
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, per_site=DEFAULT_PER_SITE,
+                 **options):
+        self.per_site = per_site
+        self.options = dict(options)
+        self.options.setdefault('pool_maxsize', per_site)
+        self.clients = {}
+        self._queues = {}
+        self._running = {}
+        self._ring = []
+        self._cursor = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._workers = [threading.Thread(target=self._work, daemon=True)
+                         for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getitem__(self, name):
+        return self.clients[name]
+
+    def __contains__(self, name):
+        return name in self.clients
+
+    def __iter__(self):
+        return iter(list(self.clients))
+
+    def __len__(self):
+        return len(self.clients)
+
+    def add(self, name, api_key, api_url, **options):
+        """
+        Adds a site, returning its authenticated client
+
+        Unlike :func:`muddle.authenticate`, this doesn't make the client
+        the default for endpoints created without one.
+
+        :param name: Any hashable name for the site
+        :param string api_key: The site's web service token
+        :param string api_url: The site's URL
+        :param options: (optional) Client settings for this site, \
+            overriding the ones given to :class:`Sites`
+        """
+
+        client = Muddle(**dict(self.options, **options))
+        client._connect(api_key, api_url)
+        with self._cond:
+            if name in self.clients:
+                self.clients[name].close()
+            else:
+                self._queues[name] = deque()
+                self._running[name] = 0
+                self._ring.append(name)
+            self.clients[name] = client
+        return client
+
+    def remove(self, name):
+        """ Removes a site, cancelling its queued calls """
+
+        with self._cond:
+            client = self.clients.pop(name)
+            for future, call in self._queues.pop(name):
+                future.cancel()
+            self._running.pop(name)
+            index = self._ring.index(name)
+            self._ring.pop(index)
+            if index < self._cursor:
+                self._cursor -= 1
+        client.close()
+
+    def submit(self, name, func, *args, **kwargs):
+        """
+        Queues func(client, \\*args, \\*\\*kwargs) to run against a site
+
+        :returns: :class:`concurrent.futures.Future` of func's result
+        """
+
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Cannot submit calls after close')
+            client = self.clients[name]
+            self._queues[name].append(
+                (future, lambda: func(client, *args, **kwargs)))
+            self._cond.notify()
+        return future
+
+    def submit_all(self, func, *args, **kwargs):
+        """
+        Queues func(client, \\*args, \\*\\*kwargs) against every site
+
+        :returns: dict of site name to :class:`concurrent.futures.Future`
+        """
+
+        return dict((name, self.submit(name, func, *args, **kwargs))
+                    for name in self)
+
+    def pending(self):
+        """ Returns the number of calls queued, by site """
+
+        with self._cond:
+            return dict((name, len(queue))
+                        for name, queue in self._queues.items())
+
+    def close(self, wait=True, cancel_pending=False):
+        """
+        Stops accepting calls and closes every site's connections
+
+        :param bool wait: (optional) Defaults to True. Wait for queued \
+            calls to finish
+        :param bool cancel_pending: (optional) Defaults to False. Cancel \
+            calls that haven't started
+        """
+
+        with self._cond:
+            self._closed = True
+            if cancel_pending:
+                for queue in self._queues.values():
+                    for future, call in queue:
+                        future.cancel()
+                    queue.clear()
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+            for client in self.clients.values():
+                client.close()
+
+    def _next(self):
+        """ Returns the next site, round-robin, with a call ready to run """
+
+        count = len(self._ring)
+        for offset in range(count):
+            name = self._ring[(self._cursor + offset) % count]
+            if self._queues[name] and self._running[name] < self.per_site:
+                self._cursor = (self._cursor + offset + 1) % count
+                return name
+
+    def _work(self):
+        while True:
+            with self._cond:
+                name = self._next()
+                while name is None:
+                    if self._closed and not any(self._queues.values()):
+                        return
+                    self._cond.wait()
+                    name = self._next()
+                future, call = self._queues[name].popleft()
+                self._running[name] += 1
+
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(call())
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    if name in self._running:
+                        self._running[name] -= 1
+                    self._cond.notify_all()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.stream
+-------------
+
+Incremental decoding of large JSON array responses.
+"""
+
+import codecs
+import json
+import re
+
+from .exceptions import raise_for_moodle_error
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\r\n'
+
+_ELEMENT_START = re.compile(r'[^\s,]')
+# A whole string (group 1 is unset if it hasn't finished arriving),
+# or a structural character.
+_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*(")?|[\[\]{},]', re.DOTALL)
+
+
+def iter_json_array(chunks):
+    """
+    Yields the elements of a JSON array one at a time
+
+    Only the element being decoded is held in memory, so elements can be
+    processed while the rest of the array is still downloading. A Moodle
+    exception (a JSON object where the array should be) is raised as
+    :class:`muddle.exceptions.MoodleError`.
+
+    :param chunks: Iterable of bytes making up the JSON document
+    """
+
+    chunks = iter(chunks)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    pos = 0          # Scan position within buf
+    start = None     # Start of the element being scanned
+    depth = 0        # Nesting depth within the element
+    opened = False   # Seen the array's opening bracket
+
+    for chunk in chunks:
+        buf += decoder.decode(chunk)
+
+        if not opened:
+            stripped = buf.lstrip(_WHITESPACE)
+            if not stripped:
+                continue
+            if stripped[0] != '[':
+                # Not an array, most likely an exception object.
+                # These are small, so just read the rest.
+                rest = decoder.decode(b''.join(chunks), final=True)
+                raise_for_moodle_error(json.loads(stripped + rest))
+                raise ValueError('Expected a JSON array')
+            buf = stripped[1:]
+            opened = True
+
+        while True:
+            if start is None:
+                match = _ELEMENT_START.search(buf, pos)
+                if not match:
+                    pos = len(buf)
+                    break
+                pos = match.start()
+                if buf[pos] == ']':
+                    return
+                start = pos
+
+            match = _TOKEN.search(buf, pos)
+            if not match:
+                pos = len(buf)
+                break
+            char = match.group()[0]
+            if char == '"':
+                if match.group(1) is None:
+                    pos = match.start()
+                    break
+            elif depth == 0 and char in ',]':
+                # End of a number, true, false or null element.
+                yield json.loads(buf[start:match.start()])
+                if char == ']':
+                    return
+                start = None
+                pos = match.end()
+                continue
+            elif char in '[{':
+                depth += 1
+            elif char in ']}':
+                depth -= 1
+            pos = match.end()
+
+            if depth == 0:
+                yield json.loads(buf[start:pos])
+                start = None
+
+        # Drop anything already consumed so the buffer only ever holds
+        # the current element.
+        if start is None:
+            buf = buf[pos:]
+            pos = 0
+        elif start:
+            buf = buf[start:]
+            pos -= start
+            start = 0
+
+    raise ValueError('Truncated JSON array')
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.subtree
+--------------
+
+Copies a category branch, with every course in it, e.g. at term rollover.
+"""
+
+import json
+import os
+
+from .exceptions import MoodleError, raise_for_moodle_error
+from .params import CREATE_CATEGORIES, courses_by_field_params
+
+DEFAULT_WORKERS = 2
+
+# Category fields carried over to the copies. idnumber must be unique
+# site-wide, so isn't.
+CATEGORY_FIELDS = ('description', 'descriptionformat', 'theme')
+
+
+class SubtreeCopy():
+    """
+    Copies a category, its subcategories and all their courses under a new
+    parent
+
+    Categories are created a level at a time, parents before children,
+    in as few calls per level as fit in a request. Courses are then
+    duplicated in parallel on a :class:`muddle.jobs.JobQueue`. Progress is
+    written to the checkpoint file as each level and each course finishes,
+    so running the same copy again resumes where a failed run stopped;
+    courses that failed are retried.
+
+    Example Usage::
+
+    >>> import muddle
+    >>> moodle = muddle.authenticate(API_KEY, API_URL)
+    >>> copy = moodle.category(12).copy_subtree(
+    ...     40, ' 2025', checkpoint='rollover-12.json', workers=4)
+    >>> copy.courses
+    {101: 2301, 102: 2302}
+    >>> copy.failed
+    {103: MoodleError('shortnametaken: ...')}
+
+    :param client: An authenticated :class:`muddle.api.Muddle`
+    :param int category_id: Root of the branch to copy
+    :param int parent: Category the copy is created under, 0 for top level
+    :param rename: Suffix appended to each course's full and short names, \
+        or a callable taking a course dict and returning the copy's \
+        (fullname, shortname). Short names must be unique site-wide.
+    :param string checkpoint: (optional) JSON file progress is kept in
+    :param int workers: (optional) Defaults to 2. Courses duplicated at once
+    :param float timeout: (optional) Seconds each duplicate may take
+    :param options: (optional) Backup settings for every duplicate, see \
+        :meth:`muddle.api.Course.duplicate`
+    """
+
+    def __init__(self, client, category_id, parent, rename, checkpoint=None,
+                 workers=DEFAULT_WORKERS, timeout=None, **options):
+        self.client = client
+        self.category_id = category_id
+        self.parent = parent
+        self.rename = rename
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.timeout = timeout
+        self.options = options
+        self.categories = {}
+        self.courses = {}
+        self.started = set()
+        self.failed = {}
+        if checkpoint is not None and os.path.exists(checkpoint):
+            self._load()
+
+    def __repr__(self):
+        return '<SubtreeCopy {} -> {}: {} categories, {} courses, ' \
+            '{} failed>'.format(self.category_id, self.parent,
+                                len(self.categories), len(self.courses),
+                                len(self.failed))
+
+    def run(self):
+        """
+        Copies whatever hasn't been copied yet
+
+        :returns: self, with ``categories`` and ``courses`` mapping source \
+            ids to the copies' ids, and ``failed`` mapping course ids to \
+            the exceptions they failed with
+        :raises muddle.exceptions.MuddleError: if a category can't be \
+            created; the rest of its level is kept, and nothing beneath \
+            the level is copied
+        """
+
+        branch = self.client.category_tree().subtree(self.category_id)
+        self._copy_categories(branch)
+        self._copy_courses(branch)
+        return self
+
+    def _copy_categories(self, branch):
+        # The branch lists parents before children.
+        depths = {}
+        levels = {}
+        for category in branch:
+            depth = depths.get(category['parent'], -1) + 1
+            depths[category['id']] = depth
+            if category['id'] not in self.categories:
+                levels.setdefault(depth, []).append(category)
+
+        for depth in sorted(levels):
+            pending = levels[depth]
+            created = self.client.category().create_many(
+                [self._category_fields(category) for category in pending])
+            error = None
+            for category, result in zip(pending, created):
+                if result.ok:
+                    self.categories[category['id']] = result.value['id']
+                elif error is None:
+                    error = result.error
+            # Keep what was created, so running again carries on.
+            self._save()
+            if error is not None:
+                raise error
+
+    def _category_fields(self, category):
+        fields = dict((field, category[field]) for field in CATEGORY_FIELDS
+                      if category.get(field) is not None)
+        fields['name'] = category['name']
+        if category['id'] == self.category_id:
+            fields['parent'] = self.parent
+        else:
+            fields['parent'] = self.categories[category['parent']]
+        return CREATE_CATEGORIES.check(fields)
+
+    def _copy_courses(self, branch):
+        pending = []
+        for category in branch:
+            for course in self._courses_in(category['id']):
+                if course['id'] not in self.courses:
+                    pending.append(course)
+
+        # A duplicate started by an interrupted run may have finished
+        # without being recorded; look for the copy before making another.
+        for course in pending:
+            if course['id'] in self.started:
+                copied = self._find(self._names(course)[1])
+                if copied is not None:
+                    self.courses[course['id']] = copied['id']
+                    self.failed.pop(course['id'], None)
+                self.started.discard(course['id'])
+        pending = [course for course in pending
+                   if course['id'] not in self.courses]
+
+        with self.client.jobs(self.workers, self.timeout) as queue:
+            jobs = {}
+            for course in pending:
+                fullname, shortname = self._names(course)
+                job = queue.duplicate(
+                    course['id'], fullname, shortname,
+                    self.categories[course['categoryid']],
+                    course.get('visible', True), **self.options)
+                jobs[job] = course['id']
+                self.started.add(course['id'])
+            self._save()
+
+            for job in queue.as_completed(list(jobs)):
+                course_id = jobs[job]
+                error = job.exception()
+                if error is None:
+                    self.courses[course_id] = job.result()['id']
+                    self.failed.pop(course_id, None)
+                else:
+                    self.failed[course_id] = error
+                self.started.discard(course_id)
+                self._save()
+
+    def _courses_in(self, category_id):
+        response = self.client._request(
+            'post', courses_by_field_params('category', category_id))
+        return raise_for_moodle_error(response.json())['courses']
+
+    def _find(self, shortname):
+        response = self.client._request(
+            'post', courses_by_field_params('shortname', shortname))
+        courses = raise_for_moodle_error(response.json())['courses']
+        return courses[0] if courses else None
+
+    def _names(self, course):
+        if callable(self.rename):
+            return self.rename(course)
+        return (course['fullname'] + self.rename,
+                course['shortname'] + self.rename)
+
+    def _load(self):
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        self.categories = dict((int(source), copy) for source, copy
+                               in state['categories'].items())
+        self.courses = dict((int(source), copy) for source, copy
+                            in state['courses'].items())
+        self.started = set(state['started'])
+        self.failed = dict((int(course_id), MoodleError(error))
+                           for course_id, error in state['failed'].items())
+
+    def _save(self):
+        if self.checkpoint is None:
+            return
+        state = {'category_id': self.category_id,
+                 'parent': self.parent,
+                 'categories': self.categories,
+                 'courses': self.courses,
+                 'started': sorted(self.started),
+                 'failed': dict((course_id, _describe(error))
+                                for course_id, error in self.failed.items())}
+        partial = self.checkpoint + '.tmp'
+        with open(partial, 'w') as f:
+            json.dump(state, f)
+        os.replace(partial, self.checkpoint)
+
+
+def _describe(error):
+    """ Returns a failure as Moodle exception data, for the checkpoint """
+
+    if isinstance(error, MoodleError):
+        return {'exception': error.exception, 'errorcode': error.errorcode,
+                'message': error.message, 'debuginfo': error.debuginfo}
+    return {'exception': type(error).__name__, 'message': str(error)}
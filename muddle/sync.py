@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.sync
+-----------
+
+Incremental course contents sync, fetching and reporting only what changed.
+"""
+
+import hashlib
+import json
+import os
+
+from .batch import chunked, DEFAULT_CHUNK_SIZE
+from .exceptions import MoodleError, is_moodle_error, raise_for_moodle_error
+from .params import courses_by_ids_params
+
+DEFAULT_WORKERS = 10
+
+# Course fields that change when the course is edited. timemodified only
+# changes with the course's settings; cacherev whenever anything in the
+# course does, activities included. Older Moodle versions don't return
+# cacherev.
+MARKER_FIELDS = ('timemodified', 'cacherev')
+
+
+def course_markers(client, course_ids=None, batch_size=DEFAULT_CHUNK_SIZE):
+    """
+    Fetches courses' metadata in bulk, returning a dict of course id to
+    marker: the course's :data:`MARKER_FIELDS`, which change whenever it
+    is edited, or None if Moodle returned none of them
+
+    Metadata comes from core_course_get_courses_by_field, as
+    core_course_get_courses doesn't return cacherev. Where Moodle doesn't
+    return cacherev either, only changes to course settings show.
+
+    :param client: An authenticated :class:`muddle.api.Muddle`
+    :param course_ids: (optional) Defaults to every course on the site
+    :param int batch_size: (optional) Courses per request
+    """
+
+    if course_ids is None:
+        batches = [None]
+    else:
+        batches = chunked(course_ids, batch_size)
+
+    markers = {}
+    for batch in batches:
+        response = client._request('post', courses_by_ids_params(batch))
+        courses = raise_for_moodle_error(response.json())['courses']
+        for course in courses:
+            marker = [course.get(field) for field in MARKER_FIELDS]
+            if not any(val is not None for val in marker):
+                marker = None
+            markers[course['id']] = marker
+    return markers
+
+
+def fingerprint(data):
+    """ Returns a short, stable hash of JSON-serializable data """
+
+    encoded = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(encoded.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def fingerprint_contents(contents):
+    """
+    Fingerprints course contents, section by section
+
+    A section's fingerprint covers its own fields and the order of its
+    modules; each module's covers the module and its files.
+
+    :param list contents: Sections, as returned by Moodle
+    :returns: list of [section id, fingerprint, [[module id, \
+        fingerprint], ...]]
+    """
+
+    sections = []
+    for section in contents:
+        modules = section.get('modules') or []
+        fields = dict(section, modules=[module['id'] for module in modules])
+        sections.append([section['id'], fingerprint(fields),
+                         [[module['id'], fingerprint(module)]
+                          for module in modules]])
+    return sections
+
+
+class CourseDiff():
+    """
+    What changed in a course's contents since the last sync
+
+    Each attribute is a list of section or module ids. A module moved to
+    another section counts as modified.
+
+    :param int course_id: The course
+    :param contents: (optional) The course's current contents, as \
+        returned by Moodle
+    :param error: (optional) Exception the course's contents couldn't be \
+        fetched with. The course is retried on the next sync.
+    :param bool deleted: (optional) The course no longer exists
+    """
+
+    def __init__(self, course_id, contents=None, error=None, deleted=False):
+        self.course_id = course_id
+        self.contents = contents
+        self.error = error
+        self.deleted = deleted
+        self.sections_added = []
+        self.sections_removed = []
+        self.sections_modified = []
+        self.modules_added = []
+        self.modules_removed = []
+        self.modules_modified = []
+
+    def __bool__(self):
+        return bool(self.error or self.deleted or self.sections_added or
+                    self.sections_removed or self.sections_modified or
+                    self.modules_added or self.modules_removed or
+                    self.modules_modified)
+
+    def __repr__(self):
+        if self.error is not None:
+            return '<CourseDiff {}: error {!r}>'.format(self.course_id,
+                                                       self.error)
+        if self.deleted:
+            return '<CourseDiff {}: deleted>'.format(self.course_id)
+        return ('<CourseDiff {}: sections +{} -{} ~{}, '
+                'modules +{} -{} ~{}>').format(
+            self.course_id, len(self.sections_added),
+            len(self.sections_removed), len(self.sections_modified),
+            len(self.modules_added), len(self.modules_removed),
+            len(self.modules_modified))
+
+    def compare(self, old, new):
+        """ Fills in the diff from two :func:`fingerprint_contents` """
+
+        old_sections = dict((section[0], section[1]) for section in old)
+        new_sections = dict((section[0], section[1]) for section in new)
+        self.sections_added, self.sections_removed, \
+            self.sections_modified = _compare(old_sections, new_sections)
+        self.modules_added, self.modules_removed, \
+            self.modules_modified = _compare(_modules(old), _modules(new))
+        return self
+
+
+def _compare(old, new):
+    """ Returns the (added, removed, modified) keys between two dicts """
+
+    added = [key for key in new if key not in old]
+    removed = [key for key in old if key not in new]
+    modified = [key for key, val in new.items()
+                if key in old and old[key] != val]
+    return added, removed, modified
+
+
+def _modules(sections):
+    return dict((module_id, (section[0], module_hash))
+                for section in sections
+                for module_id, module_hash in section[2])
+
+
+class ContentsSync():
+    """
+    Fetches course contents only for courses changed since the last sync
+
+    Each course's metadata (``timemodified``, and ``cacherev``, which
+    changes whenever an activity does) is fetched in bulk and compared
+    with what was seen last time. On Moodle versions that don't return
+    cacherev, only changes to course settings are noticed. Only courses
+    whose metadata changed have their contents fetched, and those are
+    fingerprinted section by section and module by module to report
+    exactly what changed.
+
+    Example Usage::
+
+    >>> import muddle
+    >>> moodle = muddle.authenticate(API_KEY, API_URL)
+    >>> sync = moodle.contents_sync('contents-state.json')
+    >>> for diff in sync.sync():
+    ...     reindex(diff.course_id, diff.modules_added +
+    ...             diff.modules_modified)
+    >>> sync.save()
+
+    A course's new fingerprints are only kept once the loop asks for the
+    next diff, so a course whose processing raised is reported again by
+    the next sync.
+
+    :param client: An authenticated :class:`muddle.api.Muddle`
+    :param string path: (optional) JSON file the fingerprints are loaded \
+        from, if it exists, and saved to
+    :param int workers: (optional) Defaults to 10. Concurrent contents \
+        requests
+    :param int batch_size: (optional) Defaults to 100. Courses per \
+        metadata request
+    """
+
+    def __init__(self, client, path=None, workers=DEFAULT_WORKERS,
+                 batch_size=DEFAULT_CHUNK_SIZE):
+        self.client = client
+        self.path = path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.courses = {}
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def load(self, path):
+        """ Loads fingerprints saved by :meth:`save` """
+
+        with open(path) as f:
+            courses = json.load(f)
+        self.courses = dict((int(course_id), state)
+                            for course_id, state in courses.items())
+
+    def save(self, path=None):
+        """ Saves the fingerprints, replacing the file atomically """
+
+        path = path or self.path
+        if path is None:
+            raise ValueError('No path to save the sync state to')
+        partial = path + '.tmp'
+        with open(partial, 'w') as f:
+            json.dump(self.courses, f, separators=(',', ':'))
+        os.replace(partial, path)
+
+    def changed(self, course_ids=None):
+        """
+        Compares course metadata with the last sync
+
+        :param course_ids: (optional) Courses to check. Defaults to every \
+            course on the site, in which case courses no longer on the \
+            site count as deleted.
+        :returns: (changed, deleted): a dict of changed course ids to \
+            their new metadata marker, and a list of deleted course ids
+        """
+
+        if course_ids is not None:
+            course_ids = list(course_ids)
+        return self._changes(self._markers(course_ids), course_ids)
+
+    def _changes(self, markers, course_ids):
+        if course_ids is None:
+            known = self.courses
+        else:
+            known = set(course_ids)
+        deleted = [course_id for course_id in known
+                   if course_id not in markers and
+                   course_id in self.courses]
+        changed = dict((course_id, marker)
+                       for course_id, marker in markers.items()
+                       if course_id not in self.courses or
+                       marker is None or
+                       self.courses[course_id]['marker'] != marker)
+        return changed, deleted
+
+    def sync(self, course_ids=None, force=False):
+        """
+        Yields a :class:`CourseDiff` for each course that changed
+
+        Courses whose metadata changed but whose contents fingerprint the
+        same are updated silently.
+
+        :param course_ids: (optional) Courses to sync. Defaults to every \
+            course on the site.
+        :param bool force: (optional) Defaults to False. Fetch every \
+            course's contents, whatever its metadata says
+        """
+
+        if course_ids is not None:
+            course_ids = list(course_ids)
+        markers = self._markers(course_ids)
+        changed, deleted = self._changes(markers, course_ids)
+        if not force:
+            markers = changed
+
+        for course_id in deleted:
+            yield CourseDiff(course_id, deleted=True)
+            self.courses.pop(course_id, None)
+
+        # Cached contents may predate the change being synced.
+        self.client._contents_changed(*markers)
+        results = self.client.courses_contents(markers, self.workers,
+                                               return_exceptions=True)
+        for course_id, contents in results:
+            if is_moodle_error(contents):
+                contents = MoodleError(contents)
+            if isinstance(contents, Exception):
+                yield CourseDiff(course_id, error=contents)
+                continue
+
+            sections = fingerprint_contents(contents)
+            previous = self.courses.get(course_id, {'sections': []})
+            diff = CourseDiff(course_id, contents).compare(
+                previous['sections'], sections)
+            if diff:
+                yield diff
+            self.courses[course_id] = {'marker': markers[course_id],
+                                       'sections': sections}
+
+    def _markers(self, course_ids):
+        return course_markers(self.client, course_ids, self.batch_size)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.throttle
+---------------
+
+Client-side pacing of web service calls, so concurrent callers don't
+overload the Moodle server.
+"""
+
+from contextlib import contextmanager
+import threading
+import time
+
+
+class TokenBucket():
+    """
+    Limits calls to a steady rate, allowing short bursts
+
+    :param float rate: Calls per second
+    :param int burst: (optional) Calls allowed back to back after a quiet \
+        spell. Defaults to one second's worth.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Blocks until a call may be made """
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens +
+                                   (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter():
+    """
+    Limits calls in flight, adapting the limit to how the server copes
+
+    The limit grows by one for each limit's worth of successful calls
+    (additive increase), and is cut by backoff whenever a call fails or
+    takes longer than latency_target (multiplicative decrease). Cuts are
+    made at most once per latency_target, or once a second, so a burst of
+    failures from the same overload only counts once.
+
+    :param int initial: (optional) Defaults to 4. Starting limit
+    :param int minimum: (optional) Defaults to 1. Lowest limit
+    :param int maximum: (optional) Defaults to 64. Highest limit
+    :param float latency_target: (optional) Seconds beyond which a call \
+        counts as slow. Defaults to only backing off on errors.
+    :param float backoff: (optional) Defaults to 0.5. Factor the limit is \
+        cut by
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64,
+                 latency_target=None, backoff=0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.in_flight = 0
+        self._last_cut = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """ Blocks until a call may be made """
+
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency, ok=True):
+        """ Records a finished call's latency and outcome """
+
+        with self._cond:
+            self.in_flight -= 1
+            slow = (self.latency_target is not None and
+                    latency > self.latency_target)
+            if ok and not slow:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            else:
+                now = time.monotonic()
+                if now - self._last_cut >= (self.latency_target or 1):
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._last_cut = now
+            self._cond.notify_all()
+
+
+class Scheduler():
+    """
+    Paces every call a client makes, by rate and by concurrency
+
+    Example Usage::
+
+    >>> import muddle
+    >>> from muddle.throttle import Scheduler, AdaptiveLimiter
+    >>> scheduler = Scheduler(rate=50, limiter=AdaptiveLimiter(
+    ...     maximum=32, latency_target=2.0))
+    >>> moodle = muddle.authenticate(API_KEY, API_URL, scheduler=scheduler)
+
+    :param float rate: (optional) Calls per second. Defaults to no limit.
+    :param int burst: (optional) Calls allowed back to back, see \
+        :class:`TokenBucket`
+    :param limiter: (optional) An :class:`AdaptiveLimiter`. Defaults to \
+        one with its default settings.
+    """
+
+    def __init__(self, rate=None, burst=None, limiter=None):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.limiter = limiter or AdaptiveLimiter()
+
+    @contextmanager
+    def slot(self):
+        """
+        Waits for a turn to call the server. Set ``ok`` on the yielded
+        slot to False if the server struggled with the call; exceptions
+        are counted as failures.
+        """
+
+        if self.bucket is not None:
+            self.bucket.acquire()
+        self.limiter.acquire()
+        slot = _Slot()
+        start = time.monotonic()
+        try:
+            yield slot
+        except BaseException:
+            slot.ok = False
+            raise
+        finally:
+            self.limiter.release(time.monotonic() - start, slot.ok)
+
+
+class _Slot():
+    __slots__ = ('ok',)
+
+    def __init__(self):
+        self.ok = True
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+
+"""
+muddle.transport
+----------------
+
+HTTP backends the client sends web service calls through. Each backend's
+HTTP library is only imported once the backend is used.
+"""
+
+from datetime import timedelta
+import gzip
+import json
+import time
+from urllib.parse import urlencode, urlsplit, parse_qsl
+
+from .exceptions import TransportError, TransportTimeout
+
+DEFAULT_TRANSPORT = 'requests'
+
+DEFAULT_POOL_SIZE = 10
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class Response():
+    """
+    A web service response, the same whichever transport sent the call
+
+    Mirrors the parts of :class:`requests.Response` muddle uses, so
+    endpoints behave the same across transports.
+
+    :param int status_code: HTTP status
+    :param headers: Case-insensitive mapping of response headers
+    :param bytes content: (optional) The body, if already read
+    :param reader: (optional) For streamed responses, a callable taking a \
+        chunk size and returning an iterator over the body
+    :param closer: (optional) Callable releasing the connection
+    :param string url: (optional) The URL called
+    :param int bytes_sent: (optional) Size of the request line and body
+    :param float elapsed: (optional) Seconds until the response headers \
+        arrived
+    """
+
+    def __init__(self, status_code, headers, content=None, reader=None,
+                 closer=None, url=None, bytes_sent=0, elapsed=0.0):
+        self.status_code = status_code
+        self.headers = headers
+        self.url = url
+        self.bytes_sent = bytes_sent
+        self.elapsed = timedelta(seconds=elapsed)
+        self._content = content
+        self._reader = reader
+        self._closer = closer
+
+    def __repr__(self):
+        return '<Response [{}]>'.format(self.status_code)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def consumed(self):
+        """ Whether the body has been read into :attr:`content` """
+
+        return self._content is not None
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = b''.join(self._reader(STREAM_CHUNK_SIZE))
+            self.close()
+        return self._content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        """ Decodes the body, raising ValueError if it isn't JSON """
+
+        return json.loads(self.content.decode('utf-8'))
+
+    def iter_content(self, chunk_size=STREAM_CHUNK_SIZE):
+        """ Iterates over the body, reading it as it arrives if streamed """
+
+        if self._content is not None:
+            for start in range(0, len(self._content), chunk_size):
+                yield self._content[start:start + chunk_size]
+            return
+        try:
+            yield from self._reader(chunk_size)
+        finally:
+            self.close()
+
+    def close(self):
+        """ Releases the connection back to the pool """
+
+        if self._closer is not None:
+            self._closer()
+            self._closer = None
+
+
+class Transport():
+    """
+    Base for HTTP backends
+
+    A transport owns a pool of connections and sends calls over it. Any
+    object with these two methods can be passed to
+    :func:`muddle.authenticate` as its transport.
+    """
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                timeout=None, stream=False):
+        """
+        Sends a call, returning a :class:`Response`
+
+        :param string method: HTTP method
+        :param string url: URL to call
+        :param dict params: (optional) Query string parameters
+        :param data: (optional) Form parameters as a dict, or an encoded body
+        :param dict headers: (optional) Extra request headers
+        :param timeout: (optional) Seconds, or a (connect, read) tuple
+        :param bool stream: (optional) Defer reading the body
+        :raises muddle.exceptions.TransportError: if the call fails
+        """
+
+        raise NotImplementedError
+
+    def close(self):
+        """ Closes pooled connections """
+
+
+class RequestsTransport(Transport):
+    """
+    Sends calls with requests, through a pooled keep-alive session
+
+    :param int pool_connections: (optional) Number of host pools to cache
+    :param int pool_maxsize: (optional) Connections kept open per host
+    :param bool pool_block: (optional) Block when no connection is free
+    :param bool keep_alive: (optional) Reuse connections between calls
+    :param verify: (optional) Verify TLS certificates, or CA bundle path
+    :param cert: (optional) Client certificate file, or (cert, key) tuple
+    """
+
+    def __init__(self, pool_connections=DEFAULT_POOL_SIZE,
+                 pool_maxsize=DEFAULT_POOL_SIZE, pool_block=False,
+                 keep_alive=True, verify=False, cert=None):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self._errors = (requests.Timeout, requests.RequestException)
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              pool_block=pool_block)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.verify = verify
+        self.session.cert = cert
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                timeout=None, stream=False):
+        timeout_error, request_error = self._errors
+        try:
+            response = self.session.request(method, url, params=params,
+                                            data=data, headers=headers,
+                                            timeout=timeout, stream=stream)
+        except timeout_error as e:
+            raise TransportTimeout(e) from e
+        except request_error as e:
+            raise TransportError(e) from e
+
+        request = response.request
+        return Response(
+            response.status_code, response.headers,
+            content=None if stream else response.content,
+            reader=response.iter_content, closer=response.close,
+            url=url, bytes_sent=_size(request.path_url, request.body),
+            elapsed=response.elapsed.total_seconds())
+
+    def close(self):
+        self.session.close()
+
+
+class Urllib3Transport(Transport):
+    """
+    Sends calls straight through a urllib3 pool, skipping the extra work
+    requests does per call
+
+    Takes the same options as :class:`RequestsTransport`.
+    """
+
+    def __init__(self, pool_connections=DEFAULT_POOL_SIZE,
+                 pool_maxsize=DEFAULT_POOL_SIZE, pool_block=False,
+                 keep_alive=True, verify=False, cert=None):
+        import urllib3
+
+        self._urllib3 = urllib3
+        options = {'num_pools': pool_connections, 'maxsize': pool_maxsize,
+                   'block': pool_block, 'retries': False}
+        if verify:
+            options['cert_reqs'] = 'CERT_REQUIRED'
+            if isinstance(verify, str):
+                options['ca_certs'] = verify
+        else:
+            options['cert_reqs'] = 'CERT_NONE'
+        if isinstance(cert, (list, tuple)):
+            options['cert_file'], options['key_file'] = cert
+        elif cert:
+            options['cert_file'] = cert
+        self.pool = urllib3.PoolManager(**options)
+        self.headers = {'Accept-Encoding': 'gzip, deflate',
+                        'Accept': 'application/json'}
+        if not keep_alive:
+            self.headers['Connection'] = 'close'
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                timeout=None, stream=False):
+        urllib3 = self._urllib3
+        if params:
+            url = url + '?' + urlencode(params)
+        request_headers = dict(self.headers)
+        if isinstance(data, dict):
+            data = urlencode(data).encode('ascii')
+            request_headers['Content-Type'] = \
+                'application/x-www-form-urlencoded'
+        request_headers.update(headers or {})
+
+        if isinstance(timeout, tuple):
+            timeout = urllib3.Timeout(connect=timeout[0], read=timeout[1])
+        elif timeout is None:
+            timeout = urllib3.Timeout(connect=None, read=None)
+
+        start = time.perf_counter()
+        try:
+            response = self.pool.request(method.upper(), url, body=data,
+                                         headers=request_headers,
+                                         timeout=timeout, redirect=False,
+                                         preload_content=not stream)
+        except urllib3.exceptions.NewConnectionError as e:
+            # Subclasses ConnectTimeoutError, though nothing timed out.
+            raise TransportError(e) from e
+        except urllib3.exceptions.TimeoutError as e:
+            raise TransportTimeout(e) from e
+        except urllib3.exceptions.HTTPError as e:
+            raise TransportError(e) from e
+
+        def read(chunk_size):
+            return response.stream(chunk_size, decode_content=True)
+
+        return Response(
+            response.status, response.headers,
+            content=None if stream else response.data,
+            reader=read, closer=response.release_conn, url=url,
+            bytes_sent=_size(urlsplit(url).path, data),
+            elapsed=time.perf_counter() - start)
+
+    def close(self):
+        self.pool.clear()
+
+
+class MemoryTransport(Transport):
+    """
+    Answers calls in-process from canned responses, for tests
+
+    Responses are keyed by wsfunction. Each is either the data to return
+    as JSON, an exception to raise, or a callable taking the call's
+    parameters and returning either of those. Functions without a response
+    get the exception Moodle returns for unknown functions. Every call's
+    parameters are kept in ``calls``.
+
+    Example Usage::
+
+    >>> from muddle.transport import MemoryTransport
+    >>> transport = MemoryTransport({
+    ...     'core_course_get_contents': [{'id': 1, 'modules': []}],
+    ...     'core_course_create_courses': lambda params: [
+    ...         {'id': 5, 'shortname': params['courses[0][shortname]']}]})
+    >>> moodle = muddle.authenticate(API_KEY, API_URL, transport=transport)
+    >>> moodle.course().create('Course', 'course', 1).json()
+    [{'id': 5, 'shortname': 'course'}]
+    >>> transport.calls[0]['wsfunction']
+    'core_course_create_courses'
+
+    :param dict responses: (optional) Canned responses by wsfunction
+    """
+
+    def __init__(self, responses=None):
+        self.responses = dict(responses or {})
+        self.calls = []
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                timeout=None, stream=False):
+        call = dict(params or {})
+        if isinstance(data, dict):
+            call.update(data)
+        elif data:
+            if (headers or {}).get('Content-Encoding') == 'gzip':
+                data = gzip.decompress(data)
+            call.update(parse_qsl(data.decode('ascii')))
+        self.calls.append(call)
+
+        answer = self.responses.get(call.get('wsfunction'), _UNKNOWN)
+        if callable(answer):
+            answer = answer(call)
+        if isinstance(answer, Exception):
+            raise answer
+        if isinstance(answer, Response):
+            return answer
+
+        content = json.dumps(answer).encode('utf-8')
+        return Response(200, {'Content-Type': 'application/json',
+                              'Content-Length': str(len(content))},
+                        content=content, url=url,
+                        bytes_sent=_size(urlsplit(url).path, data))
+
+
+_UNKNOWN = {'exception': 'dml_missing_record_exception',
+            'errorcode': 'invalidrecord',
+            'message': "Can't find data record in database table "
+                       "external_functions."}
+
+
+TRANSPORTS = {
+    'requests': RequestsTransport,
+    'urllib3': Urllib3Transport,
+}
+
+
+def get_transport(transport=None, **options):
+    """
+    Returns a transport: transport itself if it's a transport object,
+    otherwise a new one of the named backend (``requests`` or ``urllib3``)
+    built with options
+    """
+
+    if transport is None:
+        transport = DEFAULT_TRANSPORT
+    if not isinstance(transport, str):
+        return transport
+    try:
+        backend = TRANSPORTS[transport]
+    except KeyError:
+        raise ValueError('Unknown transport: {}'.format(transport))
+    return backend(**options)
+
+
+def _size(path, body):
+    if body is None:
+        return len(path)
+    return len(path) + len(body)
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.fake
+----------
+
+An in-memory Moodle site to run the client against, answering the web
+service functions muddle calls through a
+:class:`muddle.transport.MemoryTransport`.
+"""
+
+import itertools
+import re
+import threading
+import time
+
+import muddle
+from muddle.transport import MemoryTransport
+
+API_URL = 'http://moodle.example'
+
+FRONT_PAGE = 1
+
+
+def entries(call, name):
+    """ Returns the array sent as name[0][field]... as a list of dicts """
+
+    found = {}
+    pattern = re.compile(re.escape(name) + r'\[(\d+)\](?:\[(\w+)\])?$')
+    for key, value in call.items():
+        match = pattern.match(key)
+        if match is None:
+            continue
+        index, field = int(match.group(1)), match.group(2)
+        if field is None:
+            found[index] = value
+        else:
+            found.setdefault(index, {})[field] = value
+    return [found[index] for index in sorted(found)]
+
+
+def moodle_error(errorcode, message=None, exception='moodle_exception'):
+    return {'exception': exception, 'errorcode': errorcode,
+            'message': message or errorcode}
+
+
+def missing():
+    return moodle_error('invalidrecord',
+                        exception='dml_missing_record_exception')
+
+
+class FakeMoodle():
+    """
+    A site's categories, courses and course contents
+
+    Writes are transactional, as in Moodle: a call that fails changes
+    nothing. Courses listed in ``forbidden`` can't be viewed by the token.
+
+    :param string url: (optional) The site's URL
+    :param client options: (optional) Passed to :func:`muddle.authenticate`
+    """
+
+    def __init__(self, url=API_URL, **options):
+        self.categories = {}
+        self.courses = {}
+        self.contents = {}
+        self.forbidden = set()
+        self.ids = itertools.count(100)
+        self.lock = threading.RLock()
+        self.add_course('Front page', 'site', 0, id=FRONT_PAGE,
+                        format='site')
+        self.transport = MemoryTransport(dict(
+            (name, self._locked(getattr(self, name)))
+            for name in dir(self) if name.startswith('core_')))
+        self.moodle = muddle.authenticate('token', url,
+                                          transport=self.transport,
+                                          **options)
+
+    def calls(self, wsfunction=None):
+        """ Returns the calls made, or only those made to wsfunction """
+
+        return [call for call in self.transport.calls
+                if wsfunction in (None, call['wsfunction'])]
+
+    def add_category(self, name, parent=0, idnumber='', **fields):
+        category_id = fields.pop('id', None) or next(self.ids)
+        self.categories[category_id] = dict(
+            {'id': category_id, 'name': name, 'idnumber': idnumber,
+             'parent': parent, 'description': '', 'descriptionformat': 1,
+             'theme': '', 'sortorder': category_id, 'visible': 1}, **fields)
+        return category_id
+
+    def add_course(self, fullname, shortname, categoryid, **fields):
+        course_id = fields.pop('id', None) or next(self.ids)
+        self.courses[course_id] = dict(
+            {'id': course_id, 'fullname': fullname, 'shortname': shortname,
+             'categoryid': categoryid, 'format': 'topics', 'visible': 1,
+             'timemodified': 1000, 'cacherev': 1000}, **fields)
+        return course_id
+
+    def touch(self, course_id):
+        """ Changes a course's contents, as editing an activity would """
+
+        self.courses[course_id]['cacherev'] += 1
+
+    def descendants(self, category_id):
+        found = []
+        for child in sorted(self.categories):
+            if self.categories[child]['parent'] == category_id:
+                found.append(child)
+                found.extend(self.descendants(child))
+        return found
+
+    def _locked(self, handler):
+        def call(params):
+            with self.lock:
+                return handler(params)
+        return call
+
+    def _category(self, category_id):
+        category = dict(self.categories[category_id])
+        category['coursecount'] = sum(
+            1 for course in self.courses.values()
+            if course['categoryid'] == category_id)
+        path = [category_id]
+        while self.categories[path[0]]['parent']:
+            path.insert(0, self.categories[path[0]]['parent'])
+        category['path'] = '/' + '/'.join(str(part) for part in path)
+        category['depth'] = len(path)
+        return category
+
+    def core_course_get_categories(self, call):
+        criteria = entries(call, 'criteria')
+        if not criteria:
+            return [self._category(category_id)
+                    for category_id in sorted(self.categories)]
+        category_id = int(criteria[0]['value'])
+        if category_id not in self.categories:
+            return []
+        found = [category_id]
+        if int(call.get('addsubcategories', 1)):
+            found.extend(self.descendants(category_id))
+        return [self._category(found_id) for found_id in found]
+
+    def core_course_create_categories(self, call):
+        categories = entries(call, 'categories')
+        idnumbers = set(category['idnumber']
+                        for category in self.categories.values()
+                        if category['idnumber'])
+        for category in categories:
+            parent = int(category.get('parent', 0))
+            if parent and parent not in self.categories:
+                return missing()
+            if category.get('idnumber') in idnumbers:
+                return moodle_error('categoryidnumbertaken')
+            if category.get('idnumber'):
+                idnumbers.add(category['idnumber'])
+        created = []
+        for category in categories:
+            fields = dict(category)
+            fields['parent'] = int(fields.get('parent', 0))
+            category_id = self.add_category(**fields)
+            created.append({'id': category_id, 'name': category['name']})
+        return created
+
+    def core_course_update_categories(self, call):
+        categories = entries(call, 'categories')
+        for category in categories:
+            if int(category['id']) not in self.categories:
+                return missing()
+        for category in categories:
+            fields = dict(category)
+            category_id = int(fields.pop('id'))
+            if 'parent' in fields:
+                fields['parent'] = int(fields['parent'])
+            self.categories[category_id].update(fields)
+        return None
+
+    def core_course_delete_categories(self, call):
+        categories = entries(call, 'categories')
+        for category in categories:
+            category_id = int(category['id'])
+            if category_id not in self.categories:
+                return missing()
+            if not int(category.get('recursive', 0)) and \
+                    not int(category.get('newparent', 0)) and \
+                    not self.categories[category_id]['parent']:
+                return moodle_error('movecatcontentstoroot')
+        for category in categories:
+            category_id = int(category['id'])
+            if category_id not in self.categories:
+                # Went with a parent deleted earlier in the call.
+                continue
+            if int(category.get('recursive', 0)):
+                gone = [category_id] + self.descendants(category_id)
+                for course_id, course in list(self.courses.items()):
+                    if course['categoryid'] in gone:
+                        del self.courses[course_id]
+                for gone_id in gone:
+                    del self.categories[gone_id]
+                continue
+            target = int(category.get('newparent', 0)) or \
+                self.categories[category_id]['parent']
+            for child in self.categories.values():
+                if child['parent'] == category_id:
+                    child['parent'] = target
+            for course in self.courses.values():
+                if course['categoryid'] == category_id:
+                    course['categoryid'] = target
+            del self.categories[category_id]
+        return None
+
+    def _visible_courses(self, course_ids=None):
+        if course_ids is None:
+            course_ids = sorted(self.courses)
+        return [dict(self.courses[course_id]) for course_id in course_ids
+                if course_id in self.courses]
+
+    def core_course_get_courses(self, call):
+        course_ids = [int(course_id)
+                      for course_id in entries(call, 'options[ids]')]
+        courses = self._visible_courses(course_ids or None)
+        # Moodle checks every course it found can be viewed.
+        for course in courses:
+            if course['id'] in self.forbidden:
+                return moodle_error('nopermissions',
+                                    exception='required_capability_exception')
+        return courses
+
+    def core_course_get_courses_by_field(self, call):
+        field, value = call.get('field', ''), call.get('value', '')
+        if field == 'ids':
+            courses = self._visible_courses(
+                int(course_id) for course_id in str(value).split(','))
+        elif field == 'id':
+            courses = self._visible_courses([int(value)])
+        elif field:
+            key = 'categoryid' if field == 'category' else field
+            courses = [course for course in self._visible_courses()
+                       if str(course.get(key)) == str(value)]
+        else:
+            courses = self._visible_courses()
+        # Courses that can't be viewed are left out, not failed.
+        return {'courses': [course for course in courses
+                            if course['id'] not in self.forbidden],
+                'warnings': []}
+
+    def core_course_create_courses(self, call):
+        courses = entries(call, 'courses')
+        shortnames = set(course['shortname']
+                         for course in self.courses.values())
+        for course in courses:
+            if course['shortname'] in shortnames:
+                return moodle_error('shortnametaken')
+            if int(course['categoryid']) not in self.categories:
+                return missing()
+            shortnames.add(course['shortname'])
+        created = []
+        for course in courses:
+            fields = dict(course)
+            fields['categoryid'] = int(fields['categoryid'])
+            course_id = self.add_course(**fields)
+            created.append({'id': course_id, 'shortname': fields['shortname']})
+        return created
+
+    def core_course_update_courses(self, call):
+        warnings = []
+        for course in entries(call, 'courses'):
+            fields = dict(course)
+            course_id = int(fields.pop('id'))
+            if course_id not in self.courses:
+                warnings.append({'item': 'course', 'itemid': course_id,
+                                 'warningcode': 'errorcourseupdate',
+                                 'message': 'No such course'})
+                continue
+            if 'categoryid' in fields:
+                fields['categoryid'] = int(fields['categoryid'])
+            self.courses[course_id].update(fields)
+            self.courses[course_id]['timemodified'] += 1
+        return {'warnings': warnings}
+
+    def core_course_delete_courses(self, call):
+        warnings = []
+        for course_id in entries(call, 'courseids'):
+            course_id = int(course_id)
+            if self.courses.pop(course_id, None) is None:
+                warnings.append({'item': 'course', 'itemid': course_id,
+                                 'warningcode': 'unknowncourseidnumber',
+                                 'message': 'Unknown course ID'})
+            self.contents.pop(course_id, None)
+        return {'warnings': warnings}
+
+    def core_course_get_contents(self, call):
+        course_id = int(call['courseid'])
+        if course_id not in self.courses:
+            return missing()
+        return self.contents.get(course_id, [])
+
+    def core_course_duplicate_course(self, call):
+        source = self.courses.get(int(call['courseid']))
+        if source is None:
+            return missing()
+        if any(course['shortname'] == call['shortname']
+               for course in self.courses.values()):
+            return moodle_error('shortnametaken')
+        # Backup and restore take a while.
+        time.sleep(0.001)
+        course_id = self.add_course(call['fullname'], call['shortname'],
+                                    int(call['categoryid']))
+        self.contents[course_id] = self.contents.get(source['id'], [])
+        return {'id': course_id, 'shortname': call['shortname']}
+
+    def core_course_import_course(self, call):
+        source, target = int(call['importfrom']), int(call['importto'])
+        if source not in self.courses or target not in self.courses:
+            return missing()
+        kept = [] if int(call.get('deletecontent', 0)) else \
+            self.contents.get(target, [])
+        self.contents[target] = kept + self.contents.get(source, [])
+        return None
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_batch
+----------------
+
+Creating many courses in few calls, and bisecting batches Moodle rejects.
+"""
+
+from muddle.exceptions import MoodleError, MuddleError
+
+from .fake import FakeMoodle, entries
+
+
+def course(shortname, category):
+    return {'fullname': shortname.title(), 'shortname': shortname,
+            'categoryid': category}
+
+
+def test_courses_are_packed_into_chunks():
+    site = FakeMoodle()
+    category = site.add_category('Science')
+
+    results = site.moodle.course().create_many(
+        [course('c%d' % n, category) for n in range(25)], chunk_size=10)
+
+    assert all(result.ok for result in results)
+    assert [result.value['shortname'] for result in results] == \
+        ['c%d' % n for n in range(25)]
+    calls = site.calls('core_course_create_courses')
+    assert [len(entries(call, 'courses')) for call in calls] == [10, 10, 5]
+
+
+def test_rejected_batch_is_bisected_down_to_the_failing_course():
+    site = FakeMoodle()
+    category = site.add_category('Science')
+    site.add_course('Taken', 'c5', category)
+    courses = [course('c%d' % n, category) for n in range(8)]
+
+    results = site.moodle.course().create_many(courses, chunk_size=8)
+
+    assert [result.ok for result in results] == \
+        [True] * 5 + [False] + [True] * 2
+    assert isinstance(results[5].error, MoodleError)
+    assert results[5].error.errorcode == 'shortnametaken'
+    # 8 -> 4 + 4 -> 2 + 2 -> 1 + 1
+    assert len(site.calls('core_course_create_courses')) == 7
+    assert sorted(c['shortname'] for c in site.courses.values()) == \
+        sorted(['site'] + ['c%d' % n for n in range(8)])
+
+
+def test_invalid_courses_fail_without_being_sent():
+    site = FakeMoodle()
+    category = site.add_category('Science')
+
+    results = site.moodle.course().create_many([
+        course('good', category),
+        {'fullname': 'No shortname', 'categoryid': category},
+        dict(course('odd', category), colour='red')])
+
+    assert [result.ok for result in results] == [True, False, False]
+    assert all(isinstance(result.error, ValueError)
+               for result in results[1:])
+    call, = site.calls('core_course_create_courses')
+    assert len(entries(call, 'courses')) == 1
+
+
+def test_short_reply_fails_the_batch():
+    site = FakeMoodle()
+    category = site.add_category('Science')
+    # Moodle dropping parameters past max_input_vars creates fewer.
+    site.transport.responses['core_course_create_courses'] = \
+        lambda call: [{'id': 500, 'shortname': 'a'}]
+
+    results = site.moodle.course().create_many(
+        [course('a', category), course('b', category)])
+
+    assert not any(result.ok for result in results)
+    assert isinstance(results[0].error, MuddleError)
+    assert '1 results for 2 items' in str(results[0].error)
+    # What was sent may have been applied, so it isn't resent.
+    assert len(site.calls('core_course_create_courses')) == 1
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_cache
+----------------
+
+Cached reads, and writes through the client invalidating them.
+"""
+
+import time
+
+import pytest
+
+import muddle
+
+from .fake import FakeMoodle
+
+
+@pytest.fixture(params=['memory', 'disk'])
+def cache(request, tmp_path):
+    if request.param == 'memory':
+        return muddle.ResponseCache()
+    cache = muddle.DiskCache(str(tmp_path / 'cache.sqlite'))
+    request.addfinalizer(cache.close)
+    return cache
+
+
+def contents_site(cache, url='http://a.example'):
+    site = FakeMoodle(url, cache=cache)
+    category = site.add_category('Science')
+    for course_id in (10, 11):
+        site.add_course('Course', 'c%d' % course_id, category, id=course_id)
+        site.contents[course_id] = [{'id': 1, 'name': '{} course {}'.format(
+            url, course_id), 'modules': []}]
+    return site
+
+
+def fetched(site):
+    return [call['courseid']
+            for call in site.calls('core_course_get_contents')]
+
+
+def test_reads_are_served_from_the_cache(cache):
+    site = contents_site(cache)
+
+    first = site.moodle.course(10).contents()
+    assert site.moodle.course(10).contents() == first
+    site.moodle.course(11).contents()
+
+    assert fetched(site) == [10, 11]
+
+
+def test_writes_invalidate_what_they_change(cache):
+    site = contents_site(cache)
+    site.moodle.course(10).contents()
+    site.moodle.course(11).contents()
+
+    site.moodle.course(10).delete()
+    site.moodle.course(11).contents()
+    gone = site.moodle.course(10).contents()
+
+    assert fetched(site) == [10, 11, 10]
+    assert gone['errorcode'] == 'invalidrecord'
+
+
+def test_category_writes_invalidate_category_reads(cache):
+    site = FakeMoodle(cache=cache)
+    science = site.add_category('Science')
+    site.moodle.category(science).details()
+    site.moodle.category(science).details()
+
+    site.moodle.category(science).update(name='Sciences')
+
+    assert site.moodle.category(science).details().json()[0]['name'] == \
+        'Sciences'
+    assert len(site.calls('core_course_get_categories')) == 2
+
+
+def test_moodle_exceptions_are_not_cached(cache):
+    site = FakeMoodle(cache=cache)
+
+    for _ in range(2):
+        assert 'exception' in site.moodle.course(404).contents()
+
+    assert len(site.calls('core_course_get_contents')) == 2
+    assert len(cache) == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = muddle.ResponseCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_expire():
+    cache = muddle.ResponseCache(ttl=0)
+    cache.set('a', 1)
+
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_invalidating_a_tag_only_drops_its_entries():
+    cache = muddle.ResponseCache()
+    cache.set('a', 1, ['course:1'])
+    cache.set('b', 2, ['course:1', 'course:2'])
+    cache.set('c', 3, ['course:2'])
+
+    cache.invalidate('course:1')
+
+    assert [cache.get(key) for key in 'abc'] == [None, None, 3]
+    assert cache.stats()['invalidations'] == 2
+
+
+def test_disk_entries_outlive_the_process(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    first = contents_site(muddle.DiskCache(path))
+    contents = first.moodle.course(10).contents()
+    first.moodle.cache.close()
+
+    second = contents_site(muddle.DiskCache(path))
+
+    assert second.moodle.course(10).contents() == contents
+    assert fetched(second) == []
+
+
+def test_disk_cache_evicts_beyond_max_bytes(tmp_path):
+    cache = muddle.DiskCache(str(tmp_path / 'cache.sqlite'), max_bytes=300)
+    site = contents_site(cache)
+    for course_id in range(20, 40):
+        site.add_course('Course', 'c%d' % course_id, 0, id=course_id)
+        site.contents[course_id] = [{'id': course_id, 'modules': [],
+                                     'summary': 'x%d' % course_id * 20}]
+        site.moodle.course(course_id).contents()
+
+    assert cache.stats()['bytes'] <= 300
+    assert cache.stats()['evictions'] > 0
+
+
+def revalidation_site(tmp_path):
+    # Entries are stored already expired, so only revalidation keeps them.
+    cache = muddle.DiskCache(str(tmp_path / 'cache.sqlite'), ttl=0)
+    site = contents_site(cache)
+    site.moodle.course(10).contents()
+    site.moodle.course(11).contents()
+    return site, cache
+
+
+def test_revalidation_renews_unchanged_courses(tmp_path):
+    site, cache = revalidation_site(tmp_path)
+
+    assert cache.revalidate(site.moodle, ttl=60) == 2
+    site.moodle.course(10).contents()
+    site.moodle.course(11).contents()
+
+    assert fetched(site) == [10, 11]
+    markers, = site.calls('core_course_get_courses_by_field')
+    assert markers['field'] == 'ids'
+
+
+def test_revalidation_drops_courses_changed_since(tmp_path):
+    site, cache = revalidation_site(tmp_path)
+    cache.revalidate(site.moodle, ttl=60)
+
+    site.touch(11)
+    assert cache.revalidate(site.moodle, ttl=60) == 1
+    site.moodle.course(10).contents()
+    site.moodle.course(11).contents()
+
+    assert fetched(site) == [10, 11, 11]
+
+
+def test_first_revalidation_drops_entries_older_than_the_change(tmp_path):
+    site, cache = revalidation_site(tmp_path)
+
+    # cacherev is set from the clock when the course changes.
+    site.courses[11]['cacherev'] = int(time.time()) + 60
+    assert cache.revalidate(site.moodle, ttl=60) == 1
+
+
+def test_revalidation_drops_deleted_courses(tmp_path):
+    site, cache = revalidation_site(tmp_path)
+
+    del site.courses[11]
+
+    assert cache.revalidate(site.moodle, ttl=60) == 1
+    assert len(cache) == 1
+
+
+def test_sites_sharing_a_cache_get_their_own_responses(cache):
+    first = contents_site(cache, 'http://a.example')
+    second = contents_site(cache, 'http://b.example')
+
+    assert first.moodle.course(10).contents()[0]['name'] == \
+        'http://a.example course 10'
+    assert second.moodle.course(10).contents()[0]['name'] == \
+        'http://b.example course 10'
+    assert fetched(first) == [10] and fetched(second) == [10]
+
+
+def test_writes_only_invalidate_their_own_site(cache):
+    first = contents_site(cache, 'http://a.example')
+    second = contents_site(cache, 'http://b.example')
+    first.moodle.course(10).contents()
+    second.moodle.course(10).contents()
+
+    first.moodle.course(10).delete()
+    first.moodle.course(10).contents()
+    second.moodle.course(10).contents()
+
+    assert fetched(first) == [10, 10] and fetched(second) == [10]
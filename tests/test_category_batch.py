@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_category_batch
+-------------------------
+
+Creating and updating many categories in few calls, parents first.
+"""
+
+from muddle.exceptions import MoodleError, MuddleError
+
+from .fake import FakeMoodle, entries
+
+
+def created_names(site):
+    return [[category['name'] for category in entries(call, 'categories')]
+            for call in site.calls('core_course_create_categories')]
+
+
+def test_categories_are_created_parents_first():
+    site = FakeMoodle()
+    results = site.moodle.category().create_many([
+        {'name': 'Physics', 'idnumber': 'PHYS', 'parent': 'SCI'},
+        {'name': 'Quantum', 'parent': 'PHYS'},
+        {'name': 'Science', 'idnumber': 'SCI'},
+        {'name': 'Chemistry', 'parent': 'SCI'}])
+
+    assert all(result.ok for result in results)
+    ids = dict((result.item['name'], result.value['id'])
+               for result in results)
+    assert dict((category['name'], category['parent'])
+                for category in site.categories.values()) == {
+        'Science': 0, 'Physics': ids['Science'],
+        'Chemistry': ids['Science'], 'Quantum': ids['Physics']}
+    # One call per level.
+    assert created_names(site) == [['Science'], ['Physics', 'Chemistry'],
+                                   ['Quantum']]
+
+
+def test_existing_parents_are_given_by_id():
+    site = FakeMoodle()
+    faculty = site.add_category('Faculty')
+
+    results = site.moodle.category().create_many([
+        {'name': 'Science', 'idnumber': 'SCI', 'parent': faculty},
+        {'name': 'Physics', 'parent': 'SCI'}])
+
+    assert all(result.ok for result in results)
+    assert site.categories[results[0].value['id']]['parent'] == faculty
+
+
+def test_unknown_parent_fails_without_a_call():
+    site = FakeMoodle()
+    results = site.moodle.category().create_many([
+        {'name': 'Orphan', 'parent': 'NOPE'}])
+
+    assert isinstance(results[0].error, ValueError)
+    assert 'NOPE' in str(results[0].error)
+    assert site.calls('core_course_create_categories') == []
+
+
+def test_categories_nested_in_a_loop_fail():
+    site = FakeMoodle()
+    results = site.moodle.category().create_many([
+        {'name': 'A', 'idnumber': 'A', 'parent': 'B'},
+        {'name': 'B', 'idnumber': 'B', 'parent': 'A'},
+        {'name': 'C'}])
+
+    assert [result.ok for result in results] == [False, False, True]
+    assert 'loop' in str(results[0].error)
+    assert created_names(site) == [['C']]
+
+
+def test_children_of_a_failed_category_are_not_sent():
+    site = FakeMoodle()
+    site.add_category('Existing', idnumber='TAKEN')
+
+    results = site.moodle.category().create_many([
+        {'name': 'Clash', 'idnumber': 'TAKEN'},
+        {'name': 'Child', 'idnumber': 'CHILD', 'parent': 'TAKEN'},
+        {'name': 'Grandchild', 'parent': 'CHILD'},
+        {'name': 'Fine'}])
+
+    assert [result.ok for result in results] == [False, False, False, True]
+    assert isinstance(results[0].error, MoodleError)
+    assert isinstance(results[1].error, MuddleError)
+    assert isinstance(results[2].error, MuddleError)
+    sent = sum(created_names(site), [])
+    assert 'Child' not in sent and 'Grandchild' not in sent
+
+
+def test_updates_are_packed_into_one_call():
+    site = FakeMoodle()
+    science = site.add_category('Science')
+    physics = site.add_category('Physics')
+
+    results = site.moodle.category().update_many([
+        {'id': science, 'theme': 'boost'},
+        {'id': physics, 'parent': science},
+        {'id': physics, 'colour': 'red'}])
+
+    assert [result.ok for result in results] == [True, True, False]
+    assert len(site.calls('core_course_update_categories')) == 1
+    assert site.categories[science]['theme'] == 'boost'
+    assert site.categories[physics]['parent'] == science
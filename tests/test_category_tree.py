@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_category_tree
+------------------------
+
+The local category index, and keeping it in step with writes made
+through the client.
+"""
+
+from .fake import FakeMoodle
+
+
+def ids(categories):
+    return [category['id'] for category in categories]
+
+
+def branch_site():
+    """ A site with 1 > 2 > 3 and 1 > 4, and 5 alongside 1 """
+
+    site = FakeMoodle()
+    site.add_category('One', id=1)
+    site.add_category('Two', parent=1, id=2)
+    site.add_category('Three', parent=2, id=3)
+    site.add_category('Four', parent=1, id=4)
+    site.add_category('Five', id=5)
+    return site
+
+
+def reloaded(site):
+    """ A freshly loaded tree, to compare against """
+
+    return site.moodle.category_tree()
+
+
+def category_calls(site):
+    return len(site.calls('core_course_get_categories'))
+
+
+def test_queries_are_answered_from_one_call():
+    site = branch_site()
+    tree = site.moodle.category_tree()
+
+    assert ids(tree.descendants(0)) == [1, 2, 3, 4, 5]
+    assert ids(tree.ancestors(3)) == [1, 2]
+    assert ids(tree.children(1)) == [2, 4]
+    assert ids(tree.subtree(2)) == [2, 3]
+    assert tree.parent(1) is None
+    assert len(tree) == 5 and 3 in tree
+    assert category_calls(site) == 1
+
+
+def test_creates_fetch_only_the_new_category():
+    site = branch_site()
+    tree = site.moodle.category_tree()
+    tree.descendants(0)
+
+    created = site.moodle.category().create_many([
+        {'name': 'Six', 'parent': 3}])
+
+    new = created[0].value['id']
+    assert ids(tree.ancestors(new)) == [1, 2, 3]
+    call = site.calls('core_course_get_categories')[-1]
+    assert call['criteria[0][value]'] == new
+    assert category_calls(site) == 2
+
+
+def test_moves_are_picked_up():
+    site = branch_site()
+    tree = site.moodle.category_tree()
+    tree.descendants(0)
+
+    site.moodle.category(2).update(parent=5)
+
+    assert ids(tree.children(1)) == [4]
+    assert ids(tree.descendants(5)) == [2, 3]
+    assert ids(tree.ancestors(3)) == [5, 2]
+
+
+def test_deleting_moves_children_up_to_the_parent():
+    site = branch_site()
+    tree = site.moodle.category_tree()
+    tree.descendants(0)
+
+    site.moodle.category(2).delete()
+
+    assert ids(tree.descendants(0)) == ids(reloaded(site).descendants(0))
+    assert ids(tree.children(1)) == [3, 4]
+    assert 2 not in tree and 3 in tree
+
+
+def test_deleting_many_moves_children_up_to_their_parents():
+    site = branch_site()
+    site.add_category('Seven', parent=5, id=7)
+    site.add_category('Eight', parent=7, id=8)
+    tree = site.moodle.category_tree()
+    tree.descendants(0)
+
+    results = site.moodle.category().delete_many([2, 7])
+
+    assert all(result.ok for result in results)
+    assert ids(tree.descendants(0)) == ids(reloaded(site).descendants(0))
+    assert ids(tree.children(5)) == [8]
+
+
+def test_deleting_into_a_new_parent():
+    site = branch_site()
+    tree = site.moodle.category_tree()
+    tree.descendants(0)
+
+    site.moodle.category(2).delete(new_parent=5)
+
+    assert ids(tree.children(5)) == [3]
+    assert ids(tree.children(1)) == [4]
+
+
+def test_deleting_recursively_drops_the_branch():
+    site = branch_site()
+    tree = site.moodle.category_tree()
+    tree.descendants(0)
+
+    site.moodle.category(2).delete(recursive=True)
+
+    assert ids(tree.descendants(0)) == [1, 4, 5]
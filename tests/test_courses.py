@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_courses
+------------------
+
+Paging through a site's courses by id.
+"""
+
+import pytest
+
+from muddle.exceptions import MuddleError
+
+from .fake import FakeMoodle
+
+
+def courses_site(*course_ids):
+    site = FakeMoodle()
+    category = site.add_category('Science')
+    for course_id in course_ids:
+        site.add_course('Course', 'c%d' % course_id, category, id=course_id)
+    return site
+
+
+def pages(site):
+    return len(site.calls('core_course_get_courses_by_field'))
+
+
+def test_every_course_is_listed_with_only_the_fields_asked_for():
+    site = courses_site(*range(10, 260))
+
+    courses = list(site.moodle.iter_courses(fields=['id', 'shortname'],
+                                            batch_size=100))
+
+    assert [course['id'] for course in courses] == list(range(10, 260))
+    assert courses[0] == {'id': 10, 'shortname': 'c10'}
+    assert site.calls('core_course_get_courses') == []
+
+
+def test_prefetching_lists_the_same_courses():
+    site = courses_site(*range(10, 60))
+
+    assert list(site.moodle.iter_courses(batch_size=10)) == \
+        list(site.moodle.iter_courses(batch_size=10, prefetch=False))
+
+
+def test_paging_stops_once_every_course_is_seen():
+    site = courses_site(*range(2, 22))
+
+    list(site.moodle.iter_courses(batch_size=10, prefetch=False))
+
+    last = site.calls('core_course_get_courses_by_field')[-1]
+    assert max(int(course_id) for course_id in
+               last['value'].split(',')) < 40
+    assert pages(site) <= 3
+
+
+def test_gaps_widen_the_window():
+    site = courses_site(5, 5005)
+
+    courses = list(site.moodle.iter_courses(batch_size=100,
+                                            prefetch=False))
+
+    assert [course['id'] for course in courses] == [5, 5005]
+    assert pages(site) < 15
+
+
+def test_courses_beyond_max_gap_raise_rather_than_go_missing():
+    site = courses_site(5, 50000)
+    listed = []
+
+    with pytest.raises(MuddleError):
+        for course in site.moodle.iter_courses(max_gap=1000):
+            listed.append(course['id'])
+
+    assert listed == [5]
+    courses = site.moodle.iter_courses(max_gap=60000)
+    assert [course['id'] for course in courses] == [5, 50000]
+
+
+def test_courses_the_token_cant_view_dont_fail_their_page():
+    site = courses_site(10, 11, 12, 13, 14)
+    site.forbidden.add(12)
+    listed = []
+
+    # The category still counts 12, so paging ends at max_gap.
+    with pytest.raises(MuddleError):
+        for course in site.moodle.iter_courses(max_gap=2000):
+            listed.append(course['id'])
+
+    assert listed == [10, 11, 13, 14]
+
+
+def test_a_categorys_courses_come_from_one_call():
+    site = courses_site(10, 11)
+    other = site.add_category('Other')
+    site.add_course('Elsewhere', 'e1', other, id=12)
+
+    courses = site.moodle.iter_courses(category=other, fields=['id'])
+
+    assert list(courses) == [{'id': 12}]
+    call, = site.calls('core_course_get_courses_by_field')
+    assert call['field'] == 'category'
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_jobs
+---------------
+
+Running course duplicates and imports on a bounded pool of workers.
+"""
+
+import threading
+import time
+
+import pytest
+
+from muddle.exceptions import MoodleError
+from muddle.jobs import CANCELLED, DONE, FAILED
+
+from .fake import FakeMoodle
+
+
+def course_site():
+    site = FakeMoodle()
+    category = site.add_category('Templates')
+    course_id = site.add_course('Template', 'template', category)
+    site.contents[course_id] = [{'id': 1, 'name': 'Week 1', 'modules': []}]
+    return site, category, course_id
+
+
+def test_duplicates_run_and_return_the_new_courses():
+    site, category, template = course_site()
+
+    with site.moodle.jobs(workers=3) as queue:
+        jobs = [queue.duplicate(template, 'Copy %d' % n, 'copy%d' % n,
+                                category) for n in range(6)]
+        finished = list(queue.as_completed())
+
+    assert sorted(finished, key=jobs.index) == jobs
+    assert all(job.status == DONE for job in jobs)
+    shortnames = [job.result()['shortname'] for job in jobs]
+    assert shortnames == ['copy%d' % n for n in range(6)]
+    for job in jobs:
+        assert site.contents[job.result()['id']] == site.contents[template]
+
+
+def test_no_more_than_workers_jobs_run_at_once():
+    site, category, template = course_site()
+    duplicate = site.transport.responses['core_course_duplicate_course']
+    running = [0, 0]
+    lock = threading.Lock()
+
+    def slow_duplicate(call):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return duplicate(call)
+
+    site.transport.responses['core_course_duplicate_course'] = \
+        slow_duplicate
+    with site.moodle.jobs(workers=2) as queue:
+        for n in range(8):
+            queue.duplicate(template, 'Copy', 'copy%d' % n, category)
+        done, not_done = queue.wait()
+
+    assert len(done) == 8 and not not_done
+    assert running[1] == 2
+
+
+def test_failures_are_kept_on_the_job():
+    site, category, template = course_site()
+
+    with site.moodle.jobs() as queue:
+        job = queue.duplicate(template, 'Clash', 'template', category)
+
+    assert job.status == FAILED
+    assert isinstance(job.exception(), MoodleError)
+    with pytest.raises(MoodleError):
+        job.result()
+
+
+def test_imports_copy_contents_into_another_course():
+    site, category, template = course_site()
+    target = site.add_course('Target', 'target', category)
+    site.contents[target] = [{'id': 2, 'name': 'Old', 'modules': []}]
+
+    with site.moodle.jobs() as queue:
+        job = queue.export_data(template, target, delete_content=True)
+
+    assert job.status == DONE
+    assert site.contents[target] == site.contents[template]
+
+
+def test_pending_jobs_can_be_cancelled():
+    site, category, template = course_site()
+    release = threading.Event()
+    site.transport.responses['core_course_duplicate_course'] = \
+        lambda call: release.wait(5) and {'id': 1, 'shortname': 'x'}
+
+    queue = site.moodle.jobs(workers=1)
+    first = queue.duplicate(template, 'Copy', 'copy1', category)
+    second = queue.duplicate(template, 'Copy', 'copy2', category)
+    assert second.cancel()
+    release.set()
+    queue.shutdown()
+
+    assert first.status == DONE
+    assert second.status == CANCELLED
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_plan
+---------------
+
+Planning the changes that bring a site in line with a layout, and
+applying them in order.
+"""
+
+import pytest
+
+from muddle.exceptions import MuddleError
+
+from .fake import FakeMoodle, entries
+
+WRITES = ('core_course_create_categories', 'core_course_update_categories',
+          'core_course_create_courses', 'core_course_update_courses',
+          'core_course_delete_courses', 'core_course_delete_categories')
+
+
+def writes(site):
+    return [call['wsfunction'] for call in site.calls()
+            if call['wsfunction'] in WRITES]
+
+
+def managed_site():
+    """
+    Root 10 holds Science (with a course) and Old > Older (with a
+    course), alongside Miscellaneous and Other
+    """
+
+    site = FakeMoodle()
+    site.add_category('Miscellaneous', id=1)
+    site.add_category('Root', id=10)
+    site.add_category('Sciences', parent=10, idnumber='SCI', id=11)
+    site.add_category('Old', parent=10, id=12)
+    site.add_category('Older', parent=12, id=13)
+    site.add_category('Other', id=14)
+    site.add_course('Mech', 'PHY101', 11, id=20)
+    site.add_course('Gone', 'OLD101', 13, id=21)
+    site.add_course('Elsewhere', 'OTH101', 14, id=22)
+    return site
+
+
+LAYOUT = {
+    'categories': [
+        {'idnumber': 'SCI', 'name': 'Science'},
+        {'idnumber': 'PHYS', 'name': 'Physics', 'parent': 'SCI'},
+        {'idnumber': 'QUANT', 'name': 'Quantum', 'parent': 'PHYS'}],
+    'courses': [
+        {'shortname': 'PHY101', 'fullname': 'Mechanics',
+         'category': 'PHYS'},
+        {'shortname': 'QUA101', 'fullname': 'Qubits', 'category': 'QUANT'}]}
+
+
+def test_a_new_layout_is_created_a_level_at_a_time():
+    site = FakeMoodle()
+    site.add_category('Root', id=10)
+
+    plan = site.moodle.plan(LAYOUT, root=10)
+    results = plan.apply()
+
+    assert all(result.ok for result in results)
+    assert writes(site) == ['core_course_create_categories'] * 3 + \
+        ['core_course_create_courses']
+    assert len(writes(site)) == plan.calls()
+    quantum = plan.ids['QUANT']
+    assert site.categories[quantum]['parent'] == plan.ids['PHYS']
+    assert site.categories[plan.ids['SCI']]['parent'] == 10
+    assert not site.moodle.plan(LAYOUT, root=10)
+
+
+def test_printing_a_plan_changes_nothing():
+    site = managed_site()
+
+    plan = site.moodle.plan(LAYOUT, root=10)
+
+    assert str(plan).splitlines() == [
+        "~ category SCI: name 'Sciences' -> 'Science'",
+        "+ category PHYS (in 'SCI')",
+        "+ category QUANT (in 'PHYS')",
+        "> course PHY101: categoryid 11 -> 'PHYS', "
+        "fullname 'Mech' -> 'Mechanics'",
+        "+ course QUA101 (in 'QUANT')",
+        '5 operations in about 5 calls']
+    assert writes(site) == []
+
+
+def test_operations_are_applied_in_order():
+    site = managed_site()
+
+    results = site.moodle.plan(LAYOUT, root=10, prune=True).apply()
+
+    assert all(result.ok for result in results)
+    assert writes(site) == ['core_course_create_categories'] * 2 + [
+        'core_course_update_categories', 'core_course_create_courses',
+        'core_course_update_courses', 'core_course_delete_courses',
+        'core_course_delete_categories']
+    assert site.courses[20]['fullname'] == 'Mechanics'
+    assert site.categories[11]['name'] == 'Science'
+
+
+def test_pruning_deletes_whats_left_beneath_root():
+    site = managed_site()
+
+    site.moodle.plan(LAYOUT, root=10, prune=True).apply()
+
+    call, = site.calls('core_course_delete_categories')
+    deleted = entries(call, 'categories')
+    assert [int(category['id']) for category in deleted] == [13, 12]
+    assert all(int(category['recursive']) for category in deleted)
+    assert not any('newparent' in category for category in deleted)
+    assert not set([12, 13]) & set(site.categories)
+    assert set([1, 10, 11, 14]) <= set(site.categories)
+    assert 21 not in site.courses and 22 in site.courses
+
+
+def test_pruning_needs_a_root():
+    site = managed_site()
+
+    with pytest.raises(ValueError):
+        site.moodle.plan(LAYOUT, prune=True)
+    assert site.calls() == []
+
+
+def test_nothing_is_pruned_when_a_move_fails():
+    site = managed_site()
+    site.categories[11]['parent'] = 12
+    site.transport.responses['core_course_update_categories'] = \
+        {'exception': 'moodle_exception', 'errorcode': 'nopermissions',
+         'message': 'nopermissions'}
+
+    results = site.moodle.plan(LAYOUT, root=10, prune=True).apply()
+
+    skipped = [result for result in results
+               if result.item.step == ('category', 'delete')]
+    assert skipped and all(isinstance(result.error, MuddleError)
+                           for result in skipped)
+    assert site.calls('core_course_delete_categories') == []
+    assert 11 in site.categories and 12 in site.categories
+
+
+def test_short_replies_fail_their_operations():
+    site = FakeMoodle()
+    site.add_category('Root', id=10)
+    site.transport.responses['core_course_create_courses'] = []
+
+    results = site.moodle.plan(LAYOUT, root=10).apply()
+
+    failed = [result for result in results if not result.ok]
+    assert [result.item.key for result in failed] == ['PHY101', 'QUA101']
+    assert all(isinstance(result.error, MuddleError) for result in failed)
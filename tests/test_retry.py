@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_retry
+----------------
+
+Resending reads that failed in transit, and hedging slow ones.
+"""
+
+import threading
+import time
+
+import pytest
+
+import muddle
+from muddle.exceptions import TransportError
+from muddle.retry import Hedge, Retry
+from muddle.transport import Response
+
+from .fake import FakeMoodle
+
+
+def unavailable(retry_after=None):
+    headers = {} if retry_after is None else {'Retry-After': retry_after}
+    return Response(503, headers, content=b'')
+
+
+def failing(site, wsfunction, *failures):
+    """ Answers wsfunction with each of failures in turn, then as usual """
+
+    answer = site.transport.responses[wsfunction]
+    failures = list(failures)
+
+    def flaky(call):
+        if failures:
+            return failures.pop(0)
+        return answer(call)
+
+    site.transport.responses[wsfunction] = flaky
+
+
+def retry_site(**options):
+    metrics = muddle.Metrics()
+    site = FakeMoodle(retry=Retry(attempts=3, backoff=0.001),
+                      metrics=metrics, **options)
+    site.add_course('Course', 'c10', site.add_category('Science'), id=10)
+    site.contents[10] = [{'id': 1, 'name': 'Week 1', 'modules': []}]
+    return site, metrics
+
+
+def contents_calls(site):
+    return len(site.calls('core_course_get_contents'))
+
+
+def test_reads_are_resent_after_transient_failures():
+    site, metrics = retry_site()
+    failing(site, 'core_course_get_contents',
+            unavailable(), TransportError('connection reset'))
+
+    contents = site.moodle.course(10).contents()
+
+    assert contents[0]['name'] == 'Week 1'
+    assert contents_calls(site) == 3
+    assert metrics.snapshot()['core_course_get_contents']['retries'] == 2
+
+
+def test_reads_give_up_after_the_last_attempt():
+    site, metrics = retry_site()
+    failing(site, 'core_course_get_contents',
+            *[TransportError('connection reset')] * 3)
+
+    with pytest.raises(TransportError):
+        site.moodle.course(10).contents()
+    assert contents_calls(site) == 3
+
+
+def test_writes_are_never_resent():
+    site, metrics = retry_site()
+    failing(site, 'core_course_delete_courses',
+            TransportError('connection reset'))
+
+    with pytest.raises(TransportError):
+        site.moodle.course(10).delete()
+
+    assert len(site.calls('core_course_delete_courses')) == 1
+    assert 10 in site.courses
+
+
+def test_moodle_exceptions_are_not_resent():
+    site, metrics = retry_site()
+
+    assert 'exception' in site.moodle.course(404).contents()
+    assert contents_calls(site) == 1
+
+
+def test_retry_after_is_honoured():
+    site, metrics = retry_site()
+    failing(site, 'core_course_get_contents', unavailable('0.05'))
+
+    start = time.monotonic()
+    site.moodle.course(10).contents()
+
+    assert time.monotonic() - start >= 0.05
+    assert contents_calls(site) == 2
+
+
+def test_backoff_is_capped():
+    retry = Retry(backoff=1, max_backoff=0.5)
+
+    assert all(retry.delay(tries) <= 0.5 for tries in range(1, 10))
+    assert retry.delay(1, unavailable('30')) == 0.5
+
+
+def test_slow_reads_are_hedged():
+    metrics = muddle.Metrics()
+    hedge = Hedge(delay=0.01)
+    site = FakeMoodle(hedge=hedge, metrics=metrics)
+    answer = site.transport.responses['core_course_get_contents']
+    stalled = threading.Event()
+
+    def slow_once(call):
+        if not stalled.is_set():
+            stalled.set()
+            time.sleep(0.5)
+        return answer(call)
+
+    site.transport.responses['core_course_get_contents'] = slow_once
+    start = time.monotonic()
+    site.moodle.course(1).contents()
+
+    assert time.monotonic() - start < 0.4
+    assert contents_calls(site) == 2
+    stats = metrics.snapshot()['core_course_get_contents']
+    assert (stats['hedges'], stats['hedges_won']) == (1, 1)
+    hedge.close()
+
+
+def test_hedging_waits_for_enough_latencies():
+    # One thread, so each call's latency is recorded before the next runs.
+    hedge = Hedge(min_samples=2, workers=1)
+
+    assert hedge.after('core_course_get_contents') is None
+    for _ in range(3):
+        hedge.call(lambda: None, 'core_course_get_contents')
+
+    assert hedge.after('core_course_get_contents') >= hedge.min_delay
+    hedge.close()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_singleflight
+-----------------------
+
+Identical reads made at the same time sharing one call.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import pytest
+
+import muddle
+from muddle.exceptions import TransportError
+from muddle.singleflight import SingleFlight
+from muddle.transport import MemoryTransport
+
+WAITERS = 8
+
+
+def blocking_site(answer, coalesce=True):
+    """ Returns a client whose contents calls wait for release to be set """
+
+    release = threading.Event()
+    arrived = threading.Semaphore(0)
+
+    def contents(call):
+        arrived.release()
+        release.wait(5)
+        return answer
+
+    transport = MemoryTransport({'core_course_get_contents': contents})
+    moodle = muddle.authenticate('token', 'http://moodle.example',
+                                 transport=transport, coalesce=coalesce,
+                                 metrics=muddle.Metrics())
+    return moodle, transport, release, arrived
+
+
+def wait_for_waiters(flight):
+    # The leader is in flight; give the others time to queue behind it.
+    for _ in range(500):
+        if flight.shared >= WAITERS - 1:
+            return
+        time.sleep(0.01)
+
+
+def test_identical_reads_share_one_call():
+    moodle, transport, release, arrived = blocking_site([{'id': 1}])
+
+    with ThreadPoolExecutor(WAITERS) as executor:
+        futures = [executor.submit(moodle.course(10).contents)
+                   for _ in range(WAITERS)]
+        assert arrived.acquire(timeout=5)
+        wait_for_waiters(moodle.flights)
+        release.set()
+        results = [future.result(timeout=5) for future in futures]
+
+    assert results == [[{'id': 1}]] * WAITERS
+    assert len(transport.calls) == 1
+    snapshot = moodle.metrics.snapshot()['core_course_get_contents']
+    assert snapshot['calls'] == 1
+    assert snapshot['coalesced'] == WAITERS - 1
+    assert len(moodle.flights) == 0
+
+
+def test_different_reads_are_not_shared():
+    moodle, transport, release, arrived = blocking_site([])
+    release.set()
+
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(lambda course_id: moodle.course(course_id)
+                          .contents(), range(4)))
+
+    assert len(transport.calls) == 4
+
+
+def test_reads_made_after_a_call_finishes_call_again():
+    moodle, transport, release, arrived = blocking_site([])
+    release.set()
+
+    moodle.course(10).contents()
+    moodle.course(10).contents()
+
+    assert len(transport.calls) == 2
+
+
+def test_coalescing_can_be_turned_off():
+    moodle, transport, release, arrived = blocking_site([], coalesce=False)
+    release.set()
+
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(lambda _: moodle.course(10).contents(), range(4)))
+
+    assert len(transport.calls) == 4
+
+
+def test_waiters_get_the_leaders_exception():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        release.wait(5)
+        raise TransportError('connection reset')
+
+    with ThreadPoolExecutor(WAITERS) as executor:
+        futures = [executor.submit(flight.do, 'key', fail)
+                   for _ in range(WAITERS)]
+        wait_for_waiters(flight)
+        release.set()
+        for future in futures:
+            with pytest.raises(TransportError):
+                future.result(timeout=5)
+
+    assert len(calls) == 1
+    assert len(flight) == 0
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_sites
+----------------
+
+Clients for many sites, with their calls shared fairly between workers.
+"""
+
+import threading
+import time
+
+import muddle
+from muddle.api import Category, Muddle
+
+from .fake import FakeMoodle
+
+
+def test_sites_leave_the_default_client_be():
+    tenant = FakeMoodle('http://tenant.example')
+    default = FakeMoodle().moodle
+
+    with muddle.Sites(workers=1) as sites:
+        client = sites.add('tenant', 'token', 'http://tenant.example',
+                           transport=tenant.transport)
+
+        assert Muddle.default is default
+        assert Category().api_url == default.api_url
+        assert client.api_url.startswith('http://tenant.example')
+
+
+def test_calls_run_against_each_sites_client():
+    first = FakeMoodle('http://a.example')
+    second = FakeMoodle('http://b.example')
+    first.add_category('A', id=5)
+    second.add_category('B', id=5)
+
+    with muddle.Sites(workers=2) as sites:
+        sites.add('a', 'token', 'http://a.example',
+                  transport=first.transport)
+        sites.add('b', 'token', 'http://b.example',
+                  transport=second.transport)
+        futures = sites.submit_all(
+            lambda moodle: moodle.category(5).details().json()[0]['name'])
+
+        assert dict((name, future.result())
+                    for name, future in futures.items()) == \
+            {'a': 'A', 'b': 'B'}
+
+
+def test_a_long_backlog_does_not_starve_other_sites():
+    busy = FakeMoodle('http://busy.example')
+    quiet = FakeMoodle('http://quiet.example')
+    order = []
+    started = threading.Event()
+
+    def call(moodle, name):
+        started.wait()
+        order.append(name)
+        time.sleep(0.001)
+
+    with muddle.Sites(workers=1) as sites:
+        sites.add('busy', 'token', 'http://busy.example',
+                  transport=busy.transport)
+        sites.add('quiet', 'token', 'http://quiet.example',
+                  transport=quiet.transport)
+        for _ in range(5):
+            sites.submit('busy', call, 'busy')
+        sites.submit('quiet', call, 'quiet')
+        started.set()
+
+    assert order.index('quiet') <= 2
+
+
+def test_calls_per_site_are_capped():
+    site = FakeMoodle()
+    running = [0, 0]
+    lock = threading.Lock()
+
+    def call(moodle):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+
+    with muddle.Sites(workers=8, per_site=2) as sites:
+        sites.add('site', 'token', 'http://moodle.example',
+                  transport=site.transport)
+        futures = [sites.submit('site', call) for _ in range(8)]
+
+    assert all(future.done() for future in futures)
+    assert running[1] == 2
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_stream
+-----------------
+
+Decoding JSON arrays that arrive split at arbitrary byte boundaries.
+"""
+
+import json
+
+import pytest
+
+from muddle.exceptions import MoodleError
+from muddle.stream import iter_json_array
+
+from .fake import FakeMoodle
+
+ELEMENTS = [
+    {'id': 1, 'name': 'Café ☕', 'modules': [{'url': 'a\\b', 'n': []}]},
+    {'id': 2, 'name': 'quote " and ] and } inside', 'summary': '[{,'},
+    [],
+    'a string',
+    3.5,
+    None,
+    {'id': 3, 'emoji': '\U0001f600', 'nested': {'deeper': [[1], [2, [3]]]}},
+]
+
+
+def split(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def test_elements_survive_every_split_point():
+    data = json.dumps(ELEMENTS, ensure_ascii=False).encode('utf-8')
+    for cut in range(len(data) + 1):
+        assert list(iter_json_array([data[:cut], data[cut:]])) == ELEMENTS
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64])
+def test_elements_survive_small_chunks(size):
+    data = json.dumps(ELEMENTS, ensure_ascii=False, indent=2).encode('utf-8')
+    assert list(iter_json_array(split(data, size))) == ELEMENTS
+
+
+def test_empty_array():
+    assert list(iter_json_array([b' \n', b'[', b' ', b']'])) == []
+
+
+def test_elements_are_yielded_before_the_array_ends():
+    def chunks():
+        yield b'[{"id": 1}, '
+        yield b'{"id": 2},'
+        raise AssertionError('read past what was needed')
+
+    elements = iter_json_array(chunks())
+    assert next(elements) == {'id': 1}
+    assert next(elements) == {'id': 2}
+
+
+def test_moodle_exception_is_raised():
+    data = json.dumps({'exception': 'moodle_exception',
+                       'errorcode': 'invalidtoken',
+                       'message': 'Invalid token'}).encode('utf-8')
+    with pytest.raises(MoodleError) as raised:
+        list(iter_json_array(split(data, 5)))
+    assert raised.value.errorcode == 'invalidtoken'
+
+
+def test_course_contents_are_streamed_a_section_at_a_time():
+    site = FakeMoodle()
+    course_id = site.add_course('Course', 'c1', site.add_category('A'))
+    sections = [{'id': n, 'section': n, 'name': 'Week ✓ %d' % n,
+                 'modules': [{'id': n * 10 + m, 'modname': 'page'}
+                             for m in range(3)]}
+                for n in range(4)]
+    site.contents[course_id] = sections
+
+    course = site.moodle.course(course_id)
+
+    assert list(course.iter_contents(chunk_size=5)) == sections
+    modules = list(course.iter_modules(chunk_size=5))
+    assert [module['id'] for section, module in modules] == \
+        [n * 10 + m for n in range(4) for m in range(3)]
+    assert all('modules' not in section for section, module in modules)
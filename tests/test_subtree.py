@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_subtree
+------------------
+
+Copying a category branch with its courses, and resuming a copy that
+failed part way from its checkpoint.
+"""
+
+import json
+
+import pytest
+
+from muddle.exceptions import TransportError
+
+from .fake import FakeMoodle
+
+
+def branch_site():
+    """ 10 > 11 > 12 and 10 > 13, with courses in 10, 11 and 12 """
+
+    site = FakeMoodle()
+    site.add_category('Science', id=10)
+    site.add_category('Physics', parent=10, id=11)
+    site.add_category('Quantum', parent=11, id=12)
+    site.add_category('Chemistry', parent=10, id=13)
+    site.add_course('Intro', 'intro', 10, id=20)
+    site.add_course('Mechanics', 'mech', 11, id=21)
+    site.add_course('Qubits', 'qubits', 12, id=22)
+    site.contents[22] = [{'id': 1, 'name': 'Week 1', 'modules': []}]
+    return site
+
+
+def fail_once(site, wsfunction, when):
+    """ Makes the first call to wsfunction that when accepts fail """
+
+    answer = site.transport.responses[wsfunction]
+    failed = []
+
+    def flaky(call):
+        if not failed and when(call):
+            failed.append(call)
+            return TransportError('connection reset')
+        return answer(call)
+
+    site.transport.responses[wsfunction] = flaky
+
+
+def copy(site, checkpoint=None):
+    return site.moodle.category(10).copy_subtree(0, ' 2025',
+                                                 checkpoint=checkpoint)
+
+
+def test_branch_is_copied_with_its_courses():
+    site = branch_site()
+
+    result = copy(site)
+
+    assert sorted(result.categories) == [10, 11, 12, 13]
+    for source, copied in result.categories.items():
+        assert site.categories[copied]['name'] == \
+            site.categories[source]['name']
+        parent = site.categories[source]['parent']
+        assert site.categories[copied]['parent'] == \
+            result.categories.get(parent, 0)
+    for source, copied in result.courses.items():
+        assert site.courses[copied]['shortname'] == \
+            site.courses[source]['shortname'] + ' 2025'
+        assert site.courses[copied]['categoryid'] == \
+            result.categories[site.courses[source]['categoryid']]
+    assert sorted(result.courses) == [20, 21, 22]
+    assert site.contents[result.courses[22]] == site.contents[22]
+    assert not result.failed
+    # A call per level.
+    assert len(site.calls('core_course_create_categories')) == 3
+
+
+def test_failed_courses_are_retried_on_resume(tmp_path):
+    checkpoint = str(tmp_path / 'copy.json')
+    site = branch_site()
+    fail_once(site, 'core_course_duplicate_course',
+              lambda call: call['courseid'] == 21)
+
+    first = copy(site, checkpoint)
+    assert list(first.failed) == [21]
+    assert sorted(first.courses) == [20, 22]
+
+    second = copy(site, checkpoint)
+
+    assert not second.failed
+    assert sorted(second.courses) == [20, 21, 22]
+    assert second.categories == first.categories
+    duplicated = [call['courseid']
+                  for call in site.calls('core_course_duplicate_course')]
+    assert sorted(duplicated) == [20, 21, 21, 22]
+    assert len(site.calls('core_course_create_categories')) == 3
+
+
+def test_categories_resume_from_the_level_that_failed(tmp_path):
+    checkpoint = str(tmp_path / 'copy.json')
+    site = branch_site()
+    fail_once(site, 'core_course_create_categories',
+              lambda call: call['categories[0][name]'] == 'Quantum')
+
+    with pytest.raises(TransportError):
+        copy(site, checkpoint)
+    with open(checkpoint) as f:
+        assert sorted(json.load(f)['categories']) == ['10', '11', '13']
+    assert site.calls('core_course_duplicate_course') == []
+
+    result = copy(site, checkpoint)
+
+    assert sorted(result.categories) == [10, 11, 12, 13]
+    names = sorted(category['name'] for category in site.categories.values())
+    assert names == sorted(['Science', 'Physics', 'Quantum', 'Chemistry'] * 2)
+
+
+def test_courses_copied_but_not_recorded_are_found(tmp_path):
+    checkpoint = str(tmp_path / 'copy.json')
+    site = branch_site()
+    copied = copy(site, checkpoint).courses[21]
+
+    # As if the run stopped after starting the duplicate of 21.
+    with open(checkpoint) as f:
+        state = json.load(f)
+    del state['courses']['21']
+    state['started'] = [21]
+    with open(checkpoint, 'w') as f:
+        json.dump(state, f)
+
+    result = copy(site, checkpoint)
+
+    assert result.courses[21] == copied
+    assert len(site.calls('core_course_duplicate_course')) == 3
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_sync
+---------------
+
+Fetching contents only for courses that changed, and reporting what did.
+"""
+
+import pytest
+
+from muddle.exceptions import TransportError
+
+from .fake import FakeMoodle
+
+
+def section(section_id, *module_ids):
+    return {'id': section_id, 'name': 'Section %d' % section_id,
+            'modules': [{'id': module_id, 'name': 'Module %d' % module_id}
+                        for module_id in module_ids]}
+
+
+def sync_site():
+    site = FakeMoodle()
+    category = site.add_category('Science')
+    for course_id in (10, 11, 12):
+        site.add_course('Course', 'c%d' % course_id, category, id=course_id)
+        site.contents[course_id] = [section(course_id * 10, course_id * 100)]
+    return site
+
+
+def fetched(site):
+    return sorted(call['courseid']
+                  for call in site.calls('core_course_get_contents'))
+
+
+def run(sync, course_ids=None):
+    return dict((diff.course_id, diff) for diff in sync.sync(course_ids))
+
+
+def test_first_sync_reports_everything():
+    site = sync_site()
+    sync = site.moodle.contents_sync()
+
+    diffs = run(sync)
+
+    assert sorted(diffs) == [10, 11, 12]
+    assert diffs[10].sections_added == [100]
+    assert diffs[10].modules_added == [1000]
+    # The front page has no contents.
+    assert fetched(site) == [1, 10, 11, 12]
+
+
+def test_unchanged_courses_are_not_fetched_again():
+    site = sync_site()
+    sync = site.moodle.contents_sync()
+    run(sync)
+    before = fetched(site)
+
+    assert run(sync) == {}
+    assert fetched(site) == before
+    assert len(site.calls('core_course_get_courses_by_field')) == 2
+
+
+def test_activity_changes_are_found_through_cacherev():
+    site = sync_site()
+    sync = site.moodle.contents_sync()
+    run(sync)
+
+    site.contents[11] = [dict(section(110, 1100, 1101),
+                              modules=[{'id': 1100, 'name': 'Renamed'},
+                                       {'id': 1101, 'name': 'New'}])]
+    site.touch(11)
+    diffs = run(sync)
+
+    assert list(diffs) == [11]
+    assert diffs[11].modules_added == [1101]
+    assert diffs[11].modules_modified == [1100]
+    assert diffs[11].sections_modified == [110]
+    assert fetched(site).count(11) == 2 and fetched(site).count(10) == 1
+
+
+def test_settings_changes_with_the_same_contents_are_silent():
+    site = sync_site()
+    sync = site.moodle.contents_sync()
+    run(sync)
+
+    site.courses[12]['timemodified'] += 1
+
+    assert run(sync) == {}
+    assert fetched(site).count(12) == 2
+    assert not sync.changed()[0]
+
+
+def test_deleted_courses_are_reported():
+    site = sync_site()
+    sync = site.moodle.contents_sync()
+    run(sync)
+
+    del site.courses[12]
+    diffs = run(sync)
+
+    assert list(diffs) == [12]
+    assert diffs[12].deleted
+    assert 12 not in sync.courses
+
+
+def test_failed_fetches_are_retried_next_sync():
+    site = sync_site()
+    contents = site.transport.responses['core_course_get_contents']
+    failing = [True]
+
+    def flaky(call):
+        if int(call['courseid']) == 11 and failing[0]:
+            return TransportError('connection reset')
+        return contents(call)
+
+    site.transport.responses['core_course_get_contents'] = flaky
+    sync = site.moodle.contents_sync()
+    diffs = run(sync)
+    assert isinstance(diffs[11].error, TransportError)
+
+    failing[0] = False
+    diffs = run(sync)
+
+    assert list(diffs) == [11]
+    assert diffs[11].modules_added == [1100]
+
+
+def test_state_is_saved_and_resumed(tmp_path):
+    path = str(tmp_path / 'state.json')
+    site = sync_site()
+    sync = site.moodle.contents_sync(path)
+    run(sync)
+    sync.save()
+    before = fetched(site)
+
+    site.touch(10)
+    resumed = site.moodle.contents_sync(path)
+
+    assert list(run(resumed)) == []
+    assert fetched(site) == sorted(before + [10])
+
+
+def test_a_course_whose_diff_raised_is_reported_again():
+    site = sync_site()
+    sync = site.moodle.contents_sync()
+
+    with pytest.raises(RuntimeError):
+        for diff in sync.sync([10, 11]):
+            raise RuntimeError('indexing failed')
+
+    assert sorted(run(sync, [10, 11])) == [10, 11]
+
+
+def test_only_the_courses_asked_for_are_synced():
+    site = sync_site()
+    sync = site.moodle.contents_sync()
+
+    assert list(run(sync, [11])) == [11]
+    assert fetched(site) == [11]
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_throttle
+-------------------
+
+Pacing calls by rate and concurrency, and adapting to the server.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from muddle.throttle import AdaptiveLimiter, Scheduler, TokenBucket
+from muddle.transport import Response
+
+from .fake import FakeMoodle
+
+
+def test_bucket_allows_a_burst_then_paces_calls():
+    bucket = TokenBucket(rate=100, burst=5)
+
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    burst = time.monotonic() - start
+    for _ in range(10):
+        bucket.acquire()
+    paced = time.monotonic() - start
+
+    assert burst < 0.02
+    # Ten more calls at 100 a second.
+    assert paced >= 0.09
+
+
+def test_limit_grows_with_successes_and_halves_on_failure():
+    limiter = AdaptiveLimiter(initial=4, maximum=6)
+    for _ in range(8):
+        limiter.acquire()
+        limiter.release(0.01)
+    assert 5.5 < limiter.limit <= 6
+
+    limiter.acquire()
+    limiter.release(0.01, ok=False)
+    limiter.acquire()
+    limiter.release(0.01, ok=False)
+
+    # Failures from one overload only cut the limit once.
+    assert 2.5 < limiter.limit < 3.5
+
+
+def test_slow_calls_count_as_failures():
+    limiter = AdaptiveLimiter(initial=8, latency_target=0.5)
+    limiter.acquire()
+    limiter.release(2.0)
+
+    assert limiter.limit == 4
+
+
+def test_limit_has_a_floor_and_a_ceiling():
+    limiter = AdaptiveLimiter(initial=2, minimum=2, maximum=3)
+    limiter.acquire()
+    limiter.release(0.01, ok=False)
+    assert limiter.limit == 2
+
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(0.01)
+    assert limiter.limit == 3
+
+
+def test_calls_in_flight_are_capped():
+    limiter = AdaptiveLimiter(initial=2, maximum=2)
+    site = FakeMoodle(scheduler=Scheduler(limiter=limiter))
+    course_id = site.add_course('Course', 'c1', site.add_category('A'))
+    in_flight = [0, 0]
+    lock = threading.Lock()
+
+    def contents(call):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+        return []
+
+    site.transport.responses['core_course_get_contents'] = contents
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda _: site.moodle._request(
+            'post', {'wsfunction': 'core_course_get_contents',
+                     'courseid': course_id}), range(16)))
+
+    assert in_flight[1] == 2
+    assert limiter.in_flight == 0
+
+
+def test_overloaded_responses_back_off():
+    limiter = AdaptiveLimiter(initial=8)
+    site = FakeMoodle(scheduler=Scheduler(limiter=limiter))
+    site.transport.responses['core_course_get_contents'] = \
+        Response(503, {}, content=b'')
+
+    site.moodle._request('post', {'wsfunction': 'core_course_get_contents',
+                                  'courseid': 1})
+
+    assert limiter.limit == 4
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""
+tests.test_transport
+--------------------
+
+The in-memory transport, and HTTP libraries staying unimported until a
+backend needs them.
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import muddle
+from muddle.exceptions import MoodleError, TransportTimeout
+from muddle.params import CREATE_COURSES
+from muddle.transport import MemoryTransport, Response
+
+from .fake import API_URL
+
+
+def test_canned_responses_are_returned_as_json():
+    transport = MemoryTransport({
+        'core_course_get_contents': [{'id': 1, 'modules': []}]})
+    moodle = muddle.authenticate('token', API_URL, transport=transport)
+
+    assert moodle.course(10).contents() == [{'id': 1, 'modules': []}]
+    call, = transport.calls
+    assert call['wsfunction'] == 'core_course_get_contents'
+    assert call['courseid'] == 10
+    assert call['wstoken'] == 'token'
+
+
+def test_callables_are_given_the_call():
+    transport = MemoryTransport({
+        'core_course_create_courses': lambda call: [
+            {'id': 5, 'shortname': call['courses[0][shortname]']}]})
+    moodle = muddle.authenticate('token', API_URL, transport=transport)
+
+    response = moodle.course().create('Course', 'course', 1)
+
+    assert response.json() == [{'id': 5, 'shortname': 'course'}]
+
+
+def test_exceptions_are_raised():
+    transport = MemoryTransport({
+        'core_course_get_contents': TransportTimeout('read timed out')})
+    moodle = muddle.authenticate('token', API_URL, transport=transport)
+
+    with pytest.raises(TransportTimeout):
+        moodle.course(10).contents()
+
+
+def test_responses_are_passed_through():
+    transport = MemoryTransport({
+        'core_course_get_contents': Response(503, {}, content=b'')})
+    moodle = muddle.authenticate('token', API_URL, transport=transport)
+
+    response = moodle._request('post', {'wsfunction':
+                                        'core_course_get_contents'})
+
+    assert response.status_code == 503
+
+
+def test_unknown_functions_get_moodles_exception():
+    moodle = muddle.authenticate('token', API_URL,
+                                 transport=MemoryTransport())
+
+    with pytest.raises(MoodleError) as raised:
+        list(moodle.course(10).iter_contents())
+    assert raised.value.errorcode == 'invalidrecord'
+
+
+def test_compressed_bodies_are_decoded():
+    transport = MemoryTransport({'core_course_create_courses': []})
+    moodle = muddle.authenticate('token', API_URL, transport=transport,
+                                 compress=True)
+    courses = [{'fullname': 'Course %d' % n, 'shortname': 'c%d' % n,
+                'categoryid': 1} for n in range(100)]
+
+    moodle._request('post', CREATE_COURSES.params(courses))
+
+    call, = transport.calls
+    assert call['courses[99][shortname]'] == 'c99'
+    assert call['wstoken'] == 'token'
+
+
+def test_importing_muddle_leaves_http_libraries_unimported():
+    code = ('import sys, muddle; '
+            'print(sorted(set(sys.modules) & '
+            '{"requests", "urllib3", "sqlite3", "asyncio"}))')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', code],
+                                     cwd=root, universal_newlines=True)
+    assert output.strip() == '[]'
+
+
+def test_parameters_are_sent_in_the_body():
+    transport = MemoryTransport({'core_course_get_contents': []})
+    requests = []
+    send = transport.request
+
+    def request(method, url, **kwargs):
+        requests.append((method, url, kwargs))
+        return send(method, url, **kwargs)
+
+    transport.request = request
+    moodle = muddle.authenticate('token', API_URL, transport=transport)
+    moodle.course(10).contents()
+
+    (method, url, kwargs), = requests
+    assert method == 'post'
+    assert '?' not in url and kwargs.get('params') is None
+    assert kwargs['data']['wstoken'] == 'token'